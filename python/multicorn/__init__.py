@@ -10,8 +10,11 @@ postgresql (usually, the system wide python installation).
 
 """
 
+import random
 import sys
+import time
 from collections import namedtuple
+from itertools import islice
 try:
     from collections import OrderedDict
 except ImportError:
@@ -140,10 +143,170 @@ class Qual(object):
         return hash((self.field_name, self.operator, self.value))
 
 
+class BoolQual(object):
+    """A BoolQual combines other quals with a boolean operator, in the
+    `quals_tree` given to :meth:`ForeignDataWrapper.execute`.
+
+    For example::
+
+        mycolumn > 3 OR othercolumn IS NULL
+        NOT (mycolumn = 1 AND othercolumn = 2)
+
+    Attributes:
+        operator (str): 'and', 'or' or 'not'.
+        quals (list): The combined :class:`Qual` and :class:`BoolQual`
+            instances. A 'not' has a single one.
+    """
+
+    def __init__(self, operator, quals):
+        self.operator = operator
+        self.quals = quals
+
+    def __repr__(self):
+        if self.operator == 'not':
+            return "NOT %s" % self.quals[0]
+        return "(%s)" % (" %s " % self.operator.upper()).join(
+            "%s" % qual for qual in self.quals)
+
+    def __eq__(self, other):
+        if isinstance(other, BoolQual):
+            return (self.operator == other.operator and
+                    self.quals == other.quals)
+        return False
+
+    def __hash__(self):
+        return hash((self.operator, tuple(self.quals)))
+
+
+class Column(object):
+    """A reference to a column of the foreign table, in the `quals_tree`.
+
+    It is found as the value of a :class:`Qual` comparing two columns, or
+    as an argument of a :class:`Function`.
+
+    Attributes:
+        name (str): The name of the column.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "%s" % self.name
+
+    def __eq__(self, other):
+        if isinstance(other, Column):
+            return self.name == other.name
+        return False
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class Function(object):
+    """A function applied to columns, in the `quals_tree`.
+
+    It is found in place of the field name or the value of a :class:`Qual`,
+    for example in::
+
+        lower(mycolumn) = 'a'
+
+    Operators used inside such an expression are represented as functions
+    named after the operator, such as '+'.
+
+    Attributes:
+        name (str): The name of the function, or of the operator.
+        args (list): The arguments of the function: :class:`Column`,
+            :class:`Function` instances, or constant values.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __repr__(self):
+        return "%s(%s)" % (self.name, ", ".join("%s" % arg
+                                                for arg in self.args))
+
+    def __eq__(self, other):
+        if isinstance(other, Function):
+            return self.name == other.name and self.args == other.args
+        return False
+
+    def __hash__(self):
+        return hash((self.name, tuple(self.args)))
 
 
 
 
+
+
+class ColumnBatch(object):
+    """A ColumnBatch holds a batch of rows, stored column by column.
+
+    It can be returned in place of a row from :meth:`ForeignDataWrapper.execute`
+    (or in place of a batch from :meth:`ForeignDataWrapper.execute_batches`).
+    Wrappers building their data in arrays can this way avoid creating a
+    python object for every single row.
+
+    Attributes:
+        columns (dict): A mapping of column names to their values. Values
+            exposing a one-dimensional, contiguous buffer of integers, floats
+            or booleans (such as :class:`array.array`, :class:`memoryview`
+            or numpy arrays) are read directly from memory when the column
+            type allows it. Any other sequence is converted item by item.
+            Missing columns are NULL.
+        nulls (dict): A mapping of column names to a null mask: a sequence,
+            or a buffer of one byte per row, with a true value for every
+            NULL row.
+        length (int): The number of rows in the batch. Defaults to the
+            length of the first column.
+    """
+
+    def __init__(self, columns, nulls=None, length=None):
+        self.columns = columns
+        self.nulls = nulls or {}
+        if length is None:
+            length = len(next(iter(columns.values()))) if columns else 0
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "ColumnBatch(%s, length=%d)" % (sorted(self.columns),
+                                               self.length)
+
+
+class JoinedTable(object):
+    """One of the two foreign tables of a join computed by the FDW.
+
+    See :meth:`ForeignDataWrapper.can_join`.
+
+    Attributes:
+        instance (ForeignDataWrapper): The wrapper instance of the table.
+        options (dict): The options of the table, as given to the wrapper.
+        columns (dict): A mapping of the column names to their
+            :class:`ColumnDefinition`.
+        quals (list): A list of :class:`Qual` instances, from the where
+            clause of the query, restricting the rows of this table. In
+            :meth:`ForeignDataWrapper.can_join`, the value of the quals
+            comparing a column to a parameter is :data:`UNBOUND`.
+        targets (list): The names of the columns needed from this table, in
+            the order in which they must be returned.
+    """
+
+    def __init__(self, instance, options, columns, quals, targets):
+        self.instance = instance
+        self.options = options
+        self.columns = columns
+        self.quals = quals
+        self.targets = targets
+
+    def __repr__(self):
+        return "JoinedTable(%s, %s)" % (self.quals, self.targets)
+
+
 class ForeignDataWrapper(object):
     """Base class for all foreign data wrapper instances.
 
@@ -153,6 +316,75 @@ class ForeignDataWrapper(object):
 
     _startup_cost = 20
 
+    #: Set this to True to have rows fetched by batches, through the
+    #: :meth:`execute_batches` method instead of :meth:`execute`.
+    _batch_execute = False
+
+    #: The number of rows grouped in a batch by the default
+    #: :meth:`execute_batches` implementation.
+    _batch_size = 1000
+
+    #: Set this to True to receive the ordered list of needed columns as the
+    #: `projection` keyword argument of :meth:`execute`. Rows returned as
+    #: sequences must then hold exactly those columns, in that order.
+    _projected_rows = False
+
+    #: The number of worker processes to plan for a parallel scan. Parallel
+    #: scans are only considered if this is greater than zero, in which case
+    #: the wrapper must be safe to use from several backends at once. See
+    #: :meth:`get_partitions`.
+    _parallel_workers = 0
+
+    #: Set this to True if the scan can not be split in partitions. The
+    #: python iterator is then only run by the backend leading a parallel
+    #: scan, which hands the rows out to the workers as they ask for them.
+    #: This lets the work done above the scan (joins, aggregates...) be
+    #: shared between the workers. Such scans are only run in parallel on
+    #: PostgreSQL 11 and later.
+    _single_producer = False
+
+    #: Set this to True to modify every row matched by an UPDATE or a
+    #: DELETE at once, through :meth:`update_where` and :meth:`delete_where`,
+    #: on PostgreSQL 9.6 and later. This is only done when every clause of
+    #: the WHERE can be expressed as a :class:`Qual`, the new values are
+    #: constants or parameters, and there is no RETURNING clause.
+    _direct_modify = False
+
+    #: The number of seconds for which the results of :meth:`get_rel_size`,
+    #: :meth:`get_path_keys` and :meth:`can_sort` are cached. They are cached
+    #: by the shape of their arguments: the values of the quals are not part
+    #: of the cache key, only their columns, operators and types. Zero
+    #: disables the cache. See :meth:`invalidate_plan_cache`.
+    _plan_cache_ttl = 0
+
+    #: The maximum number of results kept in that cache.
+    _plan_cache_size = 256
+
+    #: Set this to True to receive every clause of the WHERE as a tree, in
+    #: the `quals_tree` keyword argument of :meth:`execute`, including the
+    #: ones that can not be expressed as a simple :class:`Qual`.
+    _structured_quals = False
+
+    #: Set this to True to have the rows converted in two steps. The columns
+    #: used by the clauses PostgreSQL checks itself are converted first, and
+    #: the other ones only for the rows matching those clauses. The values
+    #: of a row may then also be callables without arguments, only called
+    #: if the column is converted.
+    _late_materialization = False
+
+    #: Set this to True to cache the rows of a parameterized scan (the inner
+    #: side of a nested loop, see :meth:`get_path_keys`) for each set of
+    #: parameter values. The rows are fetched through :meth:`execute` once,
+    #: and every later outer row with the same values is joined without
+    #: another remote request, until the end of the scan. On PostgreSQL 14
+    #: and later, a Memoize node may already cache them above the scan.
+    _cache_lookups = False
+
+    #: The number of sets of parameter values whose rows are cached by a
+    #: scan with `_cache_lookups`. The least recently used one is dropped
+    #: first.
+    _lookup_cache_size = 100
+
     def __init__(self, fdw_options, fdw_columns):
         """The foreign data wrapper is initialized on the first query.
 
@@ -186,6 +418,37 @@ class ForeignDataWrapper(object):
         """
         return (100000000, len(columns) * 100)
 
+    def analyze(self, sample_size, columns):
+        """
+        Method called by ANALYZE to gather the statistics of the foreign
+        table.
+
+        The default implementation reads every row from :meth:`execute`,
+        without any qual, and keeps a uniform random sample of them (reservoir
+        sampling). Implementations able to sample the rows, or to count them,
+        on the remote side should override it.
+
+        Args:
+            sample_size (int): The maximum number of rows in the sample.
+            columns (list): The names of every column of the table.
+
+        Returns:
+            A tuple of the form (total_number_of_rows, sample_rows), where the
+            sample rows are sequences or dictionaries, as returned by
+            :meth:`execute`.
+        """
+        sample = []
+        total = 0
+        for row in self.execute([], columns) or ():
+            if total < sample_size:
+                sample.append(row)
+            else:
+                index = random.randint(0, total)
+                if index < sample_size:
+                    sample[index] = row
+            total += 1
+        return (total, sample)
+
     def can_sort(self, sortkeys):
         """
         Method called from the planner to ask the FDW what are the sorts it can
@@ -212,6 +475,48 @@ class ForeignDataWrapper(object):
         """
         return []
 
+    def can_enforce_quals(self, quals):
+        """
+        Method called from the planner to ask the FDW which quals are
+        enforced by :meth:`execute`: every row it returns satisfies them.
+        PostgreSQL then does not check them again on each row.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances, one for each
+                clause of the scan. The value of the quals comparing a
+                column to a value only known at execution time (a
+                parameter, or a column of the outer table of a nested loop)
+                is :data:`UNBOUND`. If it is NULL, :meth:`execute` is not
+                called, since no row can match.
+
+        Return:
+            The list of the quals that are enforced.
+        """
+        return []
+
+    def can_limit(self, quals, sortkeys):
+        """Tell whether the LIMIT and OFFSET of a query can be applied by this
+        FDW.
+
+        This method is called while planning a query reading a single foreign
+        table, with a LIMIT or an OFFSET known at plan time, on PostgreSQL 12
+        and later. It is only called when every clause of the WHERE can be
+        expressed as a :class:`Qual`. If it returns True, :meth:`execute`
+        receives the `limit` and `offset` keyword arguments, and PostgreSQL
+        neither rechecks the quals nor counts the rows.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances, from the where
+                clause of the query. The value of the quals comparing a
+                column to a parameter is :data:`UNBOUND`.
+            sortkeys (list): A list of :class:`SortKey`, as accepted by
+                :meth:`can_sort`, in which the rows must be returned.
+
+        Returns:
+            A boolean. The default implementation returns False.
+        """
+        return False
+
     def get_path_keys(self):
         u"""
         Method called from the planner to add additional Path to the planner.
@@ -269,6 +574,32 @@ class ForeignDataWrapper(object):
         """
         return []
 
+    def invalidate_plan_cache(self):
+        """Forget the cached results of the planning methods.
+
+        Wrappers setting :attr:`_plan_cache_ttl` should call it whenever the
+        remote data changes enough to alter their estimates.
+        """
+        self.__dict__.pop('_plan_cache', None)
+
+    def _get_plan_cache(self, key):
+        """Returns the cached planning result for the key, or None."""
+        entry = self.__dict__.get('_plan_cache', {}).get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._plan_cache[key]
+            return None
+        return entry[1]
+
+    def _set_plan_cache(self, key, value):
+        """Cache a planning result, evicting the oldest ones if full."""
+        cache = self.__dict__.setdefault('_plan_cache', OrderedDict())
+        cache.pop(key, None)
+        cache[key] = (time.time() + self._plan_cache_ttl, value)
+        while len(cache) > self._plan_cache_size:
+            cache.popitem(last=False)
+
     def explain(self, quals, columns, sortkeys=None, verbose=False):
         """Hook called on explain.
 
@@ -303,6 +634,19 @@ class ForeignDataWrapper(object):
         implement this method as a generator to prevent loading the whole
         dataset in memory.
 
+        If the `prefetch_rows` option is set on the foreign table (or its
+        server), the returned iterator is run in a background thread, which
+        reads up to that many rows in advance while the backend runs python
+        code or waits for the next row (see
+        :class:`multicorn.background.BackgroundIterator`).
+        The messages it logs through
+        :func:`multicorn.utils.log_to_postgres` are emitted when PostgreSQL
+        reads the next row, and the errors it logs or raises are reported as
+        usual. It must not call any other PostgreSQL function.
+        The iterator then runs while the backend calls the other methods of
+        the wrapper, such as :meth:`rollback`, or :meth:`execute` for another
+        scan: setting that option requires them to be thread-safe.
+
 
         Args:
             quals (list): A list of :class:`Qual` instances, containing the basic
@@ -313,19 +657,231 @@ class ForeignDataWrapper(object):
                 should be in the sequence.
             sortkeys (list): A list of :class:`SortKey`
                 that the FDW said it can enforce.
+            projection (list): Only given if the `_projected_rows` class
+                attribute is True: the names of the needed columns, in the
+                order they must appear in sequences.
+            limit (int): Only given if :meth:`can_limit` returned True: the
+                maximum number of rows to return, or None. Every qual must
+                then be enforced, and the rows sorted, before skipping
+                `offset` rows and returning at most `limit` of the others.
+            offset (int): Only given along with `limit`: the number of rows
+                to skip.
+            quals_tree (list): Only given if the `_structured_quals` class
+                attribute is True: a :class:`Qual` or :class:`BoolQual` for
+                each clause of the WHERE that can be represented, which must
+                all be true for a row to be returned. Unlike `quals`, it
+                holds disjunctions, negations, comparisons between columns
+                (the value is then a :class:`Column`) and comparisons of
+                expressions (the field name or the value is then a
+                :class:`Function`). Volatile expressions are left out.
 
         Returns:
             An iterable of python objects which can be converted back to PostgreSQL.
             Currently, such objects are:
             - sequences containing exactly as much columns as the
-            underlying tables
+            underlying tables, or as the projection if one was given
             - dictionaries mapping column names to their values.
+            - :class:`ColumnBatch` instances, holding several rows at once.
             If the sortkeys wasn't empty, the FDW has to return the data in the
             expected order.
+            If the `_late_materialization` class attribute is True, the values
+            of sequences and dictionaries may be callables without arguments,
+            returning the actual value when called.
 
         """
         pass
 
+    def execute_batches(self, quals, columns, sortkeys=None, **kwargs):
+        """Execute a query in the foreign data wrapper, returning batches of
+        rows.
+
+        This method is called instead of :meth:`execute` if the
+        `_batch_execute` class attribute is set to True. Yielding whole
+        batches saves a round-trip between PostgreSQL and python for every
+        single row, which matters when the remote system already returns
+        rows in chunks (for example a database cursor's `fetchmany`).
+
+        The default implementation groups the rows returned by
+        :meth:`execute` in lists of `_batch_size` rows.
+
+        Args:
+            quals (list): see :meth:`execute`
+            columns (list): see :meth:`execute`
+            sortkeys (list): see :meth:`execute`
+            projection (list): see :meth:`execute`
+
+        Returns:
+            An iterable of batches, each batch being a list or a tuple of
+            rows, in any of the formats accepted as the result of
+            :meth:`execute`.
+        """
+        if sortkeys:
+            kwargs['sortkeys'] = sortkeys
+        iterable = self.execute(quals, columns, **kwargs)
+        if iterable is None:
+            return
+        iterator = iter(iterable)
+        while True:
+            batch = list(islice(iterator, self._batch_size))
+            if not batch:
+                break
+            yield batch
+
+    def _lookup(self, lookups, quals, columns):
+        """Returns the rows matching the quals of a parameterized scan.
+
+        The rows are fetched through :meth:`execute` the first time the quals
+        are seen, and kept in the `lookups` OrderedDict of the scan, which
+        holds at most `_lookup_cache_size` of them. Quals whose values cannot
+        be hashed are executed without caching.
+        """
+        key = tuple((qual.field_name, qual.operator, _freeze(qual.value))
+                    for qual in quals)
+        try:
+            hash(key)
+        except TypeError:
+            return self.execute(quals, columns)
+        rows = lookups.pop(key, None)
+        if rows is None:
+            rows = list(self.execute(quals, columns))
+            if lookups and len(lookups) >= self._lookup_cache_size:
+                lookups.popitem(last=False)
+        lookups[key] = rows
+        return rows
+
+    def get_partitions(self, quals, columns):
+        """Split a parallel scan in partitions.
+
+        This method is called once, in the backend leading a parallel scan,
+        if the `_parallel_workers` class attribute is set. Each partition is
+        then handed out to the first process (the leader or one of the
+        workers) asking for more rows, which scans it through
+        :meth:`execute_partition`. Making more partitions than workers helps
+        in spreading the load evenly.
+
+        The partitions are pickled to be sent to the workers.
+
+        Args:
+            quals (list): see :meth:`execute`
+            columns (list): see :meth:`execute`
+
+        Returns:
+            A list of picklable objects, each of them describing a part of the
+            result set (a file name, a range of keys...). The default
+            implementation returns a single partition, covering the whole
+            table.
+        """
+        return [None]
+
+    def execute_partition(self, partition, quals, columns, **kwargs):
+        """Execute a query for a single partition of a parallel scan.
+
+        Args:
+            partition: one of the partitions returned by
+                :meth:`get_partitions`.
+            quals (list): see :meth:`execute`
+            columns (list): see :meth:`execute`
+            projection (list): see :meth:`execute`
+
+        Returns:
+            An iterable of rows, like :meth:`execute`. The rows from every
+            partition make up the result set of the scan. The default
+            implementation calls :meth:`execute`.
+        """
+        return self.execute(quals, columns, **kwargs)
+
+    def can_aggregate(self, group_by, aggregates, quals):
+        """Tell whether an aggregation can be computed by this FDW.
+
+        This method is called while planning a query which only aggregates
+        rows of this foreign table, on PostgreSQL 9.6 and later. If it
+        returns True, :meth:`execute_aggregate` is called instead of
+        :meth:`execute`, and PostgreSQL does not see the individual rows.
+
+        Only the count, sum, min, max and avg functions, without DISTINCT,
+        ORDER BY or FILTER, are pushed down, and only when every clause of
+        the WHERE can be expressed as a :class:`Qual`, the grouping keys are
+        plain columns and there is no HAVING clause.
+
+        Args:
+            group_by (list): the names of the columns in the GROUP BY clause.
+            aggregates (list): the aggregates to compute, as (function,
+                column) tuples. The column is None for count(*).
+            quals (list): A list of :class:`Qual` instances, from the where
+                clause of the query. The value of the quals comparing a
+                column to a parameter is :data:`UNBOUND`.
+
+        Returns:
+            A boolean. The default implementation returns False.
+        """
+        return False
+
+    def execute_aggregate(self, group_by, aggregates, quals):
+        """Compute an aggregation accepted by :meth:`can_aggregate`.
+
+        Since PostgreSQL does not check them, every qual must be enforced.
+
+        Args:
+            group_by (list): see :meth:`can_aggregate`
+            aggregates (list): see :meth:`can_aggregate`
+            quals (list): see :meth:`execute`
+
+        Returns:
+            An iterable of sequences, one for each group, holding the values
+            of the grouping columns followed by the values of the aggregates,
+            in order. Without a GROUP BY clause, a single sequence must be
+            returned.
+        """
+        raise NotImplementedError("This FDW does not support aggregates")
+
+    @classmethod
+    def can_join(cls, left, right, join_type, join_quals):
+        """Tell whether a join between two foreign tables can be computed by
+        this FDW.
+
+        This method is called while planning a SELECT query joining two
+        foreign tables of the same server and user mapping, both using this
+        class, on PostgreSQL 9.6 and later. If it returns True,
+        :meth:`execute_join` is called instead of scanning both tables.
+
+        The join is only pushed down when every clause of the WHERE on each
+        table can be expressed as a :class:`Qual`, and every join clause
+        compares a column of each table.
+
+        Args:
+            left (JoinedTable): the outer table of the join.
+            right (JoinedTable): the inner table of the join.
+            join_type (str): one of 'inner', 'left', 'right' or 'full'.
+            join_quals (list): the join clauses, as (left column, operator,
+                right column) tuples. Every one of them must hold for a pair
+                of rows to be joined.
+
+        Returns:
+            A boolean. The default implementation returns False.
+        """
+        return False
+
+    @classmethod
+    def execute_join(cls, left, right, join_type, join_quals):
+        """Compute a join accepted by :meth:`can_join`.
+
+        Since PostgreSQL does not check them, the quals of both tables and
+        the join clauses must be enforced.
+
+        Args:
+            left (JoinedTable): see :meth:`can_join`
+            right (JoinedTable): see :meth:`can_join`
+            join_type (str): see :meth:`can_join`
+            join_quals (list): see :meth:`can_join`
+
+        Returns:
+            An iterable of sequences, one for each joined row, holding the
+            values of the `targets` of the left table followed by those of
+            the right table. The values of the missing side of an outer join
+            are None.
+        """
+        raise NotImplementedError("This FDW does not support joins")
+
     @property
     def rowid_column(self):
         """
@@ -382,6 +938,41 @@ class ForeignDataWrapper(object):
         """
         raise NotImplementedError("This FDW does not support the writable API")
 
+    def update_where(self, quals, newvalues):
+        """
+        Update every tuple matching the quals to the ''newvalues''.
+
+        This method is called instead of :meth:`update` when the
+        `_direct_modify` class attribute is set, and the UPDATE can be
+        modified directly. Since the rows are not fetched by PostgreSQL,
+        every qual must be enforced.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances, from the where
+                clause of the query.
+            newvalues (dict): a dictionary mapping the names of the updated
+                columns to their new values.
+        Returns:
+            The number of updated rows.
+        """
+        raise NotImplementedError("This FDW does not support direct "
+                                  "modifications")
+
+    def delete_where(self, quals):
+        """
+        Delete every tuple matching the quals.
+
+        See :meth:`update_where`.
+
+        Args:
+            quals (list): A list of :class:`Qual` instances, from the where
+                clause of the query.
+        Returns:
+            The number of deleted rows.
+        """
+        raise NotImplementedError("This FDW does not support direct "
+                                  "modifications")
+
     def pre_commit(self):
         """
         Hook called just before a commit is issued, on PostgreSQL >=9.3.
@@ -414,6 +1005,22 @@ class ForeignDataWrapper(object):
         """
         pass
 
+    def get_scan_stats(self):
+        """
+        Hook called by EXPLAIN ANALYZE once a scan or a modification has
+        run, and before :py:meth:`end_scan` or :py:meth:`end_modify`.
+
+        The statistics returned are shown along with the ones gathered by
+        multicorn, such as the time spent in python, and can describe what
+        multicorn cannot see: the round trips to the remote source, or the
+        bytes received from it.
+
+        Returns:
+            A dict (or a sequence of pairs) mapping the names of the
+            statistics to their values. They are shown sorted by name.
+        """
+        return {}
+
     def begin(self, serializable):
         """
         Hook called at the beginning of a transaction.
@@ -558,6 +1165,18 @@ def dict_to_optionstring(options):
         for key, value in sorted(options.items()))
 
 
+def _freeze(value):
+    """Returns a hashable version of a qual value, converting lists, sets and
+    dicts (json and jsonb values)."""
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(item)) for key, item in value.items())
+    return value
+
+
 class ColumnDefinition(object):
     """
     Definition of Foreign Table Column.
@@ -0,0 +1,170 @@
+"""
+Helpers to run the iterator returned by a foreign data wrapper in a
+background thread, so that fetching rows from a remote source overlaps with
+the work done by PostgreSQL.
+
+The background thread never calls into PostgreSQL: it only runs the
+wrapper's own code, and hands the rows out through a queue. The messages it
+logs through :func:`multicorn.utils.log_to_postgres` are emitted by the
+backend when it reads the next row.
+"""
+import errno
+import fcntl
+import os
+import sys
+import threading
+import time
+import weakref
+
+from .utils import DeferredError, emit_deferred_logs
+
+try:
+    import queue
+except ImportError:
+    # Python2
+    import Queue as queue
+
+
+#: The background iterators which have not been closed yet.
+_running = weakref.WeakSet()
+
+#: The number of seconds :func:`close_all` waits for the threads to stop.
+ABORT_TIMEOUT = 5
+
+
+def close_all(timeout=ABORT_TIMEOUT):
+    """Close every background iterator, and wait for their threads.
+
+    This is called when a transaction is aborted, since the scans interrupted
+    by an error are never ended, before the wrappers roll back. The threads
+    are given at most `timeout` seconds in all to stop: one still waiting
+    for its iterable after that is left running.
+    """
+    deadline = time.time() + timeout
+    iterators = list(_running)
+    for iterator in iterators:
+        iterator.close()
+    for iterator in iterators:
+        iterator.join(max(0, deadline - time.time()))
+
+
+class BackgroundIterator(object):
+    """Iterate over an iterable in a background thread.
+
+    The rows are put in a queue as soon as they are produced, and read from
+    it by PostgreSQL, either by iterating over this object (which blocks
+    until a row is available), or by polling :meth:`ready`.
+
+    A byte is written to a pipe for every row put in the queue, so that
+    PostgreSQL can wait for rows on the file descriptor returned by
+    :meth:`fileno`.
+
+    An exception raised by the iterable is raised again, in the backend, when
+    the row which should have followed it is read. An error logged by the
+    iterable is then reported as if it had been logged by the backend.
+
+    Attributes:
+        maxsize (int): the maximum number of rows read in advance. Zero means
+            that the whole result set may be buffered.
+    """
+
+    _ROW, _END, _ERROR = range(3)
+
+    def __init__(self, iterable, maxsize=0):
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._finished = False
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._thread = threading.Thread(target=self._run, args=(iterable,))
+        self._thread.daemon = True
+        self._thread.start()
+        _running.add(self)
+
+    def _put(self, kind, value):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put((kind, value), timeout=0.1)
+            except queue.Full:
+                continue
+            try:
+                os.write(self._write_fd, b'x')
+            except OSError as e:
+                # The pipe is either full, in which case the reader has
+                # already been woken up, or closed by the reader.
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                   errno.EPIPE):
+                    raise
+            return True
+        return False
+
+    def _run(self, iterable):
+        try:
+            for row in iterable:
+                if not self._put(self._ROW, row):
+                    return
+        except Exception:
+            self._put(self._ERROR, sys.exc_info()[1])
+        else:
+            self._put(self._END, None)
+        finally:
+            os.close(self._write_fd)
+
+    def fileno(self):
+        """Returns a file descriptor which is readable once rows are ready."""
+        return self._read_fd
+
+    def ready(self):
+        """Returns True if the next row can be read without blocking."""
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        return self._finished or not self._queue.empty()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        kind, value = self._queue.get()
+        emit_deferred_logs()
+        if kind == self._ROW:
+            return value
+        self._finished = True
+        if kind == self._ERROR:
+            if isinstance(value, DeferredError):
+                value.report()
+            raise value
+        raise StopIteration
+
+    next = __next__
+
+    def close(self):
+        """Stop the background thread, and release the pipe.
+
+        The thread stops once the row it is waiting for has been produced.
+        """
+        if self._read_fd is None:
+            return
+        self._stopped.set()
+        self._finished = True
+        os.close(self._read_fd)
+        self._read_fd = None
+        _running.discard(self)
+
+    def join(self, timeout=None):
+        """Wait at most `timeout` seconds for the thread of a closed iterator
+        to stop.
+
+        Returns:
+            True if the thread has stopped.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -17,3 +17,27 @@ try:
 except TypeError:
     # Python3
     bytes_  = lambda x: bytes(x, 'utf8')
+
+try:
+    from datetime import timezone
+    utc = timezone.utc
+except ImportError:
+    # Python2
+    from datetime import timedelta, tzinfo
+
+    class _UTC(tzinfo):
+        """The UTC time zone, which python 2 lacks."""
+
+        def utcoffset(self, dt):
+            return timedelta(0)
+
+        def tzname(self, dt):
+            return 'UTC'
+
+        def dst(self, dt):
+            return timedelta(0)
+
+        def __repr__(self):
+            return 'datetime.timezone.utc'
+
+    utc = _UTC()
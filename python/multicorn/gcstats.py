@@ -0,0 +1,40 @@
+"""
+Count the python garbage collections, and the time they pause the backend,
+for the statistics shown by EXPLAIN ANALYZE.
+
+The collections are only counted once a scan asked for them, through a
+callback of the gc module, which python 2 does not have.
+"""
+import gc
+import time
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+#: The number of collections, and their total time in milliseconds.
+_collections = 0
+_time = 0.0
+_started = None
+
+
+def _callback(phase, info):
+    global _collections, _time, _started
+    if phase == 'start':
+        _started = _clock()
+    elif _started is not None:
+        _collections += 1
+        _time += (_clock() - _started) * 1000
+        _started = None
+
+
+def snapshot():
+    """Return the number of collections and their total time so far, or None
+    if they cannot be counted.
+
+    The first call starts counting them.
+    """
+    callbacks = getattr(gc, 'callbacks', None)
+    if callbacks is None:
+        return None
+    if _callback not in callbacks:
+        callbacks.append(_callback)
+    return (_collections, _time)
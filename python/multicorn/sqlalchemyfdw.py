@@ -73,6 +73,12 @@ Other options
 ``schema``
   The schema in which this table resides on the remote side
 
+``direct_modify``
+  Set it to 'true' to run an UPDATE or a DELETE as a single remote statement,
+  when PostgreSQL allows it. The statement then fails if one of its
+  conditions can not be translated for the remote database. This is only
+  done for remote PostgreSQL databases.
+
 When defining the table, the local column names will be used to retrieve the
 remote column data.
 Moreover, the local column types will be used to interpret the results in the
@@ -93,6 +99,13 @@ What does it do to reduce the amount of fetched data ?
     - NOT IN clauses, != ALL (array)
 - the set of needed columns is pushed to the remote_side, and only those columns
   will be fetched.
+- joins between two tables sharing the same remote PostgreSQL database are
+  run by it, on PostgreSQL 9.6 and later, if every qual and join clause uses
+  one of the operators above.
+- when the remote database is also PostgreSQL, the pushed quals are not
+  checked again by the local one, on PostgreSQL 9.5 and later, except the
+  ones ordering or matching strings, which the remote database may do with
+  another collation.
 
 Sort push-down support
 ----------------------
@@ -150,11 +163,11 @@ such as pymysql):
 
 """
 
-from . import ForeignDataWrapper, TableDefinition, ColumnDefinition
+from . import ForeignDataWrapper, TableDefinition, ColumnDefinition, UNBOUND
 from .utils import log_to_postgres, ERROR, WARNING, DEBUG
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import make_url, URL
-from sqlalchemy.sql import select, operators as sqlops, and_
+from sqlalchemy.sql import select, operators as sqlops, and_, func, true
 from sqlalchemy.sql.expression import nullsfirst, nullslast
 
 # Handle the sqlalchemy 0.8 / 0.9 changes
@@ -224,6 +237,9 @@ OPERATORS = {
     ('<>', False): not_(sqlops.in_op)
 }
 
+# The operators comparing strings the same way whatever their collation.
+COLLATION_FREE_OPERATORS = ('=', '<>', ('=', True), ('<>', False))
+
 def basic_converter(new_type):
     def converter(c):
         old_args = c.type.__dict__
@@ -273,6 +289,9 @@ class SqlAlchemyFdw(ForeignDataWrapper):
 
     """
 
+    _batch_execute = True
+    _projected_rows = True
+
     def __init__(self, fdw_options, fdw_columns):
         super(SqlAlchemyFdw, self).__init__(fdw_options, fdw_columns)
         if 'tablename' not in fdw_options:
@@ -291,6 +310,10 @@ class SqlAlchemyFdw(ForeignDataWrapper):
         self.transaction = None
         self._connection = None
         self._row_id_column = fdw_options.get('primary_key', None)
+        # Other databases may compare values differently, and modify other
+        # rows than PostgreSQL would (see can_enforce_quals).
+        self._direct_modify = (fdw_options.get('direct_modify') == 'true' and
+                               self.engine.dialect.name == 'postgresql')
 
 
 
@@ -321,12 +344,44 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             return []
         return sortkeys
 
+    def _filters_like_postgres(self, qual):
+        """
+        Whether the remote database filters the rows on a qual exactly as
+        PostgreSQL would. Other databases may compare values differently,
+        for example ignoring the case of strings. Strings are only compared
+        for equality, since the remote collation may order them differently.
+        """
+        if (self.engine.dialect.name != 'postgresql' or
+                qual.operator not in OPERATORS):
+            return False
+        column_type = self.table.c[qual.field_name].type
+        if isinstance(column_type, ARRAY):
+            column_type = column_type.item_type
+        return (qual.operator in COLLATION_FREE_OPERATORS or
+                not isinstance(column_type, sqltypes.String))
+
+    def can_enforce_quals(self, quals):
+        """
+        The quals applied by a remote PostgreSQL database are not checked
+        again.
+        """
+        return [qual for qual in quals if self._filters_like_postgres(qual)]
+
+    def can_limit(self, quals, sortkeys):
+        """
+        The limit is applied by the remote database if it filters the rows
+        on every qual as PostgreSQL would, since they must all be part of the
+        query.
+        """
+        return all(self._filters_like_postgres(qual) for qual in quals)
+
     def explain(self, quals, columns, sortkeys=None, verbose=False):
         sortkeys = sortkeys or []
         statement = self._build_statement(quals, columns, sortkeys)
         return [str(statement)]
 
-    def _build_statement(self, quals, columns, sortkeys):
+    def _build_statement(self, quals, columns, sortkeys, limit=None,
+                         offset=None):
         statement = select([self.table])
         clauses = []
         for qual in quals:
@@ -355,15 +410,17 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             if null_ordering:
                 column = null_ordering(column)
             statement = statement.order_by(column)
+        if limit is not None:
+            statement = statement.limit(limit)
+        if offset:
+            statement = statement.offset(offset)
         return statement
 
 
-    def execute(self, quals, columns, sortkeys=None):
-        """
-        The quals are turned into an and'ed where clause.
-        """
+    def _execute(self, quals, columns, sortkeys, limit=None, offset=None):
         sortkeys = sortkeys or []
-        statement = self._build_statement(quals, columns, sortkeys)
+        statement = self._build_statement(quals, columns, sortkeys, limit,
+                                          offset)
         log_to_postgres(str(statement), DEBUG)
         rs = (self.connection
               .execution_options(stream_results=True)
@@ -372,9 +429,87 @@ class SqlAlchemyFdw(ForeignDataWrapper):
         # behaviour (See issue #100)
         if self.engine.driver == 'pymssql' and self.transaction is not None:
             rs = list(rs)
+        return rs
+
+    def execute(self, quals, columns, sortkeys=None, projection=None,
+                limit=None, offset=None):
+        """
+        The quals are turned into an and'ed where clause.
+        """
+        for item in self._execute(quals, projection or columns, sortkeys,
+                                  limit, offset):
+            yield tuple(item) if projection else dict(item)
+
+    def execute_batches(self, quals, columns, sortkeys=None,
+                        projection=None, limit=None, offset=None):
+        """
+        Same as execute, but rows are fetched from the cursor by batches.
+        """
+        rs = self._execute(quals, projection or columns, sortkeys, limit,
+                           offset)
+        convert = tuple if projection else dict
+        if isinstance(rs, list):
+            for i in range(0, len(rs), self._batch_size):
+                yield [convert(item) for item in rs[i:i + self._batch_size]]
+            return
+        while True:
+            items = rs.fetchmany(self._batch_size)
+            if not items:
+                break
+            yield [convert(item) for item in items]
+
+    @classmethod
+    def can_join(cls, left, right, join_type, join_quals):
+        """
+        The join is run by the remote database if both tables are reached
+        through the same connection string, and it filters and joins the
+        rows as PostgreSQL would. A qual comparing a column to a parameter
+        would filter on IS NULL if the parameter is NULL, so none is allowed.
+        """
+        engine = left.instance.engine
+        if str(engine.url) != str(right.instance.engine.url):
+            return False
+        return (engine.dialect.name == 'postgresql' and
+                all(left.instance._filters_like_postgres(qual) and
+                    qual.value is not UNBOUND for qual in left.quals) and
+                all(right.instance._filters_like_postgres(qual) and
+                    qual.value is not UNBOUND for qual in right.quals) and
+                all(operator in OPERATORS for _, operator, _ in join_quals))
 
-        for item in rs:
-            yield dict(item)
+    @classmethod
+    def execute_join(cls, left, right, join_type, join_quals):
+        """
+        Each table is filtered by its quals in a subquery, and the subqueries
+        are joined.
+        """
+        left_table = left.instance._build_statement(left.quals, None,
+                                                    []).alias()
+        right_table = right.instance._build_statement(right.quals, None,
+                                                      []).alias()
+        onclause = and_(true(), *[
+            OPERATORS[operator](left_table.c[left_column],
+                                right_table.c[right_column])
+            for left_column, operator, right_column in join_quals])
+        if join_type == 'right':
+            joined = right_table.join(left_table, onclause, isouter=True)
+        else:
+            joined = left_table.join(right_table, onclause,
+                                     isouter=join_type != 'inner',
+                                     full=join_type == 'full')
+        columns = ([left_table.c[column] for column in left.targets] +
+                   [right_table.c[column] for column in right.targets])
+        connection = left.instance.connection
+        if not columns:
+            statement = select([func.count()]).select_from(joined)
+            log_to_postgres(str(statement), DEBUG)
+            for _ in range(connection.execute(statement).scalar()):
+                yield ()
+            return
+        statement = select(columns).select_from(joined)
+        log_to_postgres(str(statement), DEBUG)
+        for item in (connection.execution_options(stream_results=True)
+                     .execute(statement)):
+            yield tuple(item)
 
     @property
     def connection(self):
@@ -423,6 +558,31 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             self.table.delete()
             .where(self.table.c[self._row_id_column] == rowid))
 
+    def _where_clauses(self, quals):
+        clauses = []
+        for qual in quals:
+            operator = OPERATORS.get(qual.operator, None)
+            if operator is None:
+                log_to_postgres('Qual not supported by the foreign db: %s'
+                                % qual, ERROR)
+            clauses.append(operator(self.table.c[qual.field_name],
+                                    qual.value))
+        return clauses
+
+    def update_where(self, quals, newvalues):
+        statement = self.table.update().values(newvalues)
+        clauses = self._where_clauses(quals)
+        if clauses:
+            statement = statement.where(and_(*clauses))
+        return self.connection.execute(statement).rowcount
+
+    def delete_where(self, quals):
+        statement = self.table.delete()
+        clauses = self._where_clauses(quals)
+        if clauses:
+            statement = statement.where(and_(*clauses))
+        return self.connection.execute(statement).rowcount
+
     def _get_column_type(self, format_type):
         """Blatant ripoff from PG_Dialect.get_column_info"""
         # strip (*) from character varying(5), timestamp(5)
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
-from multicorn import ForeignDataWrapper, TableDefinition, ColumnDefinition
+from multicorn import (ForeignDataWrapper, TableDefinition, ColumnDefinition,
+                       ColumnBatch)
 from multicorn.compat import unicode_
 from .utils import log_to_postgres, WARNING, ERROR
-from itertools import cycle
+from itertools import cycle, islice
 from datetime import datetime
-from operator import itemgetter
+from operator import itemgetter, eq, ne, lt, le, gt, ge
+from array import array
+
+
+OPERATORS = {'=': eq, '<>': ne, '<': lt, '<=': le, '>': gt, '>=': ge}
 
 
 class TestForeignDataWrapper(ForeignDataWrapper):
@@ -19,6 +24,23 @@ class TestForeignDataWrapper(ForeignDataWrapper):
         self.tx_hook = options.get('tx_hook', False)
         self._row_id_column = options.get('row_id_column',
                                           list(self.columns.keys())[0])
+        self._parallel_workers = int(options.get('parallel_workers', 0))
+        self._single_producer = options.get('single_producer') == 'true'
+        self._direct_modify = options.get('direct_modify') == 'true'
+        self.aggregate = options.get('aggregate') == 'true'
+        self.limit = options.get('limit') == 'true'
+        self._plan_cache_ttl = int(options.get('plan_cache_ttl', 0))
+        self._cache_lookups = options.get('cache_lookups') == 'true'
+        self._lookup_cache_size = int(options.get('lookup_cache_size',
+                                                  self._lookup_cache_size))
+        self._structured_quals = options.get('structured_quals') == 'true'
+        self.enforce_quals = options.get('enforce_quals') == 'true'
+        self._late_materialization = (options.get('late_materialization') ==
+                                      'true')
+        self.scan_stats = options.get('scan_stats') == 'true'
+        self.log_at = int(options.get('log_at', -1))
+        self.error_at = int(options.get('error_at', -1))
+        self.remote_calls = 0
         log_to_postgres(str(sorted(options.items())))
         log_to_postgres(str(sorted([(key, column.type_name) for key, column in
                                     columns.items()])))
@@ -30,9 +52,13 @@ class TestForeignDataWrapper(ForeignDataWrapper):
             log_to_postgres("An error is about to occur", WARNING)
             log_to_postgres("An error occured", ERROR)
 
-    def _as_generator(self, quals, columns):
+    def _as_generator(self, quals, columns, indexes=range(20)):
         random_thing = cycle([1, 2, 3])
-        for index in range(20):
+        for index in indexes:
+            if index == self.log_at:
+                log_to_postgres("Row %s" % index, WARNING)
+            if index == self.error_at:
+                log_to_postgres("Row %s failed" % index, ERROR)
             if self.test_type == 'sequence':
                 line = []
                 for column_name in self.columns:
@@ -60,10 +86,20 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                                                      next(random_thing), 14,
                                                      30, 25)
                     elif self.test_type == 'int':
-                        line[column_name] = index
+                        if (self._late_materialization and
+                                column_name == 'test2'):
+                            line[column_name] = self._lazy_value(column_name,
+                                                                 index)
+                        else:
+                            line[column_name] = index
                     elif self.test_type == 'encoding':
-                        line[column_name] = (b'\xc3\xa9\xc3\xa0\xc2\xa4'
-                                             .decode('utf-8'))
+                        if self.test_subtype == 'nul':
+                            line[column_name] = u'a\x00b'
+                        elif self.test_subtype == 'bytes':
+                            line[column_name] = b'a\xc3'
+                        else:
+                            line[column_name] = (b'\xc3\xa9\xc3\xa0\xc2\xa4'
+                                                 .decode('utf-8'))
                     elif self.test_type == 'nested_list':
                         line[column_name] = [
                             [column_name, column_name],
@@ -77,18 +113,71 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                                                           index)
             yield line
 
-    def execute(self, quals, columns, sortkeys=None):
+    @staticmethod
+    def _type_name(value):
+        if isinstance(value, list):
+            return [TestForeignDataWrapper._type_name(item) for item in value]
+        return type(value).__name__
+
+    @staticmethod
+    def _lazy_value(column_name, index):
+        def value():
+            log_to_postgres("Computing %s for row %s" % (column_name, index))
+            return index
+        return value
+
+    def _as_column_batches(self, quals, columns):
+        for start in (0, 10):
+            indexes = range(start, start + 10)
+            values = {}
+            nulls = {}
+            for column_name, column in self.columns.items():
+                if column.type_name in ('smallint', 'integer', 'bigint'):
+                    values[column_name] = array('l', indexes)
+                elif column.type_name in ('real', 'double precision'):
+                    values[column_name] = array('d', [index / 4.
+                                                      for index in indexes])
+                else:
+                    values[column_name] = ['%s %s' % (column_name, index)
+                                           for index in indexes]
+                    nulls[column_name] = [index % 5 == 0
+                                          for index in indexes]
+            yield ColumnBatch(values, nulls, len(indexes))
+
+    def execute(self, quals, columns, sortkeys=None, limit=None,
+                offset=None, quals_tree=None):
         sortkeys = sortkeys or []
+        self.remote_calls += 1
         log_to_postgres(str(sorted(quals)))
         log_to_postgres(str(sorted(columns)))
+        if quals_tree is not None:
+            log_to_postgres("TREE: %s" % quals_tree)
         if (len(sortkeys)) > 0:
             log_to_postgres("requested sort(s): ")
             for k in sortkeys:
                 log_to_postgres(k)
+        if offset is not None:
+            log_to_postgres("LIMIT: %s OFFSET: %s" % (limit, offset))
+            res = self._filtered(quals)
+            if len(sortkeys) > 0:
+                res = sorted(res, key=itemgetter(sortkeys[0].attname),
+                             reverse=sortkeys[0].is_reversed)
+            return islice(res, offset,
+                          None if limit is None else offset + limit)
+        if self.enforce_quals:
+            return self._filtered([qual for qual in quals
+                                   if self._can_filter([qual])])
         if self.test_type == 'None':
             return None
+        elif self.test_type == 'types':
+            for qual in quals:
+                log_to_postgres("%s: %s" % (qual.field_name,
+                                            self._type_name(qual.value)))
+            return []
         elif self.test_type == 'iter_none':
             return [None, None]
+        elif self.test_type == 'columnar':
+            return self._as_column_batches(quals, columns)
         else:
             if (len(sortkeys) > 0):
                 # testfdw don't have tables with more than 2 fields, without
@@ -104,13 +193,104 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                                   reverse=k.is_reversed)
             return self._as_generator(quals, columns)
 
+    def get_partitions(self, quals, columns):
+        return [(start, start + 5) for start in range(0, 20, 5)]
+
+    def execute_partition(self, partition, quals, columns, **kwargs):
+        return self._as_generator(quals, columns, range(*partition))
+
+    @staticmethod
+    def _can_filter(quals):
+        return all(not qual.is_list_operator and qual.operator in OPERATORS
+                   for qual in quals)
+
+    def _filtered(self, quals):
+        for line in self._as_generator(quals, None):
+            if all(OPERATORS[qual.operator](line[qual.field_name], qual.value)
+                   for qual in quals):
+                yield line
+
+    def can_enforce_quals(self, quals):
+        if not self.enforce_quals:
+            return []
+        log_to_postgres("can_enforce_quals: %s" % sorted(quals))
+        return [qual for qual in quals if self._can_filter([qual])]
+
+    def can_limit(self, quals, sortkeys):
+        return self.limit and self._can_filter(quals)
+
+    def can_aggregate(self, group_by, aggregates, quals):
+        return self.aggregate and self._can_filter(quals)
+
+    def execute_aggregate(self, group_by, aggregates, quals):
+        log_to_postgres("AGGREGATE: %s %s %s" % (group_by, aggregates,
+                                                 sorted(quals)))
+        groups = {}
+        for line in self._filtered(quals):
+            key = tuple(line[column] for column in group_by)
+            groups.setdefault(key, []).append(line)
+        if not group_by and not groups:
+            groups[()] = []
+        for key in sorted(groups):
+            row = list(key)
+            for function, column in aggregates:
+                if column is None:
+                    row.append(len(groups[key]))
+                    continue
+                values = [line[column] for line in groups[key]]
+                if function == 'count':
+                    row.append(len(values))
+                elif not values:
+                    row.append(None)
+                elif function == 'avg':
+                    row.append(float(sum(values)) / len(values))
+                else:
+                    row.append({'sum': sum, 'min': min,
+                                'max': max}[function](values))
+            yield row
+
+    @classmethod
+    def can_join(cls, left, right, join_type, join_quals):
+        return (all(table.options.get('join') == 'true' and
+                    cls._can_filter(table.quals) for table in (left, right)) and
+                all(operator in OPERATORS for _, operator, _ in join_quals))
+
+    @classmethod
+    def execute_join(cls, left, right, join_type, join_quals):
+        log_to_postgres("JOIN: %s %s" % (join_type, join_quals))
+        log_to_postgres("LEFT: %s %s" % (sorted(left.quals), left.targets))
+        log_to_postgres("RIGHT: %s %s" % (sorted(right.quals), right.targets))
+        right_lines = list(right.instance._filtered(right.quals))
+        right_matched = set()
+        for left_line in left.instance._filtered(left.quals):
+            left_values = [left_line[column] for column in left.targets]
+            matched = False
+            for index, right_line in enumerate(right_lines):
+                if all(OPERATORS[operator](left_line[left_column],
+                                           right_line[right_column])
+                       for left_column, operator, right_column in join_quals):
+                    matched = True
+                    right_matched.add(index)
+                    yield left_values + [right_line[column]
+                                         for column in right.targets]
+            if not matched and join_type in ('left', 'full'):
+                yield left_values + [None] * len(right.targets)
+        if join_type in ('right', 'full'):
+            for index, right_line in enumerate(right_lines):
+                if index not in right_matched:
+                    yield [None] * len(left.targets) + [
+                        right_line[column] for column in right.targets]
+
     def get_rel_size(self, quals, columns):
-        if self.test_type == 'planner':
+        if self._plan_cache_ttl:
+            log_to_postgres("get_rel_size: %s %s" % (sorted(quals),
+                                                     sorted(columns)))
+        if self.test_type == 'planner' or self._cache_lookups:
             return (10000000, len(columns) * 10)
         return (20, len(columns) * 10)
 
     def get_path_keys(self):
-        if self.test_type == 'planner':
+        if self.test_type == 'planner' or self._cache_lookups:
             return [(('test1',), 1)]
         return []
 
@@ -121,6 +301,7 @@ class TestForeignDataWrapper(ForeignDataWrapper):
     def update(self, rowid, newvalues):
         if self.test_type == 'nowrite':
             super(TestForeignDataWrapper, self).update(rowid, newvalues)
+        self.remote_calls += 1
         log_to_postgres("UPDATING: %s with %s" % (
             rowid, sorted(newvalues.items())))
         if self.test_type == 'returning':
@@ -131,11 +312,22 @@ class TestForeignDataWrapper(ForeignDataWrapper):
     def delete(self, rowid):
         if self.test_type == 'nowrite':
             super(TestForeignDataWrapper, self).delete(rowid)
+        self.remote_calls += 1
         log_to_postgres("DELETING: %s" % rowid)
 
+    def update_where(self, quals, newvalues):
+        log_to_postgres("UPDATING WHERE: %s with %s" % (
+            quals, sorted(newvalues.items())))
+        return 1
+
+    def delete_where(self, quals):
+        log_to_postgres("DELETING WHERE: %s" % quals)
+        return 1
+
     def insert(self, values):
         if self.test_type == 'nowrite':
             super(TestForeignDataWrapper, self).insert(values)
+        self.remote_calls += 1
         log_to_postgres("INSERTING: %s" % sorted(values.items()))
         if self.test_type == 'returning':
             for key in self.columns:
@@ -146,6 +338,17 @@ class TestForeignDataWrapper(ForeignDataWrapper):
     def rowid_column(self):
         return self._row_id_column
 
+    def get_scan_stats(self):
+        if self.scan_stats:
+            return {'Remote Calls': self.remote_calls}
+        return {}
+
+    def end_scan(self):
+        self.remote_calls = 0
+
+    def end_modify(self):
+        self.remote_calls = 0
+
     def begin(self, serializable):
         if self.tx_hook:
             log_to_postgres('BEGIN')
@@ -1,7 +1,9 @@
+from collections import deque
 from logging import ERROR, INFO, DEBUG, WARNING, CRITICAL
+import threading
 try:
     from ._utils import _log_to_postgres
-    from ._utils import check_interrupts
+    from ._utils import check_interrupts as _check_interrupts
 except ImportError as e:
     from warnings import warn
     warn("Not executed in a postgresql server,"
@@ -10,6 +12,9 @@ except ImportError as e:
     def _log_to_postgres(message, level=0, hint=None, detail=None):
         pass
 
+    def _check_interrupts():
+        pass
+
 
 REPORT_CODES = {
     DEBUG: 0,
@@ -19,10 +24,71 @@ REPORT_CODES = {
     CRITICAL: 4
 }
 
+#: The messages logged outside of the backend's thread, by the iterators run
+#: in the background (see :mod:`multicorn.background`). They are emitted by
+#: the backend when it reads the next row.
+_deferred = deque()
+
+
+class DeferredError(Exception):
+    """An error logged outside of the backend's thread.
+
+    It is raised in the thread which logged it instead, and reported by the
+    backend like the error would have been.
+    """
+
+    def __init__(self, message, code, hint=None, detail=None):
+        super(DeferredError, self).__init__(message)
+        self.message = message
+        self.code = code
+        self.hint = hint
+        self.detail = detail
+
+    def report(self):
+        """Report the error from the backend's thread."""
+        _log_to_postgres(self.message, self.code, hint=self.hint,
+                         detail=self.detail)
+
+
+def _in_backend_thread():
+    main_thread = getattr(threading, 'main_thread', None)
+    if main_thread is None:
+        # Python2
+        return isinstance(threading.current_thread(), threading._MainThread)
+    return threading.current_thread() is main_thread()
+
+
+def emit_deferred_logs():
+    """Emit the messages logged outside of the backend's thread so far.
+
+    This must be called from the backend's thread.
+    """
+    while _deferred:
+        message, code, hint, detail = _deferred.popleft()
+        _log_to_postgres(message, code, hint=hint, detail=detail)
+
 
 def log_to_postgres(message, level=INFO, hint=None, detail=None):
+    """Log a message to PostgreSQL, with the given logging level.
+
+    An ERROR aborts the query. Outside of the backend's thread, the
+    messages are emitted once the backend reads the next row, and an ERROR
+    raises a :class:`DeferredError` instead.
+    """
     code = REPORT_CODES.get(level, None)
     if code is None:
         raise KeyError("Not a valid log level")
+    if not _in_backend_thread():
+        if code >= REPORT_CODES[ERROR]:
+            raise DeferredError(message, code, hint=hint, detail=detail)
+        _deferred.append((message, code, hint, detail))
+        return
+    emit_deferred_logs()
     _log_to_postgres(message, code, hint=hint, detail=detail)
 
+
+def check_interrupts():
+    """Abort the query if it was cancelled. Outside of the backend's thread,
+    this does nothing: the backend checks for cancellations itself."""
+    if _in_backend_thread():
+        _check_interrupts()
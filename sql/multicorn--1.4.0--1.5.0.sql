@@ -0,0 +1,38 @@
+-- cumulative statistics of the foreign tables, times in milliseconds
+CREATE OR REPLACE FUNCTION multicorn_stat_foreign_tables (
+    OUT dbid oid,
+    OUT foreigntableid oid,
+    OUT get_rel_size_calls bigint,
+    OUT get_rel_size_total_time float8,
+    OUT get_rel_size_max_time float8,
+    OUT execute_calls bigint,
+    OUT execute_total_time float8,
+    OUT execute_max_time float8,
+    OUT insert_calls bigint,
+    OUT insert_total_time float8,
+    OUT insert_max_time float8,
+    OUT update_calls bigint,
+    OUT update_total_time float8,
+    OUT update_max_time float8,
+    OUT delete_calls bigint,
+    OUT delete_total_time float8,
+    OUT delete_max_time float8,
+    OUT pre_commit_calls bigint,
+    OUT pre_commit_total_time float8,
+    OUT pre_commit_max_time float8,
+    OUT begin_calls bigint,
+    OUT begin_total_time float8,
+    OUT begin_max_time float8,
+    OUT rows bigint,
+    OUT instances bigint,
+    OUT errors bigint)
+RETURNS SETOF record
+AS 'MODULE_PATHNAME'
+LANGUAGE C STRICT VOLATILE;
+
+CREATE OR REPLACE FUNCTION multicorn_stat_reset ()
+RETURNS void
+AS 'MODULE_PATHNAME'
+LANGUAGE C STRICT;
+
+REVOKE ALL ON FUNCTION multicorn_stat_reset () FROM PUBLIC;
@@ -31,6 +31,7 @@ errorCheck()
 	PyErr_Fetch(&pErrType, &pErrValue, &pErrTraceback);
 	if (pErrType)
 	{
+		countTableError();
 		reportException(pErrType, pErrValue, pErrTraceback);
 	}
 }
@@ -19,8 +19,12 @@
 #include "access/relscan.h"
 #include "access/sysattr.h"
 #include "access/xact.h"
+#include "commands/vacuum.h"
+#include "executor/instrument.h"
 #include "nodes/makefuncs.h"
 #include "catalog/pg_type.h"
+#include "utils/guc.h"
+#include "utils/inval.h"
 #include "utils/memutils.h"
 #include "miscadmin.h"
 #include "utils/lsyscache.h"
@@ -30,6 +34,29 @@
 #if PG_VERSION_NUM >= 130000
 #include "common/hashfn.h" /* oid_hash */
 #endif
+#if PG_VERSION_NUM >= 90300
+#include "access/htup_details.h"
+#endif
+#if PG_VERSION_NUM >= 90600
+#include "access/parallel.h"
+#include "catalog/pg_aggregate.h"
+#include "catalog/pg_namespace.h"
+#include "optimizer/cost.h"
+#include "optimizer/tlist.h"
+#include "storage/proc.h"
+#include "storage/shm_mq.h"
+#include "utils/selfuncs.h"
+#endif
+#if PG_VERSION_NUM >= 120000
+#include "optimizer/optimizer.h"
+#endif
+#if PG_VERSION_NUM >= 110000
+#include "optimizer/planner.h" /* parallel_leader_participation */
+#endif
+#if PG_VERSION_NUM >= 100000
+#include "pgstat.h"
+#include "storage/latch.h"
+#endif
 
 
 PG_MODULE_MAGIC;
@@ -69,9 +96,62 @@ static ForeignScan *multicornGetForeignPlan(PlannerInfo *root,
 static void multicornExplainForeignScan(ForeignScanState *node, ExplainState *es);
 static void multicornBeginForeignScan(ForeignScanState *node, int eflags);
 static TupleTableSlot *multicornIterateForeignScan(ForeignScanState *node);
+#if PG_VERSION_NUM >= 90500
+static void releaseColumnarBatch(void *arg);
+#endif
 static void multicornReScanForeignScan(ForeignScanState *node);
 static void multicornEndForeignScan(ForeignScanState *node);
 
+#if PG_VERSION_NUM >= 90600
+static bool multicornIsForeignScanParallelSafe(PlannerInfo *root,
+								   RelOptInfo *rel,
+								   RangeTblEntry *rte);
+static Size multicornEstimateDSMForeignScan(ForeignScanState *node,
+								ParallelContext *pcxt);
+static void multicornInitializeDSMForeignScan(ForeignScanState *node,
+								  ParallelContext *pcxt,
+								  void *coordinate);
+#if PG_VERSION_NUM >= 100000
+static void multicornReInitializeDSMForeignScan(ForeignScanState *node,
+									ParallelContext *pcxt,
+									void *coordinate);
+#endif
+static void multicornInitializeWorkerForeignScan(ForeignScanState *node,
+									 shm_toc *toc,
+									 void *coordinate);
+#if PG_VERSION_NUM >= 110000
+static void multicornShutdownForeignScan(ForeignScanState *node);
+#endif
+#endif
+
+#if PG_VERSION_NUM >= 90600
+static void multicornGetForeignUpperPaths(PlannerInfo *root,
+							  UpperRelationKind stage,
+							  RelOptInfo *input_rel,
+							  RelOptInfo *output_rel
+#if PG_VERSION_NUM >= 110000
+							  , void *extra
+#endif
+							  );
+#endif
+
+#if PG_VERSION_NUM >= 90600
+static void multicornGetForeignJoinPaths(PlannerInfo *root,
+							 RelOptInfo *joinrel,
+							 RelOptInfo *outerrel,
+							 RelOptInfo *innerrel,
+							 JoinType jointype,
+							 JoinPathExtraData *extra);
+#endif
+
+static bool multicornAnalyzeForeignTable(Relation relation,
+							 AcquireSampleRowsFunc *func,
+							 BlockNumber *totalpages);
+static int	multicornAcquireSampleRows(Relation relation, int elevel,
+							HeapTuple *rows, int targrows,
+							double *totalrows,
+							double *totaldeadrows);
+
 #if PG_VERSION_NUM >= 90300
 static void multicornAddForeignUpdateTargets(Query *parsetree,
 								 RangeTblEntry *target_rte,
@@ -94,6 +174,22 @@ static TupleTableSlot *multicornExecForeignDelete(EState *estate, ResultRelInfo
 static TupleTableSlot *multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 						   TupleTableSlot *slot, TupleTableSlot *planSlot);
 static void multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo);
+static void multicornExplainForeignModify(ModifyTableState *mtstate,
+							  ResultRelInfo *rinfo,
+							  List *fdw_private,
+							  int subplan_index,
+							  ExplainState *es);
+#if PG_VERSION_NUM >= 90600
+static bool multicornPlanDirectModify(PlannerInfo *root,
+						  ModifyTable *plan,
+						  Index resultRelation,
+						  int subplan_index);
+static void multicornBeginDirectModify(ForeignScanState *node, int eflags);
+static TupleTableSlot *multicornIterateDirectModify(ForeignScanState *node);
+static void multicornEndDirectModify(ForeignScanState *node);
+static void multicornExplainDirectModify(ForeignScanState *node,
+							 ExplainState *es);
+#endif
 
 static void multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 						   SubTransactionId parentSubid, void *arg);
@@ -105,6 +201,9 @@ static List *multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
 #endif
 
 static void multicorn_xact_callback(XactEvent event, void *arg);
+static void multicorn_relcache_callback(Datum arg, Oid relid);
+static void multicorn_syscache_callback(Datum arg, int cacheid,
+							uint32 hashvalue);
 
 /*	Helpers functions */
 PGDLLEXPORT void	   *serializePlanState(MulticornPlanState * planstate);
@@ -113,14 +212,31 @@ PGDLLEXPORT MulticornExecState *initializeExecState(void *internal_plan_state);
 /* Hash table mapping oid to fdw instances */
 PGDLLEXPORT HTAB	   *InstancesHash;
 
+/* The multicorn.preload_modules setting */
+static char *preloadModulesSetting = NULL;
+
 
 void
 _PG_init()
 {
 	HASHCTL		ctl;
-	MemoryContext oldctx = MemoryContextSwitchTo(CacheMemoryContext);
+	MemoryContext oldctx;
 	bool need_import_plpy = false;
 
+	/*
+	 * The postmaster loading multicorn from shared_preload_libraries has no
+	 * CacheMemoryContext yet.
+	 */
+	if (process_shared_preload_libraries_in_progress ||
+		CacheMemoryContext == NULL)
+	{
+		oldctx = MemoryContextSwitchTo(TopMemoryContext);
+	}
+	else
+	{
+		oldctx = MemoryContextSwitchTo(CacheMemoryContext);
+	}
+
 #if PY_MAJOR_VERSION >= 3
 	/* Try to load plpython3 with its own module */
 	PG_TRY();
@@ -138,6 +254,20 @@ _PG_init()
 	Py_Initialize();
 	if (need_import_plpy)
 		PyImport_ImportModule("plpy");
+	DefineCustomStringVariable("multicorn.preload_modules",
+							   "Python modules imported when multicorn is loaded.",
+							   "When multicorn is in shared_preload_libraries, "
+							   "they are imported once by the postmaster, "
+							   "instead of by every backend.",
+							   &preloadModulesSetting,
+							   "",
+							   PGC_POSTMASTER,
+							   0,
+							   NULL,
+							   NULL,
+							   NULL);
+	preloadModules(preloadModulesSetting);
+	initTableStats();
 	RegisterXactCallback(multicorn_xact_callback, NULL);
 #if PG_VERSION_NUM >= 90300
 	RegisterSubXactCallback(multicorn_subxact_callback, NULL);
@@ -151,12 +281,26 @@ _PG_init()
 	InstancesHash = hash_create("multicorn instances", 32,
 								&ctl,
 								HASH_ELEM | HASH_FUNCTION);
+	/*
+	 * The instances are only compared to their table definition again after
+	 * the table, its server, wrapper or user mapping changed.
+	 */
+	CacheRegisterRelcacheCallback(multicorn_relcache_callback, (Datum) 0);
+	CacheRegisterSyscacheCallback(FOREIGNTABLEREL, multicorn_syscache_callback,
+								  (Datum) 0);
+	CacheRegisterSyscacheCallback(FOREIGNSERVEROID, multicorn_syscache_callback,
+								  (Datum) 0);
+	CacheRegisterSyscacheCallback(FOREIGNDATAWRAPPEROID,
+								  multicorn_syscache_callback, (Datum) 0);
+	CacheRegisterSyscacheCallback(USERMAPPINGOID, multicorn_syscache_callback,
+								  (Datum) 0);
 	MemoryContextSwitchTo(oldctx);
 }
 
 void
 _PG_fini()
 {
+	acquireGil();
 	Py_Finalize();
 }
 
@@ -178,6 +322,30 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->ReScanForeignScan = multicornReScanForeignScan;
 	fdw_routine->EndForeignScan = multicornEndForeignScan;
 
+#if PG_VERSION_NUM >= 90600
+	/* Parallel scans */
+	fdw_routine->IsForeignScanParallelSafe = multicornIsForeignScanParallelSafe;
+	fdw_routine->EstimateDSMForeignScan = multicornEstimateDSMForeignScan;
+	fdw_routine->InitializeDSMForeignScan = multicornInitializeDSMForeignScan;
+#if PG_VERSION_NUM >= 100000
+	fdw_routine->ReInitializeDSMForeignScan = multicornReInitializeDSMForeignScan;
+#endif
+	fdw_routine->InitializeWorkerForeignScan = multicornInitializeWorkerForeignScan;
+#if PG_VERSION_NUM >= 110000
+	fdw_routine->ShutdownForeignScan = multicornShutdownForeignScan;
+#endif
+#endif
+
+#if PG_VERSION_NUM >= 90600
+	/* Upper planner: aggregates */
+	fdw_routine->GetForeignUpperPaths = multicornGetForeignUpperPaths;
+	/* Joins between tables of the same server */
+	fdw_routine->GetForeignJoinPaths = multicornGetForeignJoinPaths;
+#endif
+
+	/* Statistics */
+	fdw_routine->AnalyzeForeignTable = multicornAnalyzeForeignTable;
+
 #if PG_VERSION_NUM >= 90300
 	/* Code for 9.3 */
 	fdw_routine->AddForeignUpdateTargets = multicornAddForeignUpdateTargets;
@@ -188,6 +356,15 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->ExecForeignDelete = multicornExecForeignDelete;
 	fdw_routine->ExecForeignUpdate = multicornExecForeignUpdate;
 	fdw_routine->EndForeignModify = multicornEndForeignModify;
+	fdw_routine->ExplainForeignModify = multicornExplainForeignModify;
+#if PG_VERSION_NUM >= 90600
+	/* Direct modification */
+	fdw_routine->PlanDirectModify = multicornPlanDirectModify;
+	fdw_routine->BeginDirectModify = multicornBeginDirectModify;
+	fdw_routine->IterateDirectModify = multicornIterateDirectModify;
+	fdw_routine->EndDirectModify = multicornEndDirectModify;
+	fdw_routine->ExplainDirectModify = multicornExplainDirectModify;
+#endif
 #endif
 
 #if PG_VERSION_NUM >= 90500
@@ -197,6 +374,49 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	PG_RETURN_POINTER(fdw_routine);
 }
 
+/*
+ * Returns the value of the prefetch_rows option, which must be a positive
+ * integer.
+ */
+static int
+parsePrefetchRows(DefElem *def)
+{
+	char	   *value = defGetString(def);
+	char	   *end;
+	long		result;
+
+	errno = 0;
+	result = strtol(value, &end, 10);
+	if (errno != 0 || *end != '\0' || end == value || result <= 0 ||
+		result > INT_MAX)
+	{
+		ereport(ERROR, (errmsg("Invalid value for prefetch_rows: \"%s\"", value),
+						errhint("%s", "Set it to a positive number of rows")));
+	}
+	return (int) result;
+}
+
+/*
+ * Returns the number of rows to fetch in advance from the scans on the given
+ * foreign table, from its options or its server's, or 0 to not prefetch.
+ */
+static int
+getPrefetchRows(Oid foreigntableid)
+{
+	ListCell   *lc;
+
+	foreach(lc, getOptions(foreigntableid))
+	{
+		DefElem    *def = (DefElem *) lfirst(lc);
+
+		if (strcmp(def->defname, "prefetch_rows") == 0)
+		{
+			return parsePrefetchRows(def);
+		}
+	}
+	return 0;
+}
+
 Datum
 multicorn_validator(PG_FUNCTION_ARGS)
 {
@@ -206,6 +426,7 @@ multicorn_validator(PG_FUNCTION_ARGS)
 	ListCell   *cell;
 	PyObject   *p_class;
 
+	acquireGil();
 	foreach(cell, options_list)
 	{
 		DefElem    *def = (DefElem *) lfirst(cell);
@@ -224,6 +445,10 @@ multicorn_validator(PG_FUNCTION_ARGS)
 				className = (char *) defGetString(def);
 			}
 		}
+		else if (strcmp(def->defname, "prefetch_rows") == 0)
+		{
+			parsePrefetchRows(def);
+		}
 	}
 	if (catalog == ForeignServerRelationId)
 	{
@@ -256,9 +481,33 @@ multicornGetForeignRelSize(PlannerInfo *root,
 	bool		needWholeRow = false;
 	TupleDesc	desc;
 
+	acquireGil();
 	baserel->fdw_private = planstate;
 	planstate->fdw_instance = getInstance(foreigntableid);
 	planstate->foreigntableid = foreigntableid;
+#if PG_VERSION_NUM >= 90600
+	planstate->parallel_workers = Min(getIntegerAttribute(planstate->fdw_instance,
+														  "_parallel_workers"),
+									  max_parallel_workers_per_gather);
+#if PG_VERSION_NUM >= 110000
+	/* Only the leader produces rows in a single producer scan. */
+	if (!parallel_leader_participation &&
+		getBooleanAttribute(planstate->fdw_instance, "_single_producer"))
+	{
+		planstate->parallel_workers = 0;
+	}
+#else
+	/*
+	 * The leader of a single producer scan stopped early, by a LIMIT for
+	 * example, can only release the workers waiting for its rows from
+	 * ShutdownForeignScan.
+	 */
+	if (getBooleanAttribute(planstate->fdw_instance, "_single_producer"))
+	{
+		planstate->parallel_workers = 0;
+	}
+#endif
+#endif
 	/* Initialize the conversion info array */
 	{
 		Relation	rel = RelationIdGetRelation(ftable->relid);
@@ -274,21 +523,7 @@ multicornGetForeignRelSize(PlannerInfo *root,
 		needWholeRow = rel->trigdesc && rel->trigdesc->trig_insert_after_row;
 		RelationClose(rel);
 	}
-	if (needWholeRow)
-	{
-		int			i;
-
-		for (i = 0; i < desc->natts; i++)
-		{
-			Form_pg_attribute att = TupleDescAttr(desc, i);
-
-			if (!att->attisdropped)
-			{
-				planstate->target_list = lappend(planstate->target_list, makeString(NameStr(att->attname)));
-			}
-		}
-	}
-	else
+	if (!needWholeRow)
 	{
 		/* Pull "var" clauses to build an appropriate target list */
 #if PG_VERSION_NUM >= 90600
@@ -300,6 +535,13 @@ multicornGetForeignRelSize(PlannerInfo *root,
 			Var		   *var = (Var *) lfirst(lc);
 			Value	   *colname;
 
+			/* A whole-row reference needs every column. */
+			if (var->varattno == 0)
+			{
+				needWholeRow = true;
+				break;
+			}
+
 			/*
 			 * Store only a Value node containing the string name of the
 			 * column.
@@ -311,6 +553,21 @@ multicornGetForeignRelSize(PlannerInfo *root,
 			}
 		}
 	}
+	if (needWholeRow)
+	{
+		int			i;
+
+		planstate->target_list = NIL;
+		for (i = 0; i < desc->natts; i++)
+		{
+			Form_pg_attribute att = TupleDescAttr(desc, i);
+
+			if (!att->attisdropped)
+			{
+				planstate->target_list = lappend(planstate->target_list, makeString(NameStr(att->attname)));
+			}
+		}
+	}
 	/* Extract the restrictions from the plan. */
 	foreach(lc, baserel->baserestrictinfo)
 	{
@@ -347,8 +604,11 @@ multicornGetForeignPaths(PlannerInfo *root,
 	List				*apply_pathkeys = NULL;
 	List				*deparsed_pathkeys = NULL;
 
+	List	   *possiblePaths;
+
+	acquireGil();
 	/* Extract a friendly version of the pathkeys. */
-	List	   *possiblePaths = pathKeys(planstate);
+	possiblePaths = pathKeys(planstate);
 
 	/* Try to find parameterized paths */
 	pathes = findPaths(root, baserel, possiblePaths, planstate->startupCost,
@@ -373,6 +633,31 @@ multicornGetForeignPaths(PlannerInfo *root,
 #endif
 			NULL));
 
+#if PG_VERSION_NUM >= 90600
+	/*
+	 * Add a partial path, split between the workers, if the python fdw asked
+	 * for parallel scans.
+	 */
+	if (baserel->consider_parallel && planstate->parallel_workers > 0)
+	{
+		ForeignPath *path;
+		double		divisor = planstate->parallel_workers + 1;
+
+		path = create_foreignscan_path(root, baserel,
+									   NULL,	/* default pathtarget */
+									   baserel->rows / divisor,
+									   planstate->startupCost,
+									   baserel->rows * baserel->reltarget->width / divisor,
+									   NIL,		/* no pathkeys */
+									   NULL,
+									   NULL,
+									   NULL);
+		path->path.parallel_aware = true;
+		path->path.parallel_workers = planstate->parallel_workers;
+		add_partial_path(baserel, (Path *) path);
+	}
+#endif
+
 	/* Handle sort pushdown */
 	if (root->query_pathkeys)
 	{
@@ -419,178 +704,2135 @@ multicornGetForeignPaths(PlannerInfo *root,
 }
 
 /*
- * multicornGetForeignPlan
- *		Create a ForeignScan plan node for scanning the foreign table
+ * Returns the value of a LIMIT or OFFSET clause, -1 if there is none, or -2
+ * if it is not a constant known at plan time.
  */
-static ForeignScan *
-multicornGetForeignPlan(PlannerInfo *root,
-						RelOptInfo *baserel,
-						Oid foreigntableid,
-						ForeignPath *best_path,
-						List *tlist,
-						List *scan_clauses
-#if PG_VERSION_NUM >= 90500
-						, Plan *outer_plan
-#endif
-		)
+static int64
+getLimitValue(Node *node)
 {
-	Index		scan_relid = baserel->relid;
-	MulticornPlanState *planstate = (MulticornPlanState *) baserel->fdw_private;
-	ListCell   *lc;
+	Const	   *value = (Const *) node;
+
+	if (node == NULL)
+	{
+		return -1;
+	}
+	if (!IsA(node, Const))
+	{
+		return -2;
+	}
+	if (value->constisnull)
+	{
+		return -1;
+	}
+	return DatumGetInt64(value->constvalue);
+}
+
 #if PG_VERSION_NUM >= 90600
-	best_path->path.pathtarget->width = planstate->width;
+/*
+ * Returns true if the value can be computed before calling into python: a
+ * constant, or an external parameter.
+ */
+static bool
+isPushableValue(Expr *expr)
+{
+	return IsA(expr, Const) ||
+		(IsA(expr, Param) && ((Param *) expr)->paramkind == PARAM_EXTERN);
+}
+
+/*
+ * Returns true if the clause translates to a single qual, comparing a column
+ * to a value computed before calling into python.
+ */
+static bool
+isPushableClause(Index relid, Expr *clause)
+{
+	List	   *quals = NIL;
+	MulticornBaseQual *qual;
+
+	/* Do not let extractRestrictions warn about other clauses. */
+	if (!IsA(clause, OpExpr) && !IsA(clause, ScalarArrayOpExpr) &&
+		!IsA(clause, NullTest))
+	{
+		return false;
+	}
+	extractRestrictions(bms_make_singleton(relid), clause, &quals);
+	if (list_length(quals) != 1)
+	{
+		return false;
+	}
+	qual = linitial(quals);
+	switch (qual->right_type)
+	{
+		case T_Const:
+			return true;
+		case T_Param:
+			return isPushableValue(((MulticornParamQual *) qual)->expr);
+		default:
+			return false;
+	}
+}
+
+/*
+ * Returns the description of an aggregate which can be computed by the
+ * python fdw: a list of its function name, and of the name of its column or
+ * NULL for count(*). Only count, sum, min, max and avg of a single column
+ * are supported, without DISTINCT, ORDER BY or FILTER.
+ *
+ * Returns NIL for any other aggregate.
+ */
+static List *
+describeAggregate(MulticornPlanState * planstate, Index relid, Aggref *aggref)
+{
+	char	   *name;
+	Var		   *var;
+
+	if (aggref->aggdistinct != NIL || aggref->aggorder != NIL ||
+		aggref->aggfilter != NULL || aggref->aggkind != AGGKIND_NORMAL ||
+		aggref->aggvariadic ||
+		get_func_namespace(aggref->aggfnoid) != PG_CATALOG_NAMESPACE)
+	{
+		return NIL;
+	}
+	name = get_func_name(aggref->aggfnoid);
+	if (strcmp(name, "count") != 0 && strcmp(name, "sum") != 0 &&
+		strcmp(name, "min") != 0 && strcmp(name, "max") != 0 &&
+		strcmp(name, "avg") != 0)
+	{
+		return NIL;
+	}
+	if (aggref->aggstar)
+	{
+		return list_make2(makeString(name), NULL);
+	}
+	if (list_length(aggref->args) != 1)
+	{
+		return NIL;
+	}
+	var = (Var *) ((TargetEntry *) linitial(aggref->args))->expr;
+	if (!IsA(var, Var) || var->varno != relid || var->varattno < 1)
+	{
+		return NIL;
+	}
+	return list_make2(makeString(name),
+					  makeString(planstate->cinfos[var->varattno - 1]->attrname));
+}
+
+#if PG_VERSION_NUM >= 120000
+/*
+ * Add a path applying the LIMIT and OFFSET of the query in the python fdw.
+ *
+ * This is only done for a SELECT on a single foreign table, whose best
+ * unparameterized path already returns the rows in the query order, when
+ * every clause of the WHERE translates to a qual, LIMIT and OFFSET are
+ * constants, and the python can_limit method accepts the quals and sort keys.
+ */
+static void
+addLimitPath(PlannerInfo *root, RelOptInfo *input_rel, RelOptInfo *output_rel,
+			 FinalPathExtraData *extra)
+{
+	Query	   *parse = root->parse;
+	int64		limit_count = getLimitValue(parse->limitCount);
+	int64		limit_offset = getLimitValue(parse->limitOffset);
+	ForeignPath *scanpath = NULL;
+	RelOptInfo *baserel;
+	MulticornPlanState *planstate;
+	MulticornPlanState *limitstate;
+	List	   *scan_tlist = NIL;
+	ListCell   *lc;
+	double		rows;
+	Cost		startup_cost;
+	Cost		total_cost;
+	int			i;
+
+	if (!extra->limit_needed || output_rel->fdw_private != NULL ||
+		parse->commandType != CMD_SELECT || parse->rowMarks != NIL ||
+		parse->hasTargetSRFs ||
+#if PG_VERSION_NUM >= 130000
+		parse->limitOption == LIMIT_OPTION_WITH_TIES ||
 #endif
-	scan_clauses = extract_actual_clauses(scan_clauses, false);
-	/* Extract the quals coming from a parameterized path, if any */
-	if (best_path->path.param_info)
+		limit_count < -1 || limit_offset < -1)
+	{
+		return;
+	}
+	/* Look for a plain scan of the table, already sorted as asked */
+	foreach(lc, input_rel->pathlist)
 	{
+		Path	   *path = (Path *) lfirst(lc);
 
-		foreach(lc, scan_clauses)
+		if (IsA(path, ProjectionPath))
 		{
-			extractRestrictions(baserel->relids, (Expr *) lfirst(lc),
-								&planstate->qual_list);
+			path = ((ProjectionPath *) path)->subpath;
+		}
+		if (IsA(path, ForeignPath) &&
+			path->parent->reloptkind == RELOPT_BASEREL &&
+			path->param_info == NULL &&
+			pathkeys_contained_in(root->sort_pathkeys, path->pathkeys))
+		{
+			scanpath = (ForeignPath *) path;
+			break;
 		}
 	}
-	planstate->pathkeys = (List *) best_path->fdw_private;
-	return make_foreignscan(tlist,
-							scan_clauses,
-							scan_relid,
-							scan_clauses,		/* no expressions to evaluate */
-							serializePlanState(planstate)
-#if PG_VERSION_NUM >= 90500
-							, NULL
-							, NULL /* All quals are meant to be rechecked */
-							, NULL
-#endif
-							);
+	if (scanpath == NULL)
+	{
+		return;
+	}
+	baserel = scanpath->path.parent;
+	planstate = baserel->fdw_private;
+	acquireGil();
+	/* The quals will not be rechecked, so they must all be pushed down. */
+	foreach(lc, baserel->baserestrictinfo)
+	{
+		if (!isPushableClause(baserel->relid,
+							  ((RestrictInfo *) lfirst(lc))->clause))
+		{
+			return;
+		}
+	}
+	if (!canLimit(planstate, (List *) scanpath->fdw_private))
+	{
+		return;
+	}
+	/*
+	 * The scan returns every column of the table, so that rows returned as
+	 * sequences keep their meaning, but only the needed ones are read.
+	 */
+	for (i = 0; i < planstate->numattrs; i++)
+	{
+		ConversionInfo *cinfo = planstate->cinfos[i];
+		Oid			typid;
+		int32		typmod;
+		Oid			collid;
+		TargetEntry *tle;
+
+		if (cinfo == NULL)
+		{
+			continue;
+		}
+		get_atttypetypmodcoll(planstate->foreigntableid, cinfo->attnum,
+							  &typid, &typmod, &collid);
+		tle = makeTargetEntry((Expr *) makeVar(baserel->relid, cinfo->attnum,
+											   typid, typmod, collid, 0),
+							  list_length(scan_tlist) + 1,
+							  pstrdup(cinfo->attrname),
+							  false);
+		scan_tlist = lappend(scan_tlist, tle);
+	}
+	limitstate = palloc0(sizeof(MulticornPlanState));
+	limitstate->foreigntableid = planstate->foreigntableid;
+	limitstate->fdw_instance = planstate->fdw_instance;
+	limitstate->startupCost = planstate->startupCost;
+	limitstate->numattrs = list_length(scan_tlist);
+	limitstate->width = planstate->width;
+	limitstate->target_list = planstate->target_list;
+	limitstate->pathkeys = (List *) scanpath->fdw_private;
+	limitstate->relid = baserel->relid;
+	limitstate->clauses = extract_actual_clauses(baserel->baserestrictinfo,
+												 false);
+	limitstate->scan_tlist = scan_tlist;
+	limitstate->pushed_limit = true;
+	limitstate->limit_count = parse->limitCount;
+	limitstate->limit_offset = parse->limitOffset;
+	output_rel->fdw_private = limitstate;
+	/*
+	 * Cost the path like a Limit node on top of the scan, minus the rows the
+	 * python fdw does not have to return.
+	 */
+	rows = scanpath->path.rows;
+	startup_cost = scanpath->path.startup_cost;
+	total_cost = scanpath->path.total_cost;
+	adjust_limit_rows_costs(&rows, &startup_cost, &total_cost,
+							extra->offset_est, extra->count_est);
+	total_cost = Max(startup_cost, total_cost - cpu_tuple_cost * rows);
+	add_path(output_rel,
+			 (Path *) create_foreign_upper_path(root, output_rel,
+												root->upper_targets[UPPERREL_FINAL],
+												rows, startup_cost, total_cost,
+												scanpath->path.pathkeys,
+												NULL,
+												NIL));
 }
+#endif
 
 /*
- * multicornExplainForeignScan
- *		Placeholder for additional "EXPLAIN" information.
- *		This should (at least) output the python class name, as well
- *		as information that was taken into account for the choice of a path.
+ * multicornGetForeignUpperPaths
+ *		Add a path computing the aggregates of a query in the python fdw,
+ *		or applying its LIMIT and OFFSET (see addLimitPath).
+ *
+ *		This is only done if every clause of the WHERE translates to a qual,
+ *		the query is grouped by plain columns, without HAVING nor grouping
+ *		sets, its aggregates are described by describeAggregate, and the
+ *		python can_aggregate method accepts them.
+ */
+static void
+multicornGetForeignUpperPaths(PlannerInfo *root,
+							  UpperRelationKind stage,
+							  RelOptInfo *input_rel,
+							  RelOptInfo *output_rel
+#if PG_VERSION_NUM >= 110000
+							  , void *extra
+#endif
+)
+{
+	Query	   *parse = root->parse;
+	PathTarget *target = root->upper_targets[UPPERREL_GROUP_AGG];
+	MulticornPlanState *planstate = input_rel->fdw_private;
+	MulticornPlanState *aggstate;
+	Index		relid = input_rel->relid;
+	List	   *scan_exprs = NIL;
+	List	   *group_exprs = NIL;
+	List	   *group_by = NIL;
+	List	   *aggregates = NIL;
+	ListCell   *lc;
+	double		rows = 1;
+	ForeignPath *path;
+
+#if PG_VERSION_NUM >= 120000
+	if (stage == UPPERREL_FINAL)
+	{
+		addLimitPath(root, input_rel, output_rel, (FinalPathExtraData *) extra);
+		return;
+	}
+#endif
+	if (stage != UPPERREL_GROUP_AGG || output_rel->fdw_private != NULL ||
+		input_rel->reloptkind != RELOPT_BASEREL ||
+		parse->groupingSets != NIL || parse->havingQual != NULL)
+	{
+		return;
+	}
+	acquireGil();
+	/* The quals will not be rechecked, so they must all be pushed down. */
+	foreach(lc, input_rel->baserestrictinfo)
+	{
+		if (!isPushableClause(relid, ((RestrictInfo *) lfirst(lc))->clause))
+		{
+			return;
+		}
+	}
+	foreach(lc, parse->groupClause)
+	{
+		SortGroupClause *sgc = (SortGroupClause *) lfirst(lc);
+		Var		   *var = (Var *) get_sortgroupclause_expr(sgc,
+														   parse->targetList);
+
+		if (!IsA(var, Var) || var->varno != relid || var->varattno < 1)
+		{
+			return;
+		}
+		group_by = lappend(group_by,
+						   makeString(planstate->cinfos[var->varattno - 1]->attrname));
+		group_exprs = lappend(group_exprs, var);
+	}
+	scan_exprs = list_copy(group_exprs);
+	/*
+	 * The aggregates are computed by the python fdw, and the expressions
+	 * using them, or the grouping columns, by PostgreSQL.
+	 */
+	foreach(lc, target->exprs)
+	{
+		List	   *vars = pull_var_clause((Node *) lfirst(lc),
+										   PVC_INCLUDE_AGGREGATES |
+										   PVC_RECURSE_PLACEHOLDERS);
+		ListCell   *lc_var;
+
+		foreach(lc_var, vars)
+		{
+			Expr	   *var = (Expr *) lfirst(lc_var);
+
+			if (list_member(scan_exprs, var))
+			{
+				continue;
+			}
+			if (IsA(var, Aggref))
+			{
+				List	   *aggregate = describeAggregate(planstate, relid,
+														  (Aggref *) var);
+
+				if (aggregate == NIL)
+				{
+					return;
+				}
+				aggregates = lappend(aggregates, aggregate);
+				scan_exprs = lappend(scan_exprs, var);
+			}
+			else
+			{
+				/* A column outside of the GROUP BY */
+				return;
+			}
+		}
+	}
+	if (!canAggregate(planstate, group_by, aggregates))
+	{
+		return;
+	}
+	if (group_exprs != NIL)
+	{
+		rows = estimate_num_groups(root, group_exprs, input_rel->rows, NULL
+#if PG_VERSION_NUM >= 140000
+								   , NULL
+#endif
+			);
+	}
+	aggstate = palloc0(sizeof(MulticornPlanState));
+	aggstate->foreigntableid = planstate->foreigntableid;
+	aggstate->fdw_instance = planstate->fdw_instance;
+	aggstate->startupCost = planstate->startupCost;
+	aggstate->numattrs = list_length(scan_exprs);
+	aggstate->width = target->width;
+	aggstate->aggregate = true;
+	aggstate->relid = relid;
+	aggstate->clauses = extract_actual_clauses(input_rel->baserestrictinfo,
+											   false);
+	aggstate->group_by = group_by;
+	aggstate->aggregates = aggregates;
+	aggstate->scan_tlist = add_to_flat_tlist(NIL, scan_exprs);
+	output_rel->fdw_private = aggstate;
+#if PG_VERSION_NUM >= 120000
+	path = create_foreign_upper_path(root, output_rel, target, rows,
+									 aggstate->startupCost,
+									 aggstate->startupCost + rows * target->width,
+									 NIL,	/* no pathkeys */
+									 NULL,
+									 NULL);
+#else
+	path = create_foreignscan_path(root, output_rel, target, rows,
+								   aggstate->startupCost,
+								   aggstate->startupCost + rows * target->width,
+								   NIL,	/* no pathkeys */
+								   NULL,
+								   NULL,
+								   NULL);
+#endif
+	add_path(output_rel, (Path *) path);
+}
+#endif
+
+#if PG_VERSION_NUM < 110000
+#define RINFO_IS_PUSHED_DOWN(rinfo, joinrelids) ((rinfo)->is_pushed_down)
+#endif
+
+/*
+ * Returns the description of a join clause which can be enforced by the
+ * python fdw: a list of the name of the outer column, of the operator, and
+ * of the name of the inner column.
+ *
+ * Returns NIL for a clause which does not compare a column of each table.
+ */
+static List *
+describeJoinClause(MulticornPlanState * outerstate, Index outerrelid,
+				   MulticornPlanState * innerstate, Index innerrelid,
+				   Expr *clause)
+{
+	OpExpr	   *op = (OpExpr *) clause;
+	Var		   *left,
+			   *right;
+	Oid			opno;
+
+	if (!IsA(clause, OpExpr) || list_length(op->args) != 2)
+	{
+		return NIL;
+	}
+	left = (Var *) unnestClause(linitial(op->args));
+	right = (Var *) unnestClause(lsecond(op->args));
+	opno = op->opno;
+	if (!IsA(left, Var) || !IsA(right, Var))
+	{
+		return NIL;
+	}
+	if (left->varno == innerrelid && right->varno == outerrelid)
+	{
+		Var		   *var = left;
+
+		left = right;
+		right = var;
+		opno = get_commutator(opno);
+	}
+	if (opno == InvalidOid ||
+		left->varno != outerrelid || left->varattno < 1 ||
+		right->varno != innerrelid || right->varattno < 1)
+	{
+		return NIL;
+	}
+	return list_make3(makeString(outerstate->cinfos[left->varattno - 1]->attrname),
+					  makeString(pstrdup(getOperatorString(opno))),
+					  makeString(innerstate->cinfos[right->varattno - 1]->attrname));
+}
+
+/*
+ * multicornGetForeignJoinPaths
+ *		Add a path joining two foreign tables in the python fdw.
+ *
+ *		This is only done for SELECT queries joining two tables of the same
+ *		server and user mapping, scanned with the same python class, when
+ *		every WHERE clause of both tables is a qual and every join clause
+ *		compares a column of each table. The class can_join method decides.
+ */
+static void
+multicornGetForeignJoinPaths(PlannerInfo *root,
+							 RelOptInfo *joinrel,
+							 RelOptInfo *outerrel,
+							 RelOptInfo *innerrel,
+							 JoinType jointype,
+							 JoinPathExtraData *extra)
+{
+	MulticornPlanState *outerstate = outerrel->fdw_private;
+	MulticornPlanState *innerstate = innerrel->fdw_private;
+	MulticornPlanState *joinstate;
+	List	   *outer_exprs = NIL;
+	List	   *inner_exprs = NIL;
+	ListCell   *lc;
+	Cost		startup_cost;
+	ForeignPath *path;
+
+	if (joinrel->fdw_private != NULL ||
+		root->parse->commandType != CMD_SELECT || root->rowMarks != NIL ||
+		outerrel->reloptkind != RELOPT_BASEREL ||
+		innerrel->reloptkind != RELOPT_BASEREL ||
+		outerrel->serverid != innerrel->serverid ||
+		outerrel->userid != innerrel->userid ||
+		!bms_is_empty(joinrel->lateral_relids))
+	{
+		return;
+	}
+	joinstate = palloc0(sizeof(MulticornPlanState));
+	switch (jointype)
+	{
+		case JOIN_INNER:
+			joinstate->join_type = "inner";
+			break;
+		case JOIN_LEFT:
+			joinstate->join_type = "left";
+			break;
+		case JOIN_RIGHT:
+			joinstate->join_type = "right";
+			break;
+		case JOIN_FULL:
+			joinstate->join_type = "full";
+			break;
+		default:
+			return;
+	}
+	acquireGil();
+	/* The quals will not be rechecked, so they must all be pushed down. */
+	foreach(lc, outerrel->baserestrictinfo)
+	{
+		if (!isPushableClause(outerrel->relid,
+							  ((RestrictInfo *) lfirst(lc))->clause))
+		{
+			return;
+		}
+	}
+	foreach(lc, innerrel->baserestrictinfo)
+	{
+		if (!isPushableClause(innerrel->relid,
+							  ((RestrictInfo *) lfirst(lc))->clause))
+		{
+			return;
+		}
+	}
+	foreach(lc, extra->restrictlist)
+	{
+		RestrictInfo *rinfo = (RestrictInfo *) lfirst(lc);
+		List	   *join_qual;
+
+		/* The WHERE clauses of an outer join apply after it. */
+		if (jointype != JOIN_INNER &&
+			RINFO_IS_PUSHED_DOWN(rinfo, joinrel->relids))
+		{
+			return;
+		}
+		join_qual = describeJoinClause(outerstate, outerrel->relid,
+									   innerstate, innerrel->relid,
+									   rinfo->clause);
+		if (join_qual == NIL)
+		{
+			return;
+		}
+		joinstate->join_quals = lappend(joinstate->join_quals, join_qual);
+	}
+	/* The rows hold the needed columns of the outer table, then the inner */
+	foreach(lc, joinrel->reltarget->exprs)
+	{
+		Var		   *var = (Var *) lfirst(lc);
+
+		if (!IsA(var, Var) || var->varattno < 1)
+		{
+			return;
+		}
+		if (var->varno == outerrel->relid)
+		{
+			outer_exprs = lappend(outer_exprs, var);
+			joinstate->target_list = lappend(joinstate->target_list,
+											 makeString(outerstate->cinfos[var->varattno - 1]->attrname));
+		}
+		else
+		{
+			inner_exprs = lappend(inner_exprs, var);
+			joinstate->inner_targets = lappend(joinstate->inner_targets,
+											   makeString(innerstate->cinfos[var->varattno - 1]->attrname));
+		}
+	}
+	if (!canJoin(joinstate, outerstate, innerstate))
+	{
+		return;
+	}
+	joinstate->foreigntableid = outerstate->foreigntableid;
+	joinstate->fdw_instance = outerstate->fdw_instance;
+	joinstate->startupCost = Max(outerstate->startupCost,
+								 innerstate->startupCost);
+	joinstate->relid = outerrel->relid;
+	joinstate->clauses = extract_actual_clauses(outerrel->baserestrictinfo,
+												false);
+	joinstate->inner_relid = innerrel->relid;
+	joinstate->inner_clauses = extract_actual_clauses(innerrel->baserestrictinfo,
+													  false);
+	joinstate->scan_tlist = add_to_flat_tlist(NIL,
+											  list_concat(outer_exprs,
+														  inner_exprs));
+	joinstate->numattrs = list_length(joinstate->scan_tlist);
+	joinrel->fdw_private = joinstate;
+	startup_cost = joinstate->startupCost;
+#if PG_VERSION_NUM >= 120000
+	path = create_foreign_join_path(root, joinrel,
+									NULL,	/* default pathtarget */
+									joinrel->rows,
+									startup_cost,
+									startup_cost + joinrel->rows * joinrel->reltarget->width,
+									NIL,	/* no pathkeys */
+									NULL,
+									NULL,
+									NIL);
+#else
+	path = create_foreignscan_path(root, joinrel,
+								   NULL,	/* default pathtarget */
+								   joinrel->rows,
+								   startup_cost,
+								   startup_cost + joinrel->rows * joinrel->reltarget->width,
+								   NIL,	/* no pathkeys */
+								   NULL,
+								   NULL,
+								   NIL);
+#endif
+	add_path(joinrel, (Path *) path);
+}
+#endif
+
+/*
+ * multicornGetForeignPlan
+ *		Create a ForeignScan plan node for scanning the foreign table
+ */
+static ForeignScan *
+multicornGetForeignPlan(PlannerInfo *root,
+						RelOptInfo *baserel,
+						Oid foreigntableid,
+						ForeignPath *best_path,
+						List *tlist,
+						List *scan_clauses
+#if PG_VERSION_NUM >= 90500
+						, Plan *outer_plan
+#endif
+		)
+{
+	Index		scan_relid = baserel->relid;
+	MulticornPlanState *planstate = (MulticornPlanState *) baserel->fdw_private;
+	List	   *enforced_clauses;
+	ListCell   *lc;
+
+	acquireGil();
+#if PG_VERSION_NUM >= 90600
+	/*
+	 * A pushed down aggregation, join or limit returns the rows of its own
+	 * target list, and every qual is enforced by the python fdw.
+	 */
+	if (planstate->aggregate || planstate->join_type != NULL ||
+		planstate->pushed_limit)
+	{
+		return make_foreignscan(tlist,
+								NIL,
+								0,
+								NIL,
+								serializePlanState(planstate),
+								planstate->scan_tlist,
+								NIL,
+								outer_plan);
+	}
+	best_path->path.pathtarget->width = planstate->width;
+#endif
+	scan_clauses = extract_actual_clauses(scan_clauses, false);
+	/* Extract the quals coming from a parameterized path, if any */
+	if (best_path->path.param_info)
+	{
+
+		foreach(lc, scan_clauses)
+		{
+			extractRestrictions(baserel->relids, (Expr *) lfirst(lc),
+								&planstate->qual_list);
+		}
+	}
+	/*
+	 * The quals enforced by the python fdw are not checked again, except by
+	 * EvalPlanQual, which needs the fdw_recheck_quals of PostgreSQL 9.5.
+	 */
+#if PG_VERSION_NUM >= 90500
+	enforced_clauses = canEnforceQuals(planstate, baserel->relids,
+									   scan_clauses);
+#else
+	enforced_clauses = NIL;
+#endif
+	planstate->pathkeys = (List *) best_path->fdw_private;
+	return make_foreignscan(tlist,
+							list_difference_ptr(scan_clauses, enforced_clauses),
+							scan_relid,
+							scan_clauses,		/* no expressions to evaluate */
+							serializePlanState(planstate)
+#if PG_VERSION_NUM >= 90500
+							, NULL
+							, enforced_clauses
+							, NULL
+#endif
+							);
+}
+
+/*
+ * Show the aggregates computed by the python fdw, and their grouping columns.
+ */
+static void
+explainAggregate(MulticornExecState * execstate, ExplainState *es)
+{
+	StringInfoData aggregates;
+	StringInfoData group_by;
+	ListCell   *lc;
+
+	initStringInfo(&aggregates);
+	foreach(lc, execstate->aggregates)
+	{
+		List	   *aggregate = (List *) lfirst(lc);
+
+		appendStringInfo(&aggregates, "%s%s(%s)",
+						 aggregates.len > 0 ? ", " : "",
+						 strVal(linitial(aggregate)),
+						 lsecond(aggregate) != NULL ?
+						 strVal(lsecond(aggregate)) : "*");
+	}
+	initStringInfo(&group_by);
+	foreach(lc, execstate->group_by)
+	{
+		appendStringInfo(&group_by, "%s%s", group_by.len > 0 ? ", " : "",
+						 strVal(lfirst(lc)));
+	}
+	if (aggregates.len > 0)
+	{
+		ExplainPropertyText("Multicorn Aggregates", aggregates.data, es);
+	}
+	if (group_by.len > 0)
+	{
+		ExplainPropertyText("Multicorn Group Key", group_by.data, es);
+	}
+}
+
+/*
+ * Show the tables joined by the python fdw, and the join clauses.
+ */
+static void
+explainJoin(MulticornExecState * execstate, ExplainState *es)
+{
+	char	   *outer_name = get_rel_name(execstate->outer_table);
+	char	   *inner_name = get_rel_name(execstate->inner_table);
+	StringInfoData join_quals;
+	ListCell   *lc;
+
+	ExplainPropertyText("Multicorn Join",
+						psprintf("%s %s join %s", outer_name,
+								 execstate->join_type, inner_name),
+						es);
+	initStringInfo(&join_quals);
+	foreach(lc, execstate->join_quals)
+	{
+		List	   *join_qual = (List *) lfirst(lc);
+
+		appendStringInfo(&join_quals, "%s%s.%s %s %s.%s",
+						 join_quals.len > 0 ? " AND " : "",
+						 outer_name, strVal(linitial(join_qual)),
+						 strVal(lsecond(join_qual)),
+						 inner_name, strVal(lthird(join_qual)));
+	}
+	if (join_quals.len > 0)
+	{
+		ExplainPropertyText("Multicorn Join Quals", join_quals.data, es);
+	}
+}
+
+/*
+ * Show the LIMIT and OFFSET applied by the python fdw.
+ */
+static void
+explainLimit(MulticornExecState * execstate, ExplainState *es)
+{
+	if (execstate->limit_count >= 0)
+	{
+		ExplainPropertyText("Multicorn Limit",
+							psprintf(INT64_FORMAT, execstate->limit_count),
+							es);
+	}
+	if (execstate->limit_offset > 0)
+	{
+		ExplainPropertyText("Multicorn Offset",
+							psprintf(INT64_FORMAT, execstate->limit_offset),
+							es);
+	}
+}
+
+/*
+ * Start gathering the statistics of a scan or a modification, if its plan
+ * is instrumented by EXPLAIN ANALYZE. The calls to the python hooks are also
+ * timed for the cumulative statistics of the foreign tables, but not the
+ * iteration over the rows.
+ */
+static void
+beginScanStats(MulticornScanStats * stats, EState *estate)
+{
+	stats->enabled = estate->es_instrument != 0;
+	stats->timing = (estate->es_instrument & INSTRUMENT_TIMER) != 0;
+	if (stats->timing)
+	{
+		stats->has_gc = getGcStats(&stats->gc_collections, &stats->gc_time);
+	}
+	stats->tracked = trackTableStats();
+}
+
+/*
+ * Start measuring a step of a scan or a modification, if it is timed.
+ */
+static void
+statsStartTimer(MulticornScanStats * stats, instr_time *start)
+{
+	if (stats->timing)
+	{
+		INSTR_TIME_SET_CURRENT(*start);
+	}
+	else
+	{
+		INSTR_TIME_SET_ZERO(*start);
+	}
+}
+
+/*
+ * Add the time elapsed since statsStartTimer to one of the timers.
+ */
+static void
+statsStopTimer(MulticornScanStats * stats, instr_time *start,
+			   instr_time *timer)
+{
+	instr_time	now;
+
+	if (stats->timing)
+	{
+		INSTR_TIME_SET_CURRENT(now);
+		INSTR_TIME_ACCUM_DIFF(*timer, now, *start);
+	}
+}
+
+/*
+ * Start measuring a call to one of the hooks of the foreign table, if it is
+ * timed or counted for the table.
+ */
+static void
+statsStartHook(MulticornScanStats * stats, instr_time *start)
+{
+	if (stats->timing || stats->tracked)
+	{
+		INSTR_TIME_SET_CURRENT(*start);
+	}
+	else
+	{
+		INSTR_TIME_SET_ZERO(*start);
+	}
+}
+
+/*
+ * Add the time elapsed since statsStartHook to the time spent in python, as
+ * a call to one of the hooks of the foreign table.
+ */
+static void
+statsStopHook(MulticornScanStats * stats, instr_time *start,
+			  Oid foreigntableid, MulticornHook hook)
+{
+	instr_time	elapsed;
+
+	if (!stats->timing && !stats->tracked)
+	{
+		return;
+	}
+	INSTR_TIME_SET_CURRENT(elapsed);
+	INSTR_TIME_SUBTRACT(elapsed, *start);
+	if (stats->timing)
+	{
+		INSTR_TIME_ADD(stats->python_time, elapsed);
+	}
+	if (stats->tracked)
+	{
+		countTableHook(foreigntableid, hook, 1, &elapsed);
+	}
+}
+
+/*
+ * Count a row converted from or to python, with the size of its values.
+ */
+static void
+statsCountRow(MulticornScanStats * stats, TupleTableSlot *slot)
+{
+	stats->rows++;
+	if (stats->enabled)
+	{
+		slot_getallattrs(slot);
+		stats->bytes += heap_compute_data_size(slot->tts_tupleDescriptor,
+											   slot->tts_values,
+											   slot->tts_isnull);
+	}
+}
+
+/*
+ * Add the rows returned since the last time to the cumulative statistics of
+ * the foreign table. This is done once per scan pass, and not once per row.
+ */
+static void
+flushTableStats(MulticornExecState * execstate)
+{
+	if (!execstate->stats.tracked ||
+		execstate->stats.rows == execstate->flushed_rows)
+	{
+		return;
+	}
+	countTableRows(execstate->foreigntableid,
+				   execstate->stats.rows - execstate->flushed_rows);
+	execstate->flushed_rows = execstate->stats.rows;
+}
+
+/*
+ * Show the statistics of an instrumented scan or modification, followed by
+ * the ones returned by the get_scan_stats method of the python fdw.
+ */
+static void
+explainScanStats(PyObject *fdw_instance, MulticornScanStats * stats,
+				 bool scan, ExplainState *es)
+{
+	ListCell   *lc;
+
+	if (!es->analyze || !stats->enabled)
+	{
+		return;
+	}
+	if (scan)
+	{
+		ExplainPropertyText("Multicorn Executes",
+							psprintf("%ld", stats->executes), es);
+		ExplainPropertyText("Multicorn Rescans",
+							psprintf("%ld", stats->rescans), es);
+	}
+	ExplainPropertyText("Multicorn Rows", psprintf("%ld", stats->rows), es);
+	ExplainPropertyText("Multicorn Bytes",
+						psprintf(UINT64_FORMAT, stats->bytes), es);
+	if (es->timing && stats->timing)
+	{
+		long		gc_collections;
+		double		gc_time;
+
+		ExplainPropertyText("Multicorn Python Time",
+							psprintf("%.3f ms",
+									 INSTR_TIME_GET_MILLISEC(stats->python_time)),
+							es);
+		ExplainPropertyText("Multicorn Conversion Time",
+							psprintf("%.3f ms",
+									 INSTR_TIME_GET_MILLISEC(stats->conversion_time)),
+							es);
+		if (stats->has_gc && getGcStats(&gc_collections, &gc_time))
+		{
+			ExplainPropertyText("Multicorn GC Pauses",
+								psprintf("%ld (%.3f ms)",
+										 gc_collections - stats->gc_collections,
+										 gc_time - stats->gc_time),
+								es);
+		}
+	}
+	foreach(lc, getScanStats(fdw_instance))
+	{
+		List	   *stat = (List *) lfirst(lc);
+
+		ExplainPropertyText(psprintf("Multicorn %s", strVal(linitial(stat))),
+							strVal(lsecond(stat)), es);
+	}
+}
+
+/*
+ * Start the python scan, by calling the execute method of the fdw.
+ */
+static void
+startPythonScan(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	instr_time	start;
+
+	setCurrentTableStats(execstate->foreigntableid);
+	statsStartHook(&execstate->stats, &start);
+	execute(node, NULL);
+	statsStopHook(&execstate->stats, &start, execstate->foreigntableid,
+				  MULTICORN_HOOK_EXECUTE);
+	execstate->stats.executes++;
+}
+
+/*
+ * multicornExplainForeignScan
+ *		Placeholder for additional "EXPLAIN" information.
+ *		This should (at least) output the python class name, as well
+ *		as information that was taken into account for the choice of a path.
+ *		Under EXPLAIN ANALYZE, the statistics of the scan follow.
+ */
+static void
+multicornExplainForeignScan(ForeignScanState *node, ExplainState *es)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	PyObject *p_iterable,
+			 *p_item,
+			 *p_str;
+
+	acquireGil();
+	if (execstate->aggregate)
+	{
+		explainAggregate(execstate, es);
+	}
+	else if (execstate->join_type != NULL)
+	{
+		explainJoin(execstate, es);
+	}
+	else
+	{
+		if (execstate->pushed_limit)
+		{
+			explainLimit(execstate, es);
+		}
+		p_iterable = execute(node, es);
+		Py_INCREF(p_iterable);
+		while((p_item = PyIter_Next(p_iterable))){
+			p_str = PyObject_Str(p_item);
+			ExplainPropertyText("Multicorn", PyString_AsString(p_str), es);
+			Py_DECREF(p_str);
+		}
+		Py_DECREF(p_iterable);
+		errorCheck();
+	}
+	explainScanStats(execstate->fdw_instance, &execstate->stats, true, es);
+}
+
+/*
+ * Prepare the quals on a table scanned by an aggregate or join pushdown,
+ * from its WHERE clauses.
+ *
+ * Returns the conversion info of the table columns, and sets the oid of the
+ * table.
+ */
+static ConversionInfo **
+beginScannedTable(ForeignScanState *node, Index relid, List *clauses,
+				  List **quals, Oid *foreigntableid)
+{
+	ConversionInfo **cinfos;
+	Relation	rel;
+	ListCell   *lc;
+
+	foreach(lc, clauses)
+	{
+		extractRestrictions(bms_make_singleton(relid), ((Expr *) lfirst(lc)),
+							quals);
+	}
+	*foreigntableid = getrelid(relid, node->ss.ps.state->es_range_table);
+	rel = RelationIdGetRelation(*foreigntableid);
+	cinfos = palloc0(sizeof(ConversionInfo *) *
+					 RelationGetNumberOfAttributes(rel));
+	initConversioninfo(cinfos,
+					   TupleDescGetAttInMetadata(CreateTupleDescCopy(RelationGetDescr(rel))));
+	RelationClose(rel);
+	return cinfos;
+}
+
+/*
+ * Prepare the late materialization of the rows of a scan: the columns used
+ * by its local quals are converted first, and the other needed columns only
+ * for the rows matching those quals.
+ *
+ * The rows are checked again by PostgreSQL, so volatile quals are left out.
+ * Quals using the whole row or a system column are left out too.
+ */
+static void
+beginLateMaterialization(ForeignScan *fscan, MulticornExecState * execstate)
+{
+	Bitmapset  *attrs = NULL;
+	int			k;
+
+	if (fscan->scan.plan.qual == NIL ||
+		contain_volatile_functions((Node *) fscan->scan.plan.qual))
+	{
+		return;
+	}
+	pull_varattnos((Node *) fscan->scan.plan.qual, fscan->scan.scanrelid,
+				   &attrs);
+	execstate->filter_projection = palloc(sizeof(int) * execstate->nprojected);
+	execstate->rest_projection = palloc(sizeof(int) * execstate->nprojected);
+	for (k = 0; k < execstate->nprojected; k++)
+	{
+		int			i = execstate->projection[k];
+
+		if (bms_is_member(i + 1 - FirstLowInvalidHeapAttributeNumber, attrs))
+		{
+			execstate->filter_projection[execstate->nfilter_projected++] = i;
+		}
+		else
+		{
+			execstate->rest_projection[execstate->nrest_projected++] = i;
+		}
+	}
+	if (execstate->nrest_projected == 0 ||
+		bms_num_members(attrs) != execstate->nfilter_projected)
+	{
+		pfree(execstate->filter_projection);
+		pfree(execstate->rest_projection);
+		execstate->filter_projection = NULL;
+		execstate->rest_projection = NULL;
+		return;
+	}
+	execstate->filter_values = palloc(sizeof(Datum) *
+									  execstate->nfilter_projected);
+	execstate->filter_nulls = palloc(sizeof(bool) *
+									 execstate->nfilter_projected);
+}
+
+/*
+ * Returns true if one of the quals compares a column to a parameter, whose
+ * value is only known at execution time.
+ */
+static bool
+hasParamQual(List *qual_list)
+{
+	ListCell   *lc;
+
+	foreach(lc, qual_list)
+	{
+		if (((MulticornBaseQual *) lfirst(lc))->right_type == T_Param)
+		{
+			return true;
+		}
+	}
+	return false;
+}
+
+/*
+ *	multicornBeginForeignScan
+ *		Initialize the foreign scan.
+ *		This (primarily) involves :
+ *			- retrieving cached info from the plan phase
+ *			- initializing various buffers
+ */
+static void
+multicornBeginForeignScan(ForeignScanState *node, int eflags)
+{
+	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
+	MulticornExecState *execstate;
+	/* The scan of a join or upper relation returns its fdw_scan_tlist rows */
+	TupleDesc	tupdesc = node->ss.ss_ScanTupleSlot->tts_tupleDescriptor;
+	Oid			foreigntableid;
+	ListCell   *lc;
+	int			i;
+
+	acquireGil();
+	execstate = initializeExecState(fscan->fdw_private);
+	execstate->values = palloc(sizeof(Datum) * tupdesc->natts);
+	execstate->nulls = palloc(sizeof(bool) * tupdesc->natts);
+	execstate->qual_list = NULL;
+	if (fscan->scan.scanrelid > 0)
+	{
+		foreigntableid = RelationGetRelid(node->ss.ss_currentRelation);
+		execstate->clauses = fscan->fdw_exprs;
+		foreach(lc, fscan->fdw_exprs)
+		{
+			extractRestrictions(bms_make_singleton(fscan->scan.scanrelid),
+								((Expr *) lfirst(lc)),
+								&execstate->qual_list);
+		}
+	}
+	else
+	{
+		/* The quals are converted with the columns of the scanned table. */
+		List	   *scanned = (List *) list_nth(fscan->fdw_private, 4);
+
+		execstate->qual_cinfos = beginScannedTable(node,
+												   intVal(linitial(scanned)),
+												   lsecond(scanned),
+												   &execstate->qual_list,
+												   &foreigntableid);
+		execstate->outer_table = foreigntableid;
+	}
+	if (execstate->join_type != NULL)
+	{
+		List	   *join = (List *) list_nth(fscan->fdw_private, 6);
+
+		execstate->inner_cinfos = beginScannedTable(node,
+													intVal(lthird(join)),
+													lfourth(join),
+													&execstate->inner_qual_list,
+													&execstate->inner_table);
+	}
+	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(tupdesc));
+	initConversioninfoKeys(execstate->cinfos, tupdesc->natts);
+	/*
+	 * Only the columns from the target list are read from the python rows,
+	 * the others are left NULL.
+	 */
+	execstate->projection = palloc(sizeof(int) * tupdesc->natts);
+	execstate->nprojected = 0;
+	for (i = 0; i < tupdesc->natts; i++)
+	{
+		ConversionInfo *cinfo = execstate->cinfos[i];
+
+		if (cinfo == NULL)
+		{
+			continue;
+		}
+		/* Aggregated or joined rows are sequences of every column. */
+		if (execstate->aggregate || execstate->join_type != NULL)
+		{
+			execstate->projection[execstate->nprojected++] = i;
+			continue;
+		}
+		foreach(lc, execstate->target_list)
+		{
+			if (strcmp(strVal(lfirst(lc)), cinfo->attrname) == 0)
+			{
+				execstate->projection[execstate->nprojected++] = i;
+				break;
+			}
+		}
+	}
+	execstate->batch_execute = getBooleanAttribute(execstate->fdw_instance,
+												   "_batch_execute");
+	execstate->projected_rows = execstate->aggregate ||
+		execstate->join_type != NULL ||
+		getBooleanAttribute(execstate->fdw_instance, "_projected_rows");
+	execstate->single_producer = getBooleanAttribute(execstate->fdw_instance,
+													 "_single_producer");
+	execstate->prefetch_rows = getPrefetchRows(foreigntableid);
+	execstate->structured_quals = getBooleanAttribute(execstate->fdw_instance,
+													  "_structured_quals");
+	if (fscan->scan.scanrelid > 0 &&
+		getBooleanAttribute(execstate->fdw_instance, "_late_materialization"))
+	{
+		for (i = 0; i < tupdesc->natts; i++)
+		{
+			if (execstate->cinfos[i] != NULL)
+			{
+				execstate->cinfos[i]->lazy = true;
+			}
+		}
+		/* Projected sequences only hold the columns in projection order. */
+		if (!execstate->projected_rows)
+		{
+			beginLateMaterialization(fscan, execstate);
+		}
+	}
+	/*
+	 * The rows of a parameterized scan are cached for each set of parameter
+	 * values, unless they must be sorted or projected. The OrderedDict lets
+	 * _lookup drop the least recently used ones.
+	 */
+	if (hasParamQual(execstate->qual_list) && !execstate->projected_rows &&
+		!execstate->batch_execute && execstate->pathkeys == NIL &&
+		getBooleanAttribute(execstate->fdw_instance, "_cache_lookups"))
+	{
+		PyObject   *p_class = getClassString("collections.OrderedDict");
+
+		execstate->p_lookups = PyObject_CallObject(p_class, NULL);
+		Py_DECREF(p_class);
+		errorCheck();
+	}
+	beginScanStats(&execstate->stats, node->ss.ps.state);
+#if PG_VERSION_NUM >= 90500
+	execstate->columnar_callback.func = releaseColumnarBatch;
+	execstate->columnar_callback.arg = execstate;
+	MemoryContextRegisterResetCallback(node->ss.ps.state->es_query_cxt,
+									   &execstate->columnar_callback);
+#endif
+	node->fdw_state = execstate;
+}
+
+#if PG_VERSION_NUM >= 90500
+/*
+ * Release the columnar batch of a scan when its query is torn down without
+ * multicornEndForeignScan being called, as after an error: the buffers
+ * exported by the batch would otherwise stay locked in python.
+ */
+static void
+releaseColumnarBatch(void *arg)
+{
+	MulticornExecState *execstate = arg;
+
+	if (execstate->columnar != NULL)
+	{
+		acquireGil();
+		endColumnarBatch(execstate->columnar);
+		execstate->columnar = NULL;
+	}
+}
+#endif
+
+/*
+ * Returns the next row from a batched scan, as a new reference, or NULL once
+ * every batch has been consumed. A ColumnBatch yielded in place of a batch is
+ * returned as is.
+ *
+ * The rows are read from the current batch until it is exhausted, and only
+ * then is the next one requested from the python iterator.
+ */
+static PyObject *
+nextBatchedRow(MulticornExecState * execstate)
+{
+	PyObject   *p_value;
+
+	while (execstate->p_batch == NULL ||
+		   execstate->batch_index >= PySequence_Fast_GET_SIZE(execstate->p_batch))
+	{
+		PyObject   *p_next;
+
+		Py_CLEAR(execstate->p_batch);
+		p_next = PyIter_Next(execstate->p_iterator);
+		errorCheck();
+		if (p_next == NULL || isColumnBatch(p_next))
+		{
+			/* Columnar batches are read by the caller. */
+			return p_next;
+		}
+		execstate->p_batch = PySequence_Fast(p_next,
+								"execute_batches must yield sequences of rows");
+		Py_DECREF(p_next);
+		errorCheck();
+		execstate->batch_index = 0;
+	}
+	p_value = PySequence_Fast_GET_ITEM(execstate->p_batch,
+									   execstate->batch_index);
+	Py_INCREF(p_value);
+	execstate->batch_index++;
+	return p_value;
+}
+
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * Claim the next partition of a parallel scan not yet taken by another
+ * participant, and start scanning it.
+ * Returns false once every partition has been claimed.
+ */
+static bool
+beginNextPartition(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	MulticornParallelScanState *pscan = execstate->pscan;
+
+	for (;;)
+	{
+		uint32		index = pg_atomic_fetch_add_u32(&pscan->next_partition, 1);
+
+		Py_CLEAR(execstate->p_iterator);
+		Py_CLEAR(execstate->p_partition);
+		if (index >= pscan->npartitions)
+		{
+			return false;
+		}
+		execstate->p_partition = PyList_GetItem(execstate->p_partitions, index);
+		Py_INCREF(execstate->p_partition);
+		startPythonScan(node);
+		/* Skip the partitions for which no iterator is returned. */
+		if (execstate->p_iterator != Py_None)
+		{
+			return true;
+		}
+	}
+}
+#endif
+
+#if PG_VERSION_NUM >= 100000
+/*
+ * Returns true if the next row of a scan can be read without waiting for its
+ * background iterator.
+ */
+static bool
+scanRowReady(MulticornExecState * execstate)
+{
+	if (execstate->columnar != NULL &&
+		execstate->columnar->index < execstate->columnar->length)
+	{
+		return true;
+	}
+	if (execstate->p_batch != NULL &&
+		execstate->batch_index < PySequence_Fast_GET_SIZE(execstate->p_batch))
+	{
+		return true;
+	}
+	return backgroundRowReady(execstate);
+}
+
+/*
+ * Wait until the background iterator has a row ready. The GIL is released
+ * meanwhile, and the wait is interrupted by a query cancellation.
+ */
+static void
+waitForBackgroundRow(MulticornExecState * execstate)
+{
+	while (!scanRowReady(execstate))
+	{
+		int			fd = backgroundFileno(execstate);
+
+		releaseGil();
+		WaitLatchOrSocket(MyLatch,
+						  WL_LATCH_SET | WL_SOCKET_READABLE | WL_POSTMASTER_DEATH,
+						  fd, -1L, PG_WAIT_EXTENSION);
+		ResetLatch(MyLatch);
+		CHECK_FOR_INTERRUPTS();
+		acquireGil();
+	}
+}
+#endif
+
+/*
+ * Convert the columns used by the local quals of a late materialized scan,
+ * and check the row against those quals.
+ */
+static bool
+rowMatchesLocalQuals(ForeignScanState *node, PyObject *p_value)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
+	ExprContext *econtext = node->ss.ps.ps_ExprContext;
+	bool		matches;
+	instr_time	start;
+
+	statsStartTimer(&execstate->stats, &start);
+	pythonResultToTuple(p_value, slot, execstate->cinfos,
+						execstate->filter_projection,
+						execstate->nfilter_projected, execstate->buffer);
+	statsStopTimer(&execstate->stats, &start,
+				   &execstate->stats.conversion_time);
+	ExecStoreVirtualTuple(slot);
+	econtext->ecxt_scantuple = slot;
+#if PG_VERSION_NUM >= 100000
+	matches = ExecQual(node->ss.ps.qual, econtext);
+#else
+	matches = ExecQual(node->ss.ps.qual, econtext, false);
+#endif
+	ExecClearTuple(slot);
+	if (!matches)
+	{
+		/* Forget the converted values. */
+		ResetExprContext(econtext);
+		InstrCountFiltered1(node, 1);
+	}
+	return matches;
+}
+
+/*
+ * Convert the columns of a late materialized row not used by the local
+ * quals, keeping the ones already converted.
+ */
+static void
+materializeRow(MulticornExecState * execstate, PyObject *p_value,
+			   TupleTableSlot *slot)
+{
+	int			k;
+
+	for (k = 0; k < execstate->nfilter_projected; k++)
+	{
+		int			i = execstate->filter_projection[k];
+
+		execstate->filter_values[k] = slot->tts_values[i];
+		execstate->filter_nulls[k] = slot->tts_isnull[i];
+	}
+	pythonResultToTuple(p_value, slot, execstate->cinfos,
+						execstate->rest_projection,
+						execstate->nrest_projected, execstate->buffer);
+	for (k = 0; k < execstate->nfilter_projected; k++)
+	{
+		int			i = execstate->filter_projection[k];
+
+		slot->tts_values[i] = execstate->filter_values[k];
+		slot->tts_isnull[i] = execstate->filter_nulls[k];
+	}
+}
+
+/*
+ * Retrieve the next row from the python iterator, or clear the tuple slot to
+ * indicate EOF.
+ */
+static TupleTableSlot *
+iteratePythonRows(ForeignScanState *node)
+{
+	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
+	MulticornExecState *execstate = node->fdw_state;
+	PyObject   *p_value;
+	instr_time	start;
+
+	if (execstate->p_iterator == NULL)
+	{
+#if PG_VERSION_NUM >= 90600
+		if (execstate->pscan != NULL)
+		{
+			if (!beginNextPartition(node))
+			{
+				return ExecClearTuple(slot);
+			}
+		}
+		else
+#endif
+			startPythonScan(node);
+	}
+	ExecClearTuple(slot);
+	if (execstate->p_iterator == Py_None)
+	{
+		/* No iterator returned from get_iterator, it is released at the end */
+		return slot;
+	}
+	slot->tts_values = execstate->values;
+	slot->tts_isnull = execstate->nulls;
+	for (;;)
+	{
+		MemoryContext oldcontext;
+
+		if (execstate->columnar != NULL)
+		{
+			bool		found;
+
+			statsStartTimer(&execstate->stats, &start);
+#if PG_VERSION_NUM >= 90500
+			found = columnarBatchToTuple(execstate->columnar, slot,
+										 execstate->cinfos, execstate->buffer);
+#else
+			/* Without reset callbacks, release the batch on error here. */
+			PG_TRY();
+			{
+				found = columnarBatchToTuple(execstate->columnar, slot,
+											 execstate->cinfos,
+											 execstate->buffer);
+			}
+			PG_CATCH();
+			{
+				endColumnarBatch(execstate->columnar);
+				execstate->columnar = NULL;
+				PG_RE_THROW();
+			}
+			PG_END_TRY();
+#endif
+			statsStopTimer(&execstate->stats, &start,
+						   &execstate->stats.conversion_time);
+			if (found)
+			{
+				ExecStoreVirtualTuple(slot);
+				statsCountRow(&execstate->stats, slot);
+				return slot;
+			}
+			endColumnarBatch(execstate->columnar);
+			execstate->columnar = NULL;
+		}
+		statsStartTimer(&execstate->stats, &start);
+#if PG_VERSION_NUM >= 100000
+		if (execstate->background)
+		{
+			waitForBackgroundRow(execstate);
+		}
+#endif
+		if (execstate->batch_execute)
+		{
+			p_value = nextBatchedRow(execstate);
+		}
+		else
+		{
+			p_value = PyIter_Next(execstate->p_iterator);
+			errorCheck();
+		}
+		statsStopTimer(&execstate->stats, &start,
+					   &execstate->stats.python_time);
+#if PG_VERSION_NUM >= 90600
+		/* Once a partition is exhausted, go on with the next one. */
+		if (p_value == NULL && execstate->pscan != NULL &&
+			beginNextPartition(node))
+		{
+			continue;
+		}
+#endif
+		if (!isColumnBatch(p_value))
+		{
+			/* Skip the rows a late materialized scan would filter out. */
+			if (execstate->filter_projection != NULL && p_value != NULL &&
+				p_value != Py_None && !rowMatchesLocalQuals(node, p_value))
+			{
+				Py_DECREF(p_value);
+				continue;
+			}
+			break;
+		}
+		/* The batch outlives the per-tuple context we are called in. */
+		oldcontext = MemoryContextSwitchTo(node->ss.ps.state->es_query_cxt);
+		execstate->columnar = beginColumnarBatch(p_value, execstate->cinfos,
+									   slot->tts_tupleDescriptor->natts,
+									   execstate->projection,
+									   execstate->nprojected);
+		MemoryContextSwitchTo(oldcontext);
+		Py_DECREF(p_value);
+	}
+	/* A none value results in an empty slot. */
+	if (p_value == NULL || p_value == Py_None)
+	{
+		Py_XDECREF(p_value);
+		return slot;
+	}
+	statsStartTimer(&execstate->stats, &start);
+	if (execstate->filter_projection != NULL)
+	{
+		materializeRow(execstate, p_value, slot);
+	}
+	else if (execstate->projected_rows)
+	{
+		pythonProjectedResultToTuple(p_value, slot, execstate->cinfos,
+									 execstate->projection,
+									 execstate->nprojected,
+									 execstate->buffer);
+	}
+	else
+	{
+		pythonResultToTuple(p_value, slot, execstate->cinfos,
+							execstate->projection, execstate->nprojected,
+							execstate->buffer);
+	}
+	statsStopTimer(&execstate->stats, &start,
+				   &execstate->stats.conversion_time);
+	ExecStoreVirtualTuple(slot);
+	statsCountRow(&execstate->stats, slot);
+	Py_DECREF(p_value);
+
+	return slot;
+}
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * Returns the shared queue of the given worker.
+ */
+static shm_mq *
+getSharedQueue(MulticornSharedQueues * queues, int index)
+{
+	char	   *start = (char *) queues +
+		MAXALIGN(offsetof(MulticornSharedQueues, wanted) +
+				 sizeof(pg_atomic_uint32) * queues->nqueues);
+
+	return (shm_mq *) (start + (Size) index * MULTICORN_QUEUE_SIZE);
+}
+
+/*
+ * The leader's queues are detached along with the dynamic shared memory
+ * segment, which may happen before the end of the scan.
+ */
+static void
+forgetSharedQueues(dsm_segment *seg, Datum arg)
+{
+	MulticornExecState *execstate = (MulticornExecState *) DatumGetPointer(arg);
+
+	execstate->queue_handles = NULL;
+	execstate->queues = NULL;
+}
+
+/*
+ * Create the shared queues, and attach the leader to them as the sender.
+ */
+static void
+initSharedQueues(MulticornExecState * execstate, ParallelContext *pcxt)
+{
+	MulticornSharedQueues *queues = execstate->queues;
+	int			i;
+
+	execstate->queue_handles = palloc(sizeof(shm_mq_handle *) *
+									  queues->nqueues);
+	for (i = 0; i < queues->nqueues; i++)
+	{
+		shm_mq	   *mq = shm_mq_create(getSharedQueue(queues, i),
+									   MULTICORN_QUEUE_SIZE);
+
+		pg_atomic_init_u32(&queues->wanted[i], 0);
+		shm_mq_set_sender(mq, MyProc);
+		execstate->queue_handles[i] = shm_mq_attach(mq, pcxt->seg, NULL);
+	}
+	on_dsm_detach(pcxt->seg, forgetSharedQueues, PointerGetDatum(execstate));
+	execstate->next_consumer = 0;
+	execstate->queue_done = false;
+}
+
+static void
+detachSharedQueue(shm_mq_handle *handle)
+{
+#if PG_VERSION_NUM >= 100000
+	shm_mq_detach(handle);
+#else
+	shm_mq_detach(shm_mq_get_queue(handle));
+#endif
+}
+
+/*
+ * Detach from the shared queues, letting the workers know that there are no
+ * more rows.
+ */
+static void
+detachSharedQueues(MulticornExecState * execstate)
+{
+	int			i;
+
+	if (execstate->queue_handles != NULL)
+	{
+		for (i = 0; i < execstate->queues->nqueues; i++)
+		{
+			detachSharedQueue(execstate->queue_handles[i]);
+		}
+		pfree(execstate->queue_handles);
+		execstate->queue_handles = NULL;
+	}
+	if (execstate->queue_handle != NULL)
+	{
+		detachSharedQueue(execstate->queue_handle);
+		execstate->queue_handle = NULL;
+	}
+}
+
+/*
+ * Leader side of a single producer scan.
+ *
+ * Every row read from python is sent to a worker waiting for one, if any, or
+ * else returned to the leader's own plan. Sending only to waiting workers
+ * means that the leader never waits on a full queue, which could deadlock
+ * with a worker itself waiting for the leader to read its output.
+ */
+static TupleTableSlot *
+produceSharedRow(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	MulticornSharedQueues *queues = execstate->queues;
+	TupleTableSlot *slot;
+
+	/* Once the scan was shut down, the leader keeps every row. */
+	if (execstate->queue_handles == NULL)
+	{
+		return iteratePythonRows(node);
+	}
+	for (;;)
+	{
+		HeapTuple	tuple;
+		shm_mq_result result = SHM_MQ_DETACHED;
+		int			i;
+
+		slot = iteratePythonRows(node);
+		if (TupIsNull(slot))
+		{
+			detachSharedQueues(execstate);
+			return slot;
+		}
+		for (i = 0; i < queues->nqueues; i++)
+		{
+			int			consumer = (execstate->next_consumer + i) % queues->nqueues;
+
+			if (pg_atomic_exchange_u32(&queues->wanted[consumer], 0) == 0)
+			{
+				continue;
+			}
+			execstate->next_consumer = consumer + 1;
+			/* The worker is waiting on its queue, so this does not block. */
+			tuple = heap_form_tuple(slot->tts_tupleDescriptor,
+									slot->tts_values, slot->tts_isnull);
+			result = shm_mq_send(execstate->queue_handles[consumer],
+								 tuple->t_len, tuple->t_data, false);
+			heap_freetuple(tuple);
+			break;
+		}
+		/* Keep the row if no worker took it. */
+		if (result != SHM_MQ_SUCCESS)
+		{
+			return slot;
+		}
+	}
+}
+
+/*
+ * Worker side of a single producer scan: wait for the leader to send a row.
+ */
+static TupleTableSlot *
+consumeSharedRow(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	MulticornSharedQueues *queues = execstate->queues;
+	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
+	HeapTupleData tuple;
+	Size		nbytes;
+	void	   *data;
+
+	ExecClearTuple(slot);
+	if (execstate->queue_done)
+	{
+		return slot;
+	}
+	if (execstate->queue_handle == NULL)
+	{
+		shm_mq	   *mq = getSharedQueue(queues, ParallelWorkerNumber);
+		MemoryContext oldcontext;
+
+		shm_mq_set_receiver(mq, MyProc);
+		oldcontext = MemoryContextSwitchTo(node->ss.ps.state->es_query_cxt);
+		execstate->queue_handle = shm_mq_attach(mq, NULL, NULL);
+		MemoryContextSwitchTo(oldcontext);
+	}
+	pg_atomic_write_u32(&queues->wanted[ParallelWorkerNumber], 1);
+	if (shm_mq_receive(execstate->queue_handle, &nbytes, &data, false) !=
+		SHM_MQ_SUCCESS)
+	{
+		/* The leader detached: every row has been read. */
+		detachSharedQueues(execstate);
+		execstate->queue_done = true;
+		return slot;
+	}
+	tuple.t_len = nbytes;
+	tuple.t_data = (HeapTupleHeader) data;
+	ItemPointerSetInvalid(&tuple.t_self);
+	tuple.t_tableOid = InvalidOid;
+	heap_deform_tuple(&tuple, slot->tts_tupleDescriptor,
+					  execstate->values, execstate->nulls);
+	slot->tts_values = execstate->values;
+	slot->tts_isnull = execstate->nulls;
+	ExecStoreVirtualTuple(slot);
+	return slot;
+}
+#endif
+
+/*
+ * multicornIterateForeignScan
+ *		Retrieve next row from the result set, or clear tuple slot to indicate
+ *		EOF.
+ *
+ *		This is done by iterating over the result from the "execute" python
+ *		method. In a single producer parallel scan, only the leader does so,
+ *		and the workers receive their rows from it.
+ */
+static TupleTableSlot *
+multicornIterateForeignScan(ForeignScanState *node)
+{
+#if PG_VERSION_NUM >= 90600
+	MulticornExecState *execstate = node->fdw_state;
+#endif
+
+	acquireGil();
+#if PG_VERSION_NUM >= 90600
+	if (execstate->queues != NULL)
+	{
+		if (IsParallelWorker())
+		{
+			return consumeSharedRow(node);
+		}
+		return produceSharedRow(node);
+	}
+#endif
+	return iteratePythonRows(node);
+}
+
+/*
+ * multicornReScanForeignScan
+ *		Restart the scan
+ */
+static void
+multicornReScanForeignScan(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+
+	acquireGil();
+	closeIterator(state);
+	flushTableStats(state);
+	state->stats.rescans++;
+	Py_CLEAR(state->p_batch);
+	Py_CLEAR(state->p_partition);
+	if (state->columnar != NULL)
+	{
+		endColumnarBatch(state->columnar);
+		state->columnar = NULL;
+	}
+#if PG_VERSION_NUM >= 90600
+	detachSharedQueues(state);
+	state->queue_done = false;
+#endif
+}
+
+/*
+ *	multicornEndForeignScan
+ *		Finish scanning foreign table and dispose objects used for this scan.
+ */
+static void
+multicornEndForeignScan(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *result;
+
+	acquireGil();
+	closeIterator(state);
+	flushTableStats(state);
+	result = PyObject_CallMethod(state->fdw_instance, "end_scan", "()");
+	errorCheck();
+	Py_DECREF(result);
+	releaseConversioninfoKeys(state->cinfos,
+				node->ss.ss_ScanTupleSlot->tts_tupleDescriptor->natts);
+	Py_DECREF(state->fdw_instance);
+	Py_CLEAR(state->p_batch);
+	Py_CLEAR(state->p_partition);
+	Py_CLEAR(state->p_partitions);
+	Py_CLEAR(state->p_lookups);
+	if (state->columnar != NULL)
+	{
+		endColumnarBatch(state->columnar);
+		state->columnar = NULL;
+	}
+#if PG_VERSION_NUM >= 90600
+	detachSharedQueues(state);
+#endif
+}
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * multicornIsForeignScanParallelSafe
+ *		Foreign tables can be scanned from parallel workers if the python fdw
+ *		asked for parallel workers.
+ */
+static bool
+multicornIsForeignScanParallelSafe(PlannerInfo *root, RelOptInfo *rel,
+								   RangeTblEntry *rte)
+{
+	acquireGil();
+	return getIntegerAttribute(getInstance(rte->relid), "_parallel_workers") > 0;
+}
+
+/*
+ * multicornEstimateDSMForeignScan
+ *		Ask the python fdw for the partitions of a parallel scan, and
+ *		compute the size of the shared state holding them.
+ *		A single producer scan needs a queue for each worker instead.
+ */
+static Size
+multicornEstimateDSMForeignScan(ForeignScanState *node, ParallelContext *pcxt)
+{
+	MulticornExecState *execstate = node->fdw_state;
+
+	acquireGil();
+	if (execstate->single_producer)
+	{
+		return add_size(MAXALIGN(offsetof(MulticornSharedQueues, wanted) +
+								 sizeof(pg_atomic_uint32) * pcxt->nworkers),
+						mul_size(MULTICORN_QUEUE_SIZE, pcxt->nworkers));
+	}
+	Py_XDECREF(execstate->p_partitions);
+	execstate->p_partitions = getPartitions(node);
+	execstate->pickled_partitions = pickleObject(execstate->p_partitions,
+												 &execstate->pickled_length);
+	return add_size(offsetof(MulticornParallelScanState, data),
+					execstate->pickled_length);
+}
+
+/*
+ * multicornInitializeDSMForeignScan
+ *		Store the partitions in the shared state, for the workers, or set
+ *		up the queues of a single producer scan.
  */
 static void
-multicornExplainForeignScan(ForeignScanState *node, ExplainState *es)
+multicornInitializeDSMForeignScan(ForeignScanState *node,
+								  ParallelContext *pcxt,
+								  void *coordinate)
 {
-	PyObject *p_iterable = execute(node, es),
-			 *p_item,
-			 *p_str;
-	Py_INCREF(p_iterable);
-	while((p_item = PyIter_Next(p_iterable))){
-		p_str = PyObject_Str(p_item);
-		ExplainPropertyText("Multicorn", PyString_AsString(p_str), es);
-		Py_DECREF(p_str);
+	MulticornExecState *execstate = node->fdw_state;
+	MulticornParallelScanState *pscan = coordinate;
+
+	acquireGil();
+	if (execstate->single_producer)
+	{
+		execstate->queues = coordinate;
+		execstate->queues->nqueues = pcxt->nworkers;
+		initSharedQueues(execstate, pcxt);
+		return;
 	}
-	Py_DECREF(p_iterable);
-	errorCheck();
+	pg_atomic_init_u32(&pscan->next_partition, 0);
+	pscan->npartitions = PyList_Size(execstate->p_partitions);
+	pscan->length = execstate->pickled_length;
+	memcpy(pscan->data, execstate->pickled_partitions, pscan->length);
+	execstate->pscan = pscan;
+	/* Partitions are scanned row by row. */
+	execstate->batch_execute = false;
 }
 
+#if PG_VERSION_NUM >= 100000
 /*
- *	multicornBeginForeignScan
- *		Initialize the foreign scan.
- *		This (primarily) involves :
- *			- retrieving cached info from the plan phase
- *			- initializing various buffers
+ * multicornReInitializeDSMForeignScan
+ *		Hand out the partitions from the start again, or create new queues,
+ *		for a rescan.
  */
 static void
-multicornBeginForeignScan(ForeignScanState *node, int eflags)
+multicornReInitializeDSMForeignScan(ForeignScanState *node,
+									ParallelContext *pcxt,
+									void *coordinate)
 {
-	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
-	MulticornExecState *execstate;
-	TupleDesc	tupdesc = RelationGetDescr(node->ss.ss_currentRelation);
-	ListCell   *lc;
+	MulticornExecState *execstate = node->fdw_state;
+	MulticornParallelScanState *pscan = coordinate;
 
-	execstate = initializeExecState(fscan->fdw_private);
-	execstate->values = palloc(sizeof(Datum) * tupdesc->natts);
-	execstate->nulls = palloc(sizeof(bool) * tupdesc->natts);
-	execstate->qual_list = NULL;
-	foreach(lc, fscan->fdw_exprs)
+	if (execstate->single_producer)
 	{
-		extractRestrictions(bms_make_singleton(fscan->scan.scanrelid),
-							((Expr *) lfirst(lc)),
-							&execstate->qual_list);
+		initSharedQueues(execstate, pcxt);
+		return;
 	}
-	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(tupdesc));
-	node->fdw_state = execstate;
+	pg_atomic_write_u32(&pscan->next_partition, 0);
 }
-
+#endif
 
 /*
- * multicornIterateForeignScan
- *		Retrieve next row from the result set, or clear tuple slot to indicate
- *		EOF.
- *
- *		This is done by iterating over the result from the "execute" python
- *		method.
+ * multicornInitializeWorkerForeignScan
+ *		Read the partitions from the shared state, in a worker.
  */
-static TupleTableSlot *
-multicornIterateForeignScan(ForeignScanState *node)
+static void
+multicornInitializeWorkerForeignScan(ForeignScanState *node,
+									 shm_toc *toc,
+									 void *coordinate)
 {
-	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
 	MulticornExecState *execstate = node->fdw_state;
-	PyObject   *p_value;
+	MulticornParallelScanState *pscan = coordinate;
 
-	if (execstate->p_iterator == NULL)
-	{
-		execute(node, NULL);
-	}
-	ExecClearTuple(slot);
-	if (execstate->p_iterator == Py_None)
-	{
-		/* No iterator returned from get_iterator */
-		Py_DECREF(execstate->p_iterator);
-		return slot;
-	}
-	p_value = PyIter_Next(execstate->p_iterator);
-	errorCheck();
-	/* A none value results in an empty slot. */
-	if (p_value == NULL || p_value == Py_None)
+	acquireGil();
+	if (execstate->single_producer)
 	{
-		Py_XDECREF(p_value);
-		return slot;
+		/* The worker attaches to its queue once it needs rows. */
+		execstate->queues = coordinate;
+		return;
 	}
-	slot->tts_values = execstate->values;
-	slot->tts_isnull = execstate->nulls;
-	pythonResultToTuple(p_value, slot, execstate->cinfos, execstate->buffer);
-	ExecStoreVirtualTuple(slot);
-	Py_DECREF(p_value);
-
-	return slot;
+	execstate->p_partitions = unpickleObject(pscan->data, pscan->length);
+	execstate->pscan = pscan;
+	execstate->batch_execute = false;
 }
 
+#if PG_VERSION_NUM >= 110000
 /*
- * multicornReScanForeignScan
- *		Restart the scan
+ * multicornShutdownForeignScan
+ *		Detach from the queues of a single producer scan, before the Gather
+ *		node waits for its workers. A leader stopped before the end of the
+ *		rows would otherwise leave them waiting for one forever.
  */
 static void
-multicornReScanForeignScan(ForeignScanState *node)
+multicornShutdownForeignScan(ForeignScanState *node)
 {
-	MulticornExecState *state = node->fdw_state;
+	MulticornExecState *execstate = node->fdw_state;
 
-	if (state->p_iterator)
+	if (execstate->single_producer)
 	{
-		Py_DECREF(state->p_iterator);
-		state->p_iterator = NULL;
+		detachSharedQueues(execstate);
 	}
 }
+#endif
+#endif
 
 /*
- *	multicornEndForeignScan
- *		Finish scanning foreign table and dispose objects used for this scan.
+ * multicornAnalyzeForeignTable
+ *		Every foreign table can be analyzed, by sampling its rows in python.
  */
-static void
-multicornEndForeignScan(ForeignScanState *node)
+static bool
+multicornAnalyzeForeignTable(Relation relation,
+							 AcquireSampleRowsFunc *func,
+							 BlockNumber *totalpages)
 {
-	MulticornExecState *state = node->fdw_state;
-	PyObject   *result = PyObject_CallMethod(state->fdw_instance, "end_scan", "()");
+	*func = multicornAcquireSampleRows;
+	/* The table has no pages, but ANALYZE skips empty tables. */
+	*totalpages = 1;
+	return true;
+}
+
+/*
+ * multicornAcquireSampleRows
+ *		Collect the sample rows returned by the python analyze method, along
+ *		with its estimate of the total number of rows.
+ */
+static int
+multicornAcquireSampleRows(Relation relation, int elevel,
+						   HeapTuple *rows, int targrows,
+						   double *totalrows,
+						   double *totaldeadrows)
+{
+	TupleDesc	tupdesc = RelationGetDescr(relation);
+	ConversionInfo **cinfos = palloc0(sizeof(ConversionInfo *) *
+									  tupdesc->natts);
+	StringInfo	buffer = makeStringInfo();
+	MemoryContext tmpcontext = AllocSetContextCreate(CurrentMemoryContext,
+													 "multicorn analyze",
+													 ALLOCSET_DEFAULT_MINSIZE,
+													 ALLOCSET_DEFAULT_INITSIZE,
+													 ALLOCSET_DEFAULT_MAXSIZE);
+	MemoryContext oldcontext;
+	TupleTableSlot *slot;
+	PyObject   *p_instance,
+			   *p_columns = PyList_New(0),
+			   *p_result,
+			   *p_rows,
+			   *p_value;
+	int			numrows = 0;
+	int			i;
 
+	acquireGil();
+	p_instance = getInstance(RelationGetRelid(relation));
+	initConversioninfo(cinfos, TupleDescGetAttInMetadata(tupdesc));
+	initConversioninfoKeys(cinfos, tupdesc->natts);
+	for (i = 0; i < tupdesc->natts; i++)
+	{
+		if (cinfos[i] != NULL)
+		{
+			PyList_Append(p_columns, cinfos[i]->attrkey);
+		}
+	}
+	p_result = PyObject_CallMethod(p_instance, "analyze", "(i,O)", targrows,
+								   p_columns);
+	Py_DECREF(p_columns);
 	errorCheck();
-	Py_DECREF(result);
-	Py_DECREF(state->fdw_instance);
-	Py_XDECREF(state->p_iterator);
-	state->p_iterator = NULL;
+	if (!PyArg_ParseTuple(p_result, "dO", totalrows, &p_value))
+	{
+		errorCheck();
+	}
+	p_rows = PyObject_GetIter(p_value);
+	Py_DECREF(p_result);
+	errorCheck();
+#if PG_VERSION_NUM >= 120000
+	slot = MakeSingleTupleTableSlot(tupdesc, &TTSOpsVirtual);
+#else
+	slot = MakeSingleTupleTableSlot(tupdesc);
+#endif
+	while (numrows < targrows && (p_value = PyIter_Next(p_rows)) != NULL)
+	{
+		vacuum_delay_point();
+		/* The converted values only live until the tuple is formed. */
+		oldcontext = MemoryContextSwitchTo(tmpcontext);
+		memset(slot->tts_isnull, true, sizeof(bool) * tupdesc->natts);
+		pythonResultToTuple(p_value, slot, cinfos, NULL, 0, buffer);
+		Py_DECREF(p_value);
+		MemoryContextSwitchTo(oldcontext);
+		rows[numrows++] = heap_form_tuple(tupdesc, slot->tts_values,
+										  slot->tts_isnull);
+		MemoryContextReset(tmpcontext);
+	}
+	Py_DECREF(p_rows);
+	errorCheck();
+	ExecDropSingleTupleTableSlot(slot);
+	MemoryContextDelete(tmpcontext);
+	releaseConversioninfoKeys(cinfos, tupdesc->natts);
+	Py_DECREF(p_instance);
+	/* The total can not be lower than the sample. */
+	*totalrows = Max(*totalrows, numrows);
+	*totaldeadrows = 0;
+	ereport(elevel,
+			(errmsg("\"%s\": table contains %.0f rows, %d rows in sample",
+					RelationGetRelationName(relation), *totalrows, numrows)));
+	return numrows;
 }
 
 
@@ -608,12 +2850,15 @@ multicornAddForeignUpdateTargets(Query *parsetree,
 	Var		   *var = NULL;
 	TargetEntry *tle,
 			   *returningTle;
-	PyObject   *instance = getInstance(target_relation->rd_id);
-	const char *attrname = getRowIdColumn(instance);
+	PyObject   *instance;
+	const char *attrname;
 	TupleDesc	desc = target_relation->rd_att;
 	int			i;
 	ListCell   *cell;
 
+	acquireGil();
+	instance = getInstance(target_relation->rd_id);
+	attrname = getRowIdColumn(instance);
 	foreach(cell, parsetree->returningList)
 	{
 		returningTle = lfirst(cell);
@@ -689,12 +2934,15 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 	MemoryContext oldcontext;
 	int			i;
 
+	acquireGil();
 	modstate->cinfos = palloc0(sizeof(ConversionInfo *) *
 							   desc->natts);
 	modstate->buffer = makeStringInfo();
+	modstate->foreigntableid = rel->rd_id;
 	modstate->fdw_instance = getInstance(rel->rd_id);
 	modstate->rowidAttrName = getRowIdColumn(modstate->fdw_instance);
 	initConversioninfo(modstate->cinfos, TupleDescGetAttInMetadata(desc));
+	initConversioninfoKeys(modstate->cinfos, desc->natts);
 	oldcontext = MemoryContextSwitchTo(TopMemoryContext);
 	MemoryContextSwitchTo(oldcontext);
 	if (ps->ps_ResultTupleSlot)
@@ -719,6 +2967,7 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 		}
 	}
 	modstate->rowidAttno = ExecFindJunkAttributeInTlist(subplan->targetlist, modstate->rowidAttrName);
+	beginScanStats(&modstate->stats, mtstate->ps.state);
 	resultRelInfo->ri_FdwState = modstate;
 }
 
@@ -733,14 +2982,28 @@ multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
 {
 	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
 	PyObject   *fdw_instance = modstate->fdw_instance;
-	PyObject   *values = tupleTableSlotToPyObject(slot, modstate->cinfos);
-	PyObject   *p_new_value = PyObject_CallMethod(fdw_instance, "insert", "(O)", values);
-
+	PyObject   *values;
+	PyObject   *p_new_value;
+	instr_time	start;
+
+	acquireGil();
+	statsStartTimer(&modstate->stats, &start);
+	values = tupleTableSlotToPyObject(slot, modstate->cinfos);
+	statsStopTimer(&modstate->stats, &start, &modstate->stats.conversion_time);
+	statsCountRow(&modstate->stats, slot);
+	statsStartHook(&modstate->stats, &start);
+	p_new_value = PyObject_CallMethod(fdw_instance, "insert", "(O)", values);
+	statsStopHook(&modstate->stats, &start, modstate->foreigntableid,
+				  MULTICORN_HOOK_INSERT);
 	errorCheck();
 	if (p_new_value && p_new_value != Py_None)
 	{
 		ExecClearTuple(slot);
-		pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+		statsStartTimer(&modstate->stats, &start);
+		pythonResultToTuple(p_new_value, slot, modstate->cinfos, NULL, 0,
+							modstate->buffer);
+		statsStopTimer(&modstate->stats, &start,
+					   &modstate->stats.conversion_time);
 		ExecStoreVirtualTuple(slot);
 	}
 	Py_XDECREF(p_new_value);
@@ -766,18 +3029,30 @@ multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
 	bool		is_null;
 	ConversionInfo *cinfo = modstate->rowidCinfo;
 	Datum		value = ExecGetJunkAttribute(planSlot, modstate->rowidAttno, &is_null);
+	instr_time	start;
 
+	acquireGil();
 	p_row_id = datumToPython(value, cinfo->atttypoid, cinfo);
+	statsStartHook(&modstate->stats, &start);
 	p_new_value = PyObject_CallMethod(fdw_instance, "delete", "(O)", p_row_id);
+	statsStopHook(&modstate->stats, &start, modstate->foreigntableid,
+				  MULTICORN_HOOK_DELETE);
 	errorCheck();
+	statsStartTimer(&modstate->stats, &start);
 	if (p_new_value == NULL || p_new_value == Py_None)
 	{
 		Py_XDECREF(p_new_value);
 		p_new_value = tupleTableSlotToPyObject(planSlot, modstate->resultCinfos);
 	}
 	ExecClearTuple(slot);
-	pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+	pythonResultToTuple(p_new_value, slot, modstate->cinfos, NULL, 0,
+							modstate->buffer);
+	statsStopTimer(&modstate->stats, &start, &modstate->stats.conversion_time);
 	ExecStoreVirtualTuple(slot);
+	if (modstate->stats.enabled)
+	{
+		modstate->stats.rows++;
+	}
 	Py_DECREF(p_new_value);
 	Py_DECREF(p_row_id);
 	errorCheck();
@@ -798,19 +3073,32 @@ multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 	PyObject   *fdw_instance = modstate->fdw_instance,
 			   *p_row_id,
 			   *p_new_value,
-			   *p_value = tupleTableSlotToPyObject(slot, modstate->cinfos);
+			   *p_value;
 	bool		is_null;
 	ConversionInfo *cinfo = modstate->rowidCinfo;
 	Datum		value = ExecGetJunkAttribute(planSlot, modstate->rowidAttno, &is_null);
+	instr_time	start;
 
+	acquireGil();
+	statsStartTimer(&modstate->stats, &start);
+	p_value = tupleTableSlotToPyObject(slot, modstate->cinfos);
 	p_row_id = datumToPython(value, cinfo->atttypoid, cinfo);
+	statsStopTimer(&modstate->stats, &start, &modstate->stats.conversion_time);
+	statsCountRow(&modstate->stats, slot);
+	statsStartHook(&modstate->stats, &start);
 	p_new_value = PyObject_CallMethod(fdw_instance, "update", "(O,O)", p_row_id,
 									  p_value);
+	statsStopHook(&modstate->stats, &start, modstate->foreigntableid,
+				  MULTICORN_HOOK_UPDATE);
 	errorCheck();
 	if (p_new_value != NULL && p_new_value != Py_None)
 	{
 		ExecClearTuple(slot);
-		pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+		statsStartTimer(&modstate->stats, &start);
+		pythonResultToTuple(p_new_value, slot, modstate->cinfos, NULL, 0,
+							modstate->buffer);
+		statsStopTimer(&modstate->stats, &start,
+					   &modstate->stats.conversion_time);
 		ExecStoreVirtualTuple(slot);
 	}
 	Py_XDECREF(p_new_value);
@@ -828,13 +3116,276 @@ multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo)
 
 {
 	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
-	PyObject   *result = PyObject_CallMethod(modstate->fdw_instance, "end_modify", "()");
+	PyObject   *result;
 
+	acquireGil();
+	result = PyObject_CallMethod(modstate->fdw_instance, "end_modify", "()");
 	errorCheck();
+	releaseConversioninfoKeys(modstate->cinfos,
+				RelationGetDescr(resultRelInfo->ri_RelationDesc)->natts);
 	Py_DECREF(modstate->fdw_instance);
 	Py_DECREF(result);
 }
 
+/*
+ * multicornExplainForeignModify
+ *		Under EXPLAIN ANALYZE, show the statistics of the modification.
+ */
+static void
+multicornExplainForeignModify(ModifyTableState *mtstate,
+							  ResultRelInfo *rinfo,
+							  List *fdw_private,
+							  int subplan_index,
+							  ExplainState *es)
+{
+	MulticornModifyState *modstate = rinfo->ri_FdwState;
+
+	if (modstate == NULL)
+	{
+		return;
+	}
+	acquireGil();
+	explainScanStats(modstate->fdw_instance, &modstate->stats, false, es);
+}
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * multicornPlanDirectModify
+ *		Decide whether an UPDATE or a DELETE can be handed as a whole to the
+ *		python update_where or delete_where method.
+ *
+ *		This is the case if the wrapper sets the _direct_modify attribute,
+ *		every clause of the WHERE translates to a qual, and the new values
+ *		are constants or parameters. RETURNING is not supported.
+ */
+static bool
+multicornPlanDirectModify(PlannerInfo *root,
+						  ModifyTable *plan,
+						  Index resultRelation,
+						  int subplan_index)
+{
+	CmdType		operation = plan->operation;
+	RangeTblEntry *rte = planner_rt_fetch(resultRelation, root);
+	Plan	   *subplan = (Plan *) list_nth(plan->plans, subplan_index);
+	ForeignScan *fscan;
+	PyObject   *fdw_instance;
+	List	   *update_exprs = NIL;
+	List	   *update_attnos = NIL;
+	ListCell   *lc;
+	bool		direct_modify;
+
+	if ((operation != CMD_UPDATE && operation != CMD_DELETE) ||
+		plan->returningLists != NIL || !IsA(subplan, ForeignScan))
+	{
+		return false;
+	}
+	fscan = (ForeignScan *) subplan;
+	if (fscan->scan.scanrelid != resultRelation)
+	{
+		return false;
+	}
+	acquireGil();
+	fdw_instance = getInstance(rte->relid);
+	direct_modify = getBooleanAttribute(fdw_instance, "_direct_modify");
+	Py_DECREF(fdw_instance);
+	if (!direct_modify)
+	{
+		return false;
+	}
+	/* The quals will not be rechecked, so they must all be pushed down. */
+	foreach(lc, fscan->fdw_exprs)
+	{
+		if (!isPushableClause(resultRelation, (Expr *) lfirst(lc)))
+		{
+			return false;
+		}
+	}
+	if (operation == CMD_UPDATE)
+	{
+		int			col = -1;
+
+		while ((col = bms_next_member(rte->updatedCols, col)) >= 0)
+		{
+			AttrNumber	attno = col + FirstLowInvalidHeapAttributeNumber;
+			TargetEntry *tle;
+
+			if (attno <= InvalidAttrNumber)
+			{
+				return false;
+			}
+			tle = get_tle_by_resno(subplan->targetlist, attno);
+			if (tle == NULL || !isPushableValue(tle->expr))
+			{
+				return false;
+			}
+			update_exprs = lappend(update_exprs, tle->expr);
+			update_attnos = lappend_int(update_attnos, attno);
+		}
+	}
+	fscan->operation = operation;
+	fscan->scan.plan.qual = NIL;
+	/* The new values follow the quals, to be fixed up along with them. */
+	fscan->fdw_exprs = list_concat(list_copy(fscan->fdw_exprs), update_exprs);
+	fscan->fdw_private = lappend(fscan->fdw_private, update_attnos);
+	fscan->fdw_private = lappend(fscan->fdw_private,
+								 makeInteger(plan->canSetTag));
+	return true;
+}
+
+/*
+ * multicornBeginDirectModify
+ *		Initialize a direct modification.
+ */
+static void
+multicornBeginDirectModify(ForeignScanState *node, int eflags)
+{
+	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
+	TupleDesc	tupdesc = RelationGetDescr(node->ss.ss_currentRelation);
+	MulticornExecState *execstate;
+	List	   *update_attnos = (List *) list_nth(fscan->fdw_private, 8);
+	int			nquals = list_length(fscan->fdw_exprs) -
+						 list_length(update_attnos);
+	ListCell   *lc;
+	int			i = 0;
+
+	acquireGil();
+	execstate = initializeExecState(fscan->fdw_private);
+	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(tupdesc));
+	initConversioninfoKeys(execstate->cinfos, tupdesc->natts);
+	execstate->qual_list = NULL;
+	foreach(lc, fscan->fdw_exprs)
+	{
+		if (i++ < nquals)
+		{
+			extractRestrictions(bms_make_singleton(fscan->scan.scanrelid),
+								(Expr *) lfirst(lc),
+								&execstate->qual_list);
+		}
+		else
+		{
+			execstate->update_exprs = lappend(execstate->update_exprs,
+											  ExecInitExpr((Expr *) lfirst(lc),
+														   (PlanState *) node));
+		}
+	}
+	execstate->update_attnos = update_attnos;
+	execstate->set_processed = intVal(list_nth(fscan->fdw_private, 9));
+	beginScanStats(&execstate->stats, node->ss.ps.state);
+	node->fdw_state = execstate;
+}
+
+/*
+ * multicornIterateDirectModify
+ *		Modify every matching row at once. No row is ever returned.
+ */
+static TupleTableSlot *
+multicornIterateDirectModify(ForeignScanState *node)
+{
+	MulticornExecState *execstate = node->fdw_state;
+	Instrumentation *instr = node->ss.ps.instrument;
+	long		count;
+	instr_time	start;
+
+	acquireGil();
+	statsStartTimer(&execstate->stats, &start);
+	count = executeDirectModify(node);
+	statsStopTimer(&execstate->stats, &start, &execstate->stats.python_time);
+	execstate->stats.rows += count;
+	if (execstate->set_processed)
+	{
+		node->ss.ps.state->es_processed += count;
+	}
+	if (instr)
+	{
+		instr->tuplecount += count;
+	}
+	return ExecClearTuple(node->ss.ss_ScanTupleSlot);
+}
+
+/*
+ * multicornEndDirectModify
+ *		Finish a direct modification.
+ */
+static void
+multicornEndDirectModify(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *result;
+
+	acquireGil();
+	result = PyObject_CallMethod(state->fdw_instance, "end_modify", "()");
+	errorCheck();
+	Py_DECREF(result);
+	releaseConversioninfoKeys(state->cinfos,
+				RelationGetDescr(node->ss.ss_currentRelation)->natts);
+	Py_DECREF(state->fdw_instance);
+}
+
+/*
+ * multicornExplainDirectModify
+ *		Under EXPLAIN ANALYZE, show the statistics of the modification.
+ */
+static void
+multicornExplainDirectModify(ForeignScanState *node, ExplainState *es)
+{
+	MulticornExecState *execstate = node->fdw_state;
+
+	acquireGil();
+	explainScanStats(execstate->fdw_instance, &execstate->stats, false, es);
+}
+#endif
+
+/*
+ * Callback marking the instance of a foreign table as stale when its
+ * relcache entry is invalidated (for example, when its columns change), or
+ * every instance if relid is invalid.
+ */
+static void
+multicorn_relcache_callback(Datum arg, Oid relid)
+{
+	HASH_SEQ_STATUS status;
+	CacheEntry *entry;
+
+	if (OidIsValid(relid))
+	{
+		entry = hash_search(InstancesHash, &relid, HASH_FIND, NULL);
+		if (entry != NULL)
+		{
+			entry->stale = true;
+		}
+		return;
+	}
+	hash_seq_init(&status, InstancesHash);
+	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	{
+		entry->stale = true;
+	}
+}
+
+/*
+ * Callback marking instances as stale when the options of a foreign table,
+ * server, wrapper or user mapping change. Only the instance of the table is
+ * concerned by a change of its options, but every instance is marked for
+ * the other catalogs.
+ */
+static void
+multicorn_syscache_callback(Datum arg, int cacheid, uint32 hashvalue)
+{
+	HASH_SEQ_STATUS status;
+	CacheEntry *entry;
+
+	hash_seq_init(&status, InstancesHash);
+	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	{
+		if (hashvalue == 0 || cacheid != FOREIGNTABLEREL ||
+			GetSysCacheHashValue1(FOREIGNTABLEREL,
+								  ObjectIdGetDatum(entry->hashkey)) == hashvalue)
+		{
+			entry->stale = true;
+		}
+	}
+}
+
 /*
  * Callback used to propagate a subtransaction end.
  */
@@ -851,6 +3402,7 @@ multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 	if (event == SUBXACT_EVENT_COMMIT_SUB || event == SUBXACT_EVENT_START_SUB)
 		return;
 
+	acquireGil();
 	curlevel = GetCurrentTransactionNestLevel();
 
 	hash_seq_init(&status, InstancesHash);
@@ -885,6 +3437,12 @@ multicorn_xact_callback(XactEvent event, void *arg)
 	HASH_SEQ_STATUS status;
 	CacheEntry *entry;
 
+	acquireGil();
+	/* The scans interrupted by an error leave their threads running. */
+	if (event == XACT_EVENT_ABORT)
+	{
+		stopBackgroundIterators();
+	}
 	hash_seq_init(&status, InstancesHash);
 	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
 	{
@@ -896,7 +3454,14 @@ multicorn_xact_callback(XactEvent event, void *arg)
 		{
 #if PG_VERSION_NUM >= 90300
 			case XACT_EVENT_PRE_COMMIT:
-				PyObject_CallMethod(instance, "pre_commit", "()");
+				{
+					instr_time	start;
+
+					startTableHook(entry->hashkey, &start);
+					PyObject_CallMethod(instance, "pre_commit", "()");
+					endTableHook(entry->hashkey, MULTICORN_HOOK_PRE_COMMIT,
+								 &start);
+				}
 				break;
 #endif
 			case XACT_EVENT_COMMIT:
@@ -933,6 +3498,7 @@ multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
 			   *p_item;
 	ListCell   *lc;
 
+	acquireGil();
 	f_server = GetForeignServer(serverOid);
 	foreach(lc, f_server->options)
 	{
@@ -1036,6 +3602,49 @@ serializePlanState(MulticornPlanState * state)
 	result = lappend(result, state->target_list);
 
 	result = lappend(result, serializeDeparsedSortGroup(state->pathkeys));
+	/* The table scanned by an aggregate, join or limit pushdown */
+	if (state->aggregate || state->join_type != NULL || state->pushed_limit)
+	{
+		result = lappend(result, list_make2(makeInteger(state->relid),
+											state->clauses));
+	}
+	else
+	{
+		result = lappend(result, NIL);
+	}
+	if (state->aggregate)
+	{
+		result = lappend(result, list_make2(state->group_by,
+											state->aggregates));
+	}
+	else
+	{
+		result = lappend(result, NIL);
+	}
+	if (state->join_type != NULL)
+	{
+		List	   *join = NIL;
+
+		join = lappend(join, makeString(state->join_type));
+		join = lappend(join, state->join_quals);
+		join = lappend(join, makeInteger(state->inner_relid));
+		join = lappend(join, state->inner_clauses);
+		join = lappend(join, state->inner_targets);
+		result = lappend(result, join);
+	}
+	else
+	{
+		result = lappend(result, NIL);
+	}
+	if (state->pushed_limit)
+	{
+		result = lappend(result, list_make2(state->limit_count,
+											state->limit_offset));
+	}
+	else
+	{
+		result = lappend(result, NIL);
+	}
 
 	return result;
 }
@@ -1058,6 +3667,31 @@ initializeExecState(void *internalstate)
 	execstate->target_list = copyObject(lthird(values));
 	pathkeys = lfourth(values);
 	execstate->pathkeys = deserializeDeparsedSortGroup(pathkeys);
+	if (list_nth(values, 5) != NIL)
+	{
+		List	   *aggregate = (List *) list_nth(values, 5);
+
+		execstate->aggregate = true;
+		execstate->group_by = copyObject(linitial(aggregate));
+		execstate->aggregates = copyObject(lsecond(aggregate));
+	}
+	if (list_nth(values, 6) != NIL)
+	{
+		List	   *join = (List *) list_nth(values, 6);
+
+		execstate->join_type = pstrdup(strVal(linitial(join)));
+		execstate->join_quals = copyObject(lsecond(join));
+		execstate->inner_targets = copyObject(list_nth(join, 4));
+	}
+	if (list_nth(values, 7) != NIL)
+	{
+		List	   *limit = (List *) list_nth(values, 7);
+
+		execstate->pushed_limit = true;
+		execstate->limit_count = getLimitValue(linitial(limit));
+		execstate->limit_offset = Max(getLimitValue(lsecond(limit)), 0);
+	}
+	execstate->foreigntableid = foreigntableid;
 	execstate->fdw_instance = getInstance(foreigntableid);
 	execstate->buffer = makeStringInfo();
 	execstate->cinfos = palloc0(sizeof(ConversionInfo *) * attnum);
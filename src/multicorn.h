@@ -13,6 +13,10 @@
 #include "nodes/bitmapset.h"
 #include "nodes/makefuncs.h"
 #include "nodes/pg_list.h"
+#include "portability/instr_time.h"
+#if PG_VERSION_NUM >= 90600
+#include "port/atomics.h"
+#endif
 
 #if PG_VERSION_NUM < 120000
 #include "nodes/relation.h"
@@ -39,11 +43,26 @@ typedef struct CacheEntry
 	List	   *options;
 	List	   *columns;
 	int			xact_depth;
+	/* Set by the invalidation callbacks: options and columns may differ. */
+	bool		stale;
+	/* The user whose mapping options were last compared */
+	Oid			userid;
 	/* Keep the "options" and "columns" in a specific context to avoid leaks. */
 	MemoryContext cacheContext;
 }	CacheEntry;
 
 
+struct ConversionInfo;
+
+/*
+ * Converts a python object directly to a datum of the column type.
+ * Returns false if the object is not of a type the converter knows about,
+ * in which case the caller falls back to the input function.
+ */
+typedef bool (*PyobjectToDatumFunc) (PyObject *object,
+									 struct ConversionInfo *cinfo,
+									 Datum *value);
+
 typedef struct ConversionInfo
 {
 	char	   *attrname;
@@ -56,6 +75,16 @@ typedef struct ConversionInfo
 	bool		is_array;
 	int			attndims;
 	bool		need_quote;
+	PyobjectToDatumFunc pyconverter;
+	/* For array columns, the element type and its output function */
+	Oid			attelemtype;
+	FmgrInfo   *attelemoutfunc;
+	/* Position of the column in a row returned as a sequence */
+	int			seqindex;
+	/* Interned python string used to look the column up in a row */
+	PyObject   *attrkey;
+	/* Whether callable values are called to get the value of the column */
+	bool		lazy;
 }	ConversionInfo;
 
 
@@ -67,6 +96,7 @@ typedef struct MulticornPlanState
 	List	   *target_list;
 	List	   *qual_list;
 	int			startupCost;
+	int			parallel_workers;
 	ConversionInfo **cinfos;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
 
@@ -78,8 +108,88 @@ typedef struct MulticornPlanState
 	 * getRelSize to GetForeignPlan.
 	 */
 	int width;
+
+	/*
+	 * Aggregate and join pushdown: the scanned table (the outer one for a
+	 * join) and its WHERE clauses, and the target list of the rows returned
+	 * by the python fdw.
+	 */
+	Index		relid;
+	List	   *clauses;
+	List	   *scan_tlist;
+	/* The grouping columns and the aggregates computed by the python fdw */
+	bool		aggregate;
+	List	   *group_by;
+	List	   *aggregates;
+	/*
+	 * The type of a join computed by the python fdw, the clauses joining the
+	 * tables, and the inner table with its WHERE clauses and needed columns.
+	 * The needed columns of the outer table are in target_list.
+	 */
+	char	   *join_type;
+	List	   *join_quals;
+	Index		inner_relid;
+	List	   *inner_clauses;
+	List	   *inner_targets;
+	/* The LIMIT and OFFSET constants applied by the python fdw, if any */
+	bool		pushed_limit;
+	Node	   *limit_count;
+	Node	   *limit_offset;
 }	MulticornPlanState;
 
+/*
+ * A column of a columnar batch (a multicorn.ColumnBatch python object).
+ */
+typedef struct MulticornBatchColumn
+{
+	/* The column values, NULL if the column is absent from the batch */
+	PyObject   *p_column;
+	/* The values as a "fast" sequence, when they are not read from a buffer */
+	PyObject   *p_values;
+	/* The buffer exported by the values, and its struct format code */
+	bool		has_buffer;
+	Py_buffer	view;
+	char		format;
+	/* The null mask, either as a buffer or as a "fast" sequence */
+	bool		has_nullmask;
+	Py_buffer	nullmask;
+	PyObject   *p_nulls;
+}	MulticornBatchColumn;
+
+typedef struct MulticornColumnarBatch
+{
+	Py_ssize_t	length;
+	Py_ssize_t	index;
+	int			natts;
+	/* One entry per attribute */
+	MulticornBatchColumn *columns;
+}	MulticornColumnarBatch;
+
+/*
+ * The statistics of a scan or a modification, shown by EXPLAIN ANALYZE.
+ * They are only gathered when the plan is instrumented, and the times only
+ * when it is timed, or when the statistics of the foreign tables are tracked.
+ */
+typedef struct MulticornScanStats
+{
+	bool		enabled;
+	bool		timing;
+	/* Whether the calls to the hooks count for the foreign table */
+	bool		tracked;
+	/* The calls to execute, the rescans, and the rows converted */
+	long		executes;
+	long		rescans;
+	long		rows;
+	uint64		bytes;
+	/* The time spent in python, and in the conversion of the rows */
+	instr_time	python_time;
+	instr_time	conversion_time;
+	/* The python garbage collections when the scan started, if counted */
+	bool		has_gc;
+	long		gc_collections;
+	double		gc_time;
+}	MulticornScanStats;
+
 typedef struct MulticornExecState
 {
 	/* instance and iterator */
@@ -91,13 +201,141 @@ typedef struct MulticornExecState
 	Datum	   *values;
 	bool	   *nulls;
 	ConversionInfo **cinfos;
+	/* Indexes of the attributes needed by the scan, in table order */
+	int		   *projection;
+	int			nprojected;
 	/* Common buffer to avoid repeated allocations */
 	StringInfo	buffer;
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
+	/* Whether sequences hold only the projected columns, in order */
+	bool		projected_rows;
+	/* Batched execution: the current batch, and the next row to return */
+	bool		batch_execute;
+	PyObject   *p_batch;
+	Py_ssize_t	batch_index;
+	/* The columnar batch being read, if any */
+	MulticornColumnarBatch *columnar;
+#if PG_VERSION_NUM >= 90500
+	/* Releases the columnar batch if the scan ends with an error */
+	MemoryContextCallback columnar_callback;
+#endif
+	/* Parallel scan: the shared state, the partitions and the current one */
+	struct MulticornParallelScanState *pscan;
+	PyObject   *p_partitions;
+	PyObject   *p_partition;
+	/* The pickled partitions, to be copied in the shared state */
+	char	   *pickled_partitions;
+	Size		pickled_length;
+	/*
+	 * Single producer parallel scan: the leader runs the python iterator,
+	 * and hands rows out to the workers through the shared queues.
+	 */
+	bool		single_producer;
+	struct MulticornSharedQueues *queues;
+	/* The leader's handles on every queue, and the next one to look at */
+	struct shm_mq_handle **queue_handles;
+	int			next_consumer;
+	/* A worker's handle on its own queue */
+	struct shm_mq_handle *queue_handle;
+	bool		queue_done;
+	/* Whether p_iterator is a multicorn.background.BackgroundIterator */
+	bool		background;
+	/* The number of rows to fetch in advance, from the prefetch_rows option */
+	int			prefetch_rows;
+	/*
+	 * Parameterized lookups: the python OrderedDict of the rows already
+	 * fetched for each set of parameter values, kept across rescans, from the
+	 * least to the most recently used.
+	 */
+	PyObject   *p_lookups;
+	/*
+	 * Structured quals: the clauses of the WHERE, given to python as a tree
+	 * if the fdw asks for them.
+	 */
+	bool		structured_quals;
+	List	   *clauses;
+	/*
+	 * Late materialization: the columns used by the local quals, converted
+	 * first, and the other needed columns, converted only for the rows
+	 * matching those quals.
+	 */
+	int		   *filter_projection;
+	int			nfilter_projected;
+	int		   *rest_projection;
+	int			nrest_projected;
+	Datum	   *filter_values;
+	bool	   *filter_nulls;
+	/*
+	 * Direct modification: the new values of an UPDATE and the numbers of
+	 * their columns, and whether the modified rows count for the command
+	 */
+	List	   *update_exprs;
+	List	   *update_attnos;
+	bool		set_processed;
+	/*
+	 * Aggregate pushdown: the grouping columns and the aggregates computed
+	 * by the python fdw, and the conversion info of the table columns, used
+	 * for the quals.
+	 */
+	bool		aggregate;
+	List	   *group_by;
+	List	   *aggregates;
+	ConversionInfo **qual_cinfos;
+	/*
+	 * Join pushdown: the type of the join and its clauses, the joined tables,
+	 * and the quals, columns and needed columns of the inner one.
+	 */
+	char	   *join_type;
+	List	   *join_quals;
+	Oid			outer_table;
+	Oid			inner_table;
+	List	   *inner_qual_list;
+	ConversionInfo **inner_cinfos;
+	List	   *inner_targets;
+	/* The LIMIT (-1 if none) and OFFSET applied by the python fdw, if any */
+	bool		pushed_limit;
+	int64		limit_count;
+	int64		limit_offset;
+	/* The statistics shown by EXPLAIN ANALYZE */
+	MulticornScanStats stats;
+	/*
+	 * The foreign table, and the rows already added to its cumulative
+	 * statistics.
+	 */
+	Oid			foreigntableid;
+	long		flushed_rows;
 }	MulticornExecState;
 
+/*
+ * The state of a parallel scan, shared between the leader and the workers.
+ * The partitions of the scan are handed out in order, from a shared counter.
+ */
+#if PG_VERSION_NUM >= 90600
+typedef struct MulticornParallelScanState
+{
+	pg_atomic_uint32 next_partition;
+	uint32		npartitions;
+	/* The pickled list of partitions */
+	Size		length;
+	char		data[FLEXIBLE_ARRAY_MEMBER];
+}	MulticornParallelScanState;
+
+/*
+ * The shared state of a single producer parallel scan. It is followed by one
+ * shm_mq of MULTICORN_QUEUE_SIZE bytes per worker.
+ */
+#define MULTICORN_QUEUE_SIZE 65536
+
+typedef struct MulticornSharedQueues
+{
+	int			nqueues;
+	/* Set by a worker waiting for a row from its queue */
+	pg_atomic_uint32 wanted[FLEXIBLE_ARRAY_MEMBER];
+}	MulticornSharedQueues;
+#endif
+
 typedef struct MulticornModifyState
 {
 	ConversionInfo **cinfos;
@@ -107,6 +345,9 @@ typedef struct MulticornModifyState
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	ConversionInfo *rowidCinfo;
+	/* The statistics shown by EXPLAIN ANALYZE */
+	MulticornScanStats stats;
+	Oid			foreigntableid;
 }	MulticornModifyState;
 
 
@@ -137,6 +378,8 @@ typedef struct MulticornParamQual
 {
 	MulticornBaseQual base;
 	Expr	   *expr;
+	/* Whether the clause can never be true if the parameter is NULL */
+	bool		strict;
 }	MulticornParamQual;
 
 typedef struct MulticornDeparsedSortGroup
@@ -163,11 +406,50 @@ PGDLLEXPORT PyObject   *execute(ForeignScanState *state, ExplainState *es);
 PGDLLEXPORT void pythonResultToTuple(PyObject *p_value,
 					TupleTableSlot *slot,
 					ConversionInfo ** cinfos,
+					int *projection,
+					int nprojected,
 					StringInfo buffer);
+PGDLLEXPORT void pythonProjectedResultToTuple(PyObject *p_value,
+							 TupleTableSlot *slot,
+							 ConversionInfo ** cinfos,
+							 int *projection,
+							 int nprojected,
+							 StringInfo buffer);
+PGDLLEXPORT void initConversioninfoKeys(ConversionInfo ** cinfos, int natts);
+PGDLLEXPORT void releaseConversioninfoKeys(ConversionInfo ** cinfos, int natts);
 PGDLLEXPORT PyObject   *tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos);
 PGDLLEXPORT char	   *getRowIdColumn(PyObject *fdw_instance);
+PGDLLEXPORT bool getBooleanAttribute(PyObject *fdw_instance, const char *name);
+PGDLLEXPORT int getIntegerAttribute(PyObject *fdw_instance, const char *name);
+PGDLLEXPORT PyObject   *getPartitions(ForeignScanState *node);
+PGDLLEXPORT List *getScanStats(PyObject *fdw_instance);
+PGDLLEXPORT bool getGcStats(long *collections, double *gc_time);
+PGDLLEXPORT char	   *pickleObject(PyObject *object, Size *length);
+PGDLLEXPORT PyObject   *unpickleObject(const char *data, Size length);
+PGDLLEXPORT void releaseGil(void);
+PGDLLEXPORT void acquireGil(void);
+PGDLLEXPORT void preloadModules(const char *modules);
+PGDLLEXPORT void startBackgroundIterator(MulticornExecState * state, int maxsize);
+PGDLLEXPORT bool backgroundRowReady(MulticornExecState * state);
+PGDLLEXPORT int backgroundFileno(MulticornExecState * state);
+PGDLLEXPORT void stopBackgroundIterator(MulticornExecState * state);
+PGDLLEXPORT void closeIterator(MulticornExecState * state);
+PGDLLEXPORT void stopBackgroundIterators(void);
+PGDLLEXPORT long executeDirectModify(ForeignScanState *node);
+PGDLLEXPORT bool isColumnBatch(PyObject *p_value);
+PGDLLEXPORT MulticornColumnarBatch *beginColumnarBatch(PyObject *p_batch,
+				   ConversionInfo ** cinfos,
+				   int natts,
+				   int *projection,
+				   int nprojected);
+PGDLLEXPORT bool columnarBatchToTuple(MulticornColumnarBatch * batch,
+					 TupleTableSlot *slot,
+					 ConversionInfo ** cinfos,
+					 StringInfo buffer);
+PGDLLEXPORT void endColumnarBatch(MulticornColumnarBatch * batch);
 PGDLLEXPORT PyObject   *optionsListToPyDict(List *options);
 PGDLLEXPORT const char *getPythonEncodingName(void);
+PGDLLEXPORT PyobjectToDatumFunc getPyobjectToDatumFunc(ConversionInfo * cinfo);
 
 PGDLLEXPORT void getRelSize(MulticornPlanState * state,
 		PlannerInfo *root,
@@ -178,9 +460,42 @@ PGDLLEXPORT List	   *pathKeys(MulticornPlanState * state);
 
 PGDLLEXPORT List	   *canSort(MulticornPlanState * state, List *deparsed);
 
+PGDLLEXPORT bool canAggregate(MulticornPlanState * state, List *group_by,
+		List *aggregates);
+PGDLLEXPORT bool canLimit(MulticornPlanState * state, List *deparsed);
+PGDLLEXPORT List *canEnforceQuals(MulticornPlanState * state,
+				Relids base_relids, List *clauses);
+PGDLLEXPORT bool canJoin(MulticornPlanState * state, MulticornPlanState * outerstate,
+		MulticornPlanState * innerstate);
+
 PGDLLEXPORT CacheEntry *getCacheEntry(Oid foreigntableid);
 PGDLLEXPORT UserMapping *multicorn_GetUserMapping(Oid userid, Oid serverid);
+PGDLLEXPORT List *getOptions(Oid foreigntableid);
+
 
+/* stats.c */
+typedef enum MulticornHook
+{
+	MULTICORN_HOOK_GET_REL_SIZE,
+	MULTICORN_HOOK_EXECUTE,
+	MULTICORN_HOOK_INSERT,
+	MULTICORN_HOOK_UPDATE,
+	MULTICORN_HOOK_DELETE,
+	MULTICORN_HOOK_PRE_COMMIT,
+	MULTICORN_HOOK_BEGIN,
+	MULTICORN_NUM_HOOKS
+}	MulticornHook;
+
+PGDLLEXPORT void initTableStats(void);
+PGDLLEXPORT bool trackTableStats(void);
+PGDLLEXPORT void setCurrentTableStats(Oid relid);
+PGDLLEXPORT void startTableHook(Oid relid, instr_time *start);
+PGDLLEXPORT void endTableHook(Oid relid, MulticornHook hook, instr_time *start);
+PGDLLEXPORT void countTableHook(Oid relid, MulticornHook hook, int64 calls,
+			   instr_time *elapsed);
+PGDLLEXPORT void countTableRows(Oid relid, int64 rows);
+PGDLLEXPORT void countTableInstance(Oid relid);
+PGDLLEXPORT void countTableError(void);
 
 /* Hash table mapping oid to fdw instances */
 extern PGDLLEXPORT HTAB *InstancesHash;
@@ -191,6 +506,8 @@ PGDLLEXPORT void extractRestrictions(Relids base_relids,
 					Expr *node,
 					List **quals);
 PGDLLEXPORT List	   *extractColumns(List *reltargetlist, List *restrictinfolist);
+PGDLLEXPORT char	   *getOperatorString(Oid opoid);
+PGDLLEXPORT Node	   *unnestClause(Node *node);
 PGDLLEXPORT void initConversioninfo(ConversionInfo ** cinfo,
 		AttInMetadata *attinmeta);
 
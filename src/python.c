@@ -8,6 +8,8 @@
 #include "utils/numeric.h"
 #include "utils/date.h"
 #include "utils/timestamp.h"
+#include "utils/datetime.h"
+#include "utils/uuid.h"
 #include "utils/array.h"
 #include "utils/catcache.h"
 #include "utils/memutils.h"
@@ -19,6 +21,12 @@
 #include "mb/pg_wchar.h"
 #include "access/xact.h"
 #include "utils/lsyscache.h"
+#if PG_VERSION_NUM < 120000
+#include "optimizer/clauses.h"
+#include "optimizer/var.h"
+#else
+#include "optimizer/optimizer.h"
+#endif
 
 
 PGDLLEXPORT List	   *getOptions(Oid foreigntableid);
@@ -52,6 +60,9 @@ PGDLLEXPORT PyObject   *datumNumberToPython(Datum node, ConversionInfo * cinfo);
 PGDLLEXPORT PyObject   *datumDateToPython(Datum datum, ConversionInfo * cinfo);
 PGDLLEXPORT PyObject   *datumStringToPython(Datum node, ConversionInfo * cinfo);
 PGDLLEXPORT PyObject   *datumTimestampToPython(Datum datum, ConversionInfo * cinfo);
+PGDLLEXPORT PyObject   *datumTimestampTzToPython(Datum datum, ConversionInfo * cinfo);
+PGDLLEXPORT PyObject   *datumUuidToPython(Datum datum, ConversionInfo * cinfo);
+PGDLLEXPORT PyObject   *datumJsonToPython(Datum datum, ConversionInfo * cinfo, Oid type);
 PGDLLEXPORT PyObject   *datumIntToPython(Datum datum, ConversionInfo * cinfo);
 PGDLLEXPORT PyObject   *datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo);
 PGDLLEXPORT PyObject   *datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type);
@@ -61,11 +72,15 @@ PGDLLEXPORT PyObject   *datumByteaToPython(Datum datum, ConversionInfo * cinfo);
 void pythonDictToTuple(PyObject *p_value,
 				  TupleTableSlot *slot,
 				  ConversionInfo ** cinfos,
+				  int *projection,
+				  int nprojected,
 				  StringInfo buffer);
 
 void pythonSequenceToTuple(PyObject *p_value,
 					  TupleTableSlot *slot,
 					  ConversionInfo ** cinfos,
+					  int *projection,
+					  int nprojected,
 					  StringInfo buffer);
 
 /* Python to cstring functions */
@@ -95,6 +110,61 @@ void appendBinaryStringInfoQuote(StringInfo buffer,
 
 
 static void begin_remote_xact(CacheEntry * entry);
+static PyObject *stringsToPyList(List *strings);
+static PyObject *tuplesToPyList(List *tuples);
+static PyObject *planQualToPython(MulticornBaseQual * qual,
+				 ConversionInfo ** cinfos, PyObject *p_unbound);
+static PyObject *planQualsToPyList(List *qual_list, ConversionInfo ** cinfos);
+static PyObject *joinedTableToPython(Oid foreigntableid, PyObject *p_quals,
+					List *targets);
+static PyObject *operandToPython(ForeignScanState *node, Expr *expr);
+static PyObject *clauseToPython(ForeignScanState *node, Expr *expr);
+
+/* Python objects imported on first use, and kept for the backend lifetime. */
+static PyObject *uuidClass = NULL;
+static PyObject *decimalClass = NULL;
+static PyObject *jsonDumps = NULL;
+static PyObject *jsonLoads = NULL;
+static PyObject *pickleDumps = NULL;
+static PyObject *pickleLoads = NULL;
+static PyObject *utcTimezone = NULL;
+
+/* The backend's thread state, while python threads are allowed to run. */
+static PyThreadState *savedThreadState = NULL;
+
+/* The process which initialized the interpreter: the postmaster, if preloaded. */
+static int	interpreterPid = 0;
+
+/*
+ * Import an attribute (a class, a function...) from a python module.
+ *
+ * Returns a new reference.
+ */
+static PyObject *
+importAttribute(const char *module, const char *name)
+{
+	PyObject   *p_module = PyImport_ImportModule(module),
+			   *p_attribute;
+
+	errorCheck();
+	p_attribute = PyObject_GetAttrString(p_module, name);
+	Py_DECREF(p_module);
+	errorCheck();
+	return p_attribute;
+}
+
+/*
+ * Import the datetime C API. This is costly, so only do it once.
+ */
+static void
+importDateTime(void)
+{
+	if (PyDateTimeAPI == NULL)
+	{
+		PyDateTime_IMPORT;
+		errorCheck();
+	}
+}
 
 /*
  * Get a (python) encoding name for an attribute.
@@ -292,6 +362,53 @@ qualDefsToPyList(List *qual_list, ConversionInfo ** cinfos)
 	return p_quals;
 }
 
+/*
+ * Convert a qual to python while planning. The value of a qual comparing a
+ * column to a value only known at execution time is p_unbound.
+ */
+static PyObject *
+planQualToPython(MulticornBaseQual * qual, ConversionInfo ** cinfos,
+				 PyObject *p_unbound)
+{
+	ConversionInfo *cinfo;
+
+	if (qual->right_type == T_Const)
+	{
+		return qualdefToPython((MulticornConstQual *) qual, cinfos);
+	}
+	cinfo = cinfos[qual->varattno - 1];
+	Py_INCREF(p_unbound);
+	return pythonQual(qual->opname, p_unbound, cinfo, qual->isArray,
+					  qual->useOr, cinfo->atttypoid);
+}
+
+/*
+ * Same as qualDefsToPyList, but the quals comparing a column to a parameter
+ * are included, with multicorn.UNBOUND as their value, so that the python
+ * fdw sees every qual it will have to enforce.
+ */
+static PyObject *
+planQualsToPyList(List *qual_list, ConversionInfo ** cinfos)
+{
+	ListCell   *lc;
+	PyObject   *p_quals = PyList_New(0),
+			   *p_unbound = getClassString("multicorn.UNBOUND");
+
+	foreach(lc, qual_list)
+	{
+		PyObject   *python_qual = planQualToPython((MulticornBaseQual *) lfirst(lc),
+												   cinfos, p_unbound);
+
+		if (python_qual != NULL)
+		{
+			PyList_Append(p_quals, python_qual);
+			Py_DECREF(python_qual);
+		}
+	}
+	Py_DECREF(p_unbound);
+	return p_quals;
+}
+
 
 /*
  * Same as getClass, but accepts a C-String argument instead of a python
@@ -567,31 +684,61 @@ compareColumns(List *columns1, List *columns2)
 CacheEntry *
 getCacheEntry(Oid foreigntableid)
 {
-	/*
-	 * create a temporary context. If we have to (re)create the python
-	 * instance, it will be promoted to a cachememorycontext. Otherwise, it
-	 * will be freed before returning the instance
-	 */
-	MemoryContext tempContext = AllocSetContextCreate(CurrentMemoryContext,
-												  "multicorn temporary data",
-													  ALLOCSET_SMALL_MINSIZE,
-													  ALLOCSET_SMALL_INITSIZE,
-													  ALLOCSET_SMALL_MAXSIZE),
-				oldContext = MemoryContextSwitchTo(tempContext);
+	MemoryContext tempContext,
+				oldContext;
 	CacheEntry *entry = NULL;
 	bool		found = false;
-	List	   *options = getOptions(foreigntableid);
+	List	   *options;
 	List	   *columns = NULL;
 	PyObject   *p_columns = NULL;
-	ForeignTable *ftable = GetForeignTable(foreigntableid);
-	Relation	rel = RelationIdGetRelation(ftable->relid);
-	TupleDesc	desc = rel->rd_att;
+	Relation	rel;
+	TupleDesc	desc;
 	bool		needInitialization = false;
 
 	entry = hash_search(InstancesHash, &foreigntableid, HASH_ENTER,
 						&found);
 
-	if (!found || entry->value == NULL)
+	/*
+	 * Unless an invalidation callback marked it as stale, or the current user
+	 * (and thus the user mapping) changed, the instance is still valid: its
+	 * options and columns are only compared otherwise.
+	 */
+	if (found && entry->value != NULL && !entry->stale &&
+		entry->userid == GetUserId())
+	{
+		Py_INCREF(entry->value);
+		begin_remote_xact(entry);
+		return entry;
+	}
+	if (!found)
+	{
+		entry->value = NULL;
+	}
+
+	/*
+	 * An invalidation received from now on calls for another comparison, but
+	 * the fast path above stays closed until the instance is known to be
+	 * valid: an error may interrupt the comparison.
+	 */
+	entry->stale = false;
+	entry->userid = InvalidOid;
+
+	/*
+	 * create a temporary context. If we have to (re)create the python
+	 * instance, it will be promoted to a cachememorycontext. Otherwise, it
+	 * will be freed before returning the instance
+	 */
+	tempContext = AllocSetContextCreate(CurrentMemoryContext,
+										"multicorn temporary data",
+										ALLOCSET_SMALL_MINSIZE,
+										ALLOCSET_SMALL_INITSIZE,
+										ALLOCSET_SMALL_MAXSIZE);
+	oldContext = MemoryContextSwitchTo(tempContext);
+	options = getOptions(foreigntableid);
+	rel = RelationIdGetRelation(foreigntableid);
+	desc = rel->rd_att;
+
+	if (entry->value == NULL)
 	{
 		entry->options = NULL;
 		entry->columns = NULL;
@@ -606,6 +753,7 @@ getCacheEntry(Oid foreigntableid)
 		{
 			/* Options have changed, we must purge the cache. */
 			Py_XDECREF(entry->value);
+			entry->value = NULL;
 			needInitialization = true;
 		}
 		else
@@ -615,6 +763,7 @@ getCacheEntry(Oid foreigntableid)
 			if (!compareColumns(columns, entry->columns))
 			{
 				Py_XDECREF(entry->value);
+				entry->value = NULL;
 				needInitialization = true;
 			}
 			else
@@ -630,9 +779,9 @@ getCacheEntry(Oid foreigntableid)
 															"wrapper")),
 				   *p_instance;
 
-		entry->value = NULL;
 		getColumnsFromTable(desc, &p_columns, &columns);
 		PyDict_DelItemString(p_options, "wrapper");
+		countTableInstance(foreigntableid);
 		p_instance = PyObject_CallFunction(p_class, "(O,O)", p_options,
 										   p_columns);
 		errorCheck();
@@ -661,6 +810,7 @@ getCacheEntry(Oid foreigntableid)
 		MemoryContextDelete(tempContext);
 	}
 	RelationClose(rel);
+	entry->userid = GetUserId();
 	Py_INCREF(entry->value);
 
 	/*
@@ -692,7 +842,11 @@ begin_remote_xact(CacheEntry * entry)
 	/* Start main transaction if we haven't yet */
 	if (entry->xact_depth <= 0)
 	{
+		instr_time	start;
+
+		startTableHook(entry->hashkey, &start);
 		rv = PyObject_CallMethod(entry->value, "begin", "(i)", IsolationIsSerializable());
+		endTableHook(entry->hashkey, MULTICORN_HOOK_BEGIN, &start);
 		Py_XDECREF(rv);
 		errorCheck();
 		entry->xact_depth = 1;
@@ -709,6 +863,92 @@ begin_remote_xact(CacheEntry * entry)
 
 
 
+/*
+ * Returns the cached result of a planning method, as a new reference, or
+ * NULL if the wrapper did not cache it (or does not use a plan cache, in
+ * which case key is NULL).
+ */
+static PyObject *
+getPlanCache(PyObject *fdw_instance, StringInfo key)
+{
+	PyObject   *p_result;
+
+	if (key == NULL)
+	{
+		return NULL;
+	}
+	p_result = PyObject_CallMethod(fdw_instance, "_get_plan_cache", "(s)",
+								   key->data);
+	errorCheck();
+	if (p_result == Py_None)
+	{
+		Py_DECREF(p_result);
+		return NULL;
+	}
+	return p_result;
+}
+
+/*
+ * Cache the result of a planning method, if the wrapper uses a plan cache.
+ */
+static void
+setPlanCache(PyObject *fdw_instance, StringInfo key, PyObject *p_result)
+{
+	PyObject   *p_none;
+
+	if (key == NULL)
+	{
+		return;
+	}
+	p_none = PyObject_CallMethod(fdw_instance, "_set_plan_cache", "(s,O)",
+								 key->data, p_result);
+	errorCheck();
+	Py_DECREF(p_none);
+}
+
+/*
+ * Start the key under which the results of a planning method are cached, or
+ * return NULL if the wrapper does not use a plan cache.
+ */
+static StringInfo
+planCacheKey(PyObject *fdw_instance, const char *method)
+{
+	StringInfo	key;
+
+	if (!getBooleanAttribute(fdw_instance, "_plan_cache_ttl"))
+	{
+		return NULL;
+	}
+	key = makeStringInfo();
+	appendStringInfo(key, "%s:", method);
+	return key;
+}
+
+/*
+ * Add the shape of the quals to a plan cache key: their columns, operators
+ * and types, but not their values.
+ */
+static void
+appendQualsShape(StringInfo key, List *qual_list, ConversionInfo ** cinfos)
+{
+	ListCell   *lc;
+
+	foreach(lc, qual_list)
+	{
+		MulticornBaseQual *qual = (MulticornBaseQual *) lfirst(lc);
+
+		if (qual->right_type != T_Const)
+		{
+			continue;
+		}
+		appendStringInfo(key, " %s %s %s %u %s",
+						 cinfos[qual->varattno - 1]->attrname, qual->opname,
+						 !qual->isArray ? "-" : qual->useOr ? "any" : "all",
+						 qual->typeoid,
+						 ((MulticornConstQual *) qual)->isnull ? "null" : "-");
+	}
+}
+
 /*
  * Returns the relation estimated size, in term of number of rows and width.
  * This is done by calling the getRelSize python method.
@@ -726,14 +966,36 @@ getRelSize(MulticornPlanState * state,
 			   *p_rows,
 			   *p_width,
 			   *p_startup_cost;
+	StringInfo	key = planCacheKey(state->fdw_instance, "get_rel_size");
+	ListCell   *lc;
 
-	p_targets_set = valuesToPySet(state->target_list);
-	p_quals = qualDefsToPyList(state->qual_list, state->cinfos);
-	p_rows_and_width = PyObject_CallMethod(state->fdw_instance, "get_rel_size",
-										   "(O,O)", p_quals, p_targets_set);
-	errorCheck();
-	Py_DECREF(p_targets_set);
-	Py_DECREF(p_quals);
+	if (key != NULL)
+	{
+		appendQualsShape(key, state->qual_list, state->cinfos);
+		appendStringInfoString(key, " |");
+		foreach(lc, state->target_list)
+		{
+			appendStringInfo(key, " %s", strVal(lfirst(lc)));
+		}
+	}
+	p_rows_and_width = getPlanCache(state->fdw_instance, key);
+	if (p_rows_and_width == NULL)
+	{
+		instr_time	start;
+
+		p_targets_set = valuesToPySet(state->target_list);
+		p_quals = qualDefsToPyList(state->qual_list, state->cinfos);
+		startTableHook(state->foreigntableid, &start);
+		p_rows_and_width = PyObject_CallMethod(state->fdw_instance,
+											   "get_rel_size", "(O,O)",
+											   p_quals, p_targets_set);
+		endTableHook(state->foreigntableid, MULTICORN_HOOK_GET_REL_SIZE,
+					 &start);
+		errorCheck();
+		Py_DECREF(p_targets_set);
+		Py_DECREF(p_quals);
+		setPlanCache(state->fdw_instance, key, p_rows_and_width);
+	}
 	if ((p_rows_and_width == Py_None) || PyTuple_Size(p_rows_and_width) != 2)
 	{
 		Py_DECREF(p_rows_and_width);
@@ -908,22 +1170,27 @@ getDeparsedSortGroup(PyObject *sortKey)
 
 
 /*
- * Execute the query in the python fdw, and returns an iterator.
+ * Build the python list of quals on the columns described by cinfos,
+ * evaluating the parameters.
+ *
+ * If null_param is not NULL, it is set to whether a parameter is NULL in a
+ * strict qual, which no row can then match. Such a qual is given to python
+ * with None as its value, as an IS NULL test would be.
  */
-PyObject *
-execute(ForeignScanState *node, ExplainState *es)
+static PyObject *
+qualListToPython(ForeignScanState *node, List *qual_list,
+				 ConversionInfo ** cinfos, bool *null_param)
 {
-	MulticornExecState *state = node->fdw_state;
-	PyObject   *p_targets_set,
-			   *p_quals = PyList_New(0),
-			   *p_pathkeys = PyList_New(0),
-			   *p_iterable,
-			   *p_method;
+	PyObject   *p_quals = PyList_New(0);
 	ListCell   *lc;
 
 	ExprContext *econtext = node->ss.ps.ps_ExprContext;
 
-	foreach(lc, state->qual_list)
+	if (null_param != NULL)
+	{
+		*null_param = false;
+	}
+	foreach(lc, qual_list)
 	{
 		MulticornBaseQual *qual = lfirst(lc);
 		MulticornConstQual *newqual = NULL;
@@ -949,6 +1216,11 @@ execute(ForeignScanState *node, ExplainState *es)
 				#endif
 				newqual->base.typeoid = ((Param*) ((MulticornParamQual *) qual)->expr)->paramtype;
 				newqual->isnull = isNull;
+				if (isNull && null_param != NULL &&
+					((MulticornParamQual *) qual)->strict)
+				{
+					*null_param = true;
+				}
 				break;
 			case T_Const:
 				newqual = (MulticornConstQual *) qual;
@@ -958,7 +1230,8 @@ execute(ForeignScanState *node, ExplainState *es)
 		}
 		if (newqual != NULL)
 		{
-			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) newqual, state->cinfos);
+			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) newqual,
+														cinfos);
 
 			if (python_qual != NULL)
 			{
@@ -967,364 +1240,2340 @@ execute(ForeignScanState *node, ExplainState *es)
 			}
 		}
 	}
-	/* Transform every object to a suitable python representation */
-	p_targets_set = valuesToPySet(state->target_list);
-
-	foreach(lc, state->pathkeys)
-	{
-		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
-		PyObject *python_sortkey = getSortKey(pathkey);
-		PyList_Append(p_pathkeys, python_sortkey);
-		Py_DECREF(python_sortkey);
-	}
-	{
-		PyObject * args,
-				 * kwargs = PyDict_New();
-		if(PyList_Size(p_pathkeys) > 0){
-			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
-		}
-		if(es != NULL){
-			PyObject * verbose;
-			if(es->verbose){
-				verbose = Py_True;
-			} else {
-				verbose = Py_False;
-			}
-			p_method = PyObject_GetAttrString(state->fdw_instance, "explain");
-			args = PyTuple_Pack(2, p_quals, p_targets_set);
-			PyDict_SetItemString(kwargs, "verbose", verbose);
-			errorCheck();
-		} else {
-			p_method = PyObject_GetAttrString(state->fdw_instance, "execute");
-			errorCheck();
-			args = PyTuple_Pack(2, p_quals, p_targets_set);
-			errorCheck();
-		}
-		p_iterable = PyObject_Call(p_method, args, kwargs);
-		errorCheck();
-		Py_DECREF(p_method);
-		Py_DECREF(args);
-		Py_DECREF(kwargs);
-	}
-
-	errorCheck();
-	if (p_iterable == Py_None){
-		state->p_iterator = p_iterable;
-	}
-	else
-	{
-		state->p_iterator = PyObject_GetIter(p_iterable);
-	}
-	Py_DECREF(p_quals);
-	Py_DECREF(p_targets_set);
-	Py_DECREF(p_pathkeys);
-	Py_DECREF(p_iterable);
-	errorCheck();
-	return state->p_iterator;
+	return p_quals;
 }
 
-void
-pynumberToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+/*
+ * Build the python list of quals for a scan, evaluating the parameters.
+ */
+static PyObject *
+scanQualsToPython(ForeignScanState *node, bool *null_param)
 {
-	PyObject   *pTempStr;
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
-
-	pTempStr = PyObject_Str(pyobject);
-	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
-	appendBinaryStringInfo(buffer, tempbuffer, strlength);
-	Py_DECREF(pTempStr);
-}
+	MulticornExecState *state = node->fdw_state;
 
-void
-pyunicodeToCString(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
-{
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
-	PyObject   *pTempStr;
-	pTempStr = PyUnicode_AsEncodedString(pyobject, getPythonEncodingName(), NULL);
-	errorCheck();
-	PyBytes_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
-	Py_DECREF(pTempStr);
+	return qualListToPython(node, state->qual_list,
+							state->qual_cinfos != NULL ?
+							state->qual_cinfos : state->cinfos, null_param);
 }
 
-void
-pystringToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+/*
+ * Build a python multicorn.Function from the name of a function or an
+ * operator, and its arguments.
+ *
+ * Returns NULL if one of the arguments can not be represented.
+ */
+static PyObject *
+functionToPython(ForeignScanState *node, char *name, List *args)
 {
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
+	PyObject   *p_args = PyList_New(0),
+			   *p_class,
+			   *p_function;
+	ListCell   *lc;
 
-	if (PyString_AsStringAndSize(pyobject, &tempbuffer, &strlength) < 0)
+	foreach(lc, args)
 	{
-		ereport(WARNING,
-				(errmsg("An error occured while decoding the %s column",
-						cinfo->attrname),
-				 errhint("You should maybe return unicode instead?")));
+		PyObject   *p_arg = operandToPython(node, (Expr *) lfirst(lc));
+
+		if (p_arg == NULL)
+		{
+			Py_DECREF(p_args);
+			return NULL;
+		}
+		PyList_Append(p_args, p_arg);
+		Py_DECREF(p_arg);
 	}
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	p_class = getClassString("multicorn.Function");
+	p_function = PyObject_CallFunction(p_class, "(s,O)", name, p_args);
+	errorCheck();
+	Py_DECREF(p_class);
+	Py_DECREF(p_args);
+	return p_function;
 }
 
-void
-pysequenceToCString(PyObject *pyobject, StringInfo buffer,
-					ConversionInfo * cinfo)
+/*
+ * Build the python representation of an operand of a clause: a
+ * multicorn.Column for a column of the scanned table, a multicorn.Function
+ * for a function or an operator applied to other operands, or the value of
+ * a constant or a parameter.
+ *
+ * Returns NULL if the operand can not be represented.
+ */
+static PyObject *
+operandToPython(ForeignScanState *node, Expr *expr)
 {
-	/* Its an array */
-	Py_ssize_t	i,
-				size = PySequence_Size(pyobject);
-	PyObject   *p_item;
-	int			previous_dims = cinfo->attndims,
-				previous_needquote = cinfo->need_quote;
+	MulticornExecState *state = node->fdw_state;
+	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
 
-	if (cinfo->attndims == 0)
+	switch (nodeTag(expr))
+	{
+		case T_Var:
+			{
+				Var		   *var = (Var *) expr;
+				ConversionInfo *cinfo;
+				PyObject   *p_class,
+						   *p_column;
+
+				if (var->varno != fscan->scan.scanrelid || var->varattno < 1)
+				{
+					return NULL;
+				}
+				cinfo = state->cinfos[var->varattno - 1];
+				if (cinfo == NULL)
+				{
+					return NULL;
+				}
+				p_class = getClassString("multicorn.Column");
+				p_column = PyObject_CallFunction(p_class, "(O)",
+												 cinfo->attrkey);
+				errorCheck();
+				Py_DECREF(p_class);
+				return p_column;
+			}
+		case T_Const:
+			{
+				Const	   *constant = (Const *) expr;
+
+				if (constant->constisnull)
+				{
+					Py_INCREF(Py_None);
+					return Py_None;
+				}
+				return datumToPython(constant->constvalue,
+									 constant->consttype, NULL);
+			}
+		case T_Param:
+			{
+				ExprState  *expr_state = ExecInitExpr(expr,
+													  (PlanState *) node);
+				Datum		value;
+				bool		isNull;
+
+#if PG_VERSION_NUM >= 100000
+				value = ExecEvalExpr(expr_state, node->ss.ps.ps_ExprContext,
+									 &isNull);
+#else
+				value = ExecEvalExpr(expr_state, node->ss.ps.ps_ExprContext,
+									 &isNull, NULL);
+#endif
+				if (isNull)
+				{
+					Py_INCREF(Py_None);
+					return Py_None;
+				}
+				return datumToPython(value, ((Param *) expr)->paramtype, NULL);
+			}
+		case T_RelabelType:
+			return operandToPython(node, ((RelabelType *) expr)->arg);
+		case T_ArrayExpr:
+			{
+				PyObject   *p_items = PyList_New(0);
+				ListCell   *lc;
+
+				foreach(lc, ((ArrayExpr *) expr)->elements)
+				{
+					PyObject   *p_item = operandToPython(node,
+														 (Expr *) lfirst(lc));
+
+					if (p_item == NULL)
+					{
+						Py_DECREF(p_items);
+						return NULL;
+					}
+					PyList_Append(p_items, p_item);
+					Py_DECREF(p_item);
+				}
+				return p_items;
+			}
+		case T_FuncExpr:
+			return functionToPython(node,
+									get_func_name(((FuncExpr *) expr)->funcid),
+									((FuncExpr *) expr)->args);
+		case T_OpExpr:
+			return functionToPython(node,
+									getOperatorString(((OpExpr *) expr)->opno),
+									((OpExpr *) expr)->args);
+		default:
+			return NULL;
+	}
+}
+
+/*
+ * Build the field name of a qual: the name of the column if the operand is
+ * a column, or its python representation if it is an expression using
+ * columns.
+ *
+ * Returns NULL if the operand does not use any column, or can not be
+ * represented.
+ */
+static PyObject *
+fieldToPython(ForeignScanState *node, Expr *expr)
+{
+	MulticornExecState *state = node->fdw_state;
+
+	if (IsA(expr, RelabelType))
+	{
+		expr = ((RelabelType *) expr)->arg;
+	}
+	if (!contain_var_clause((Node *) expr))
+	{
+		return NULL;
+	}
+	if (IsA(expr, Var))
+	{
+		PyObject   *p_column = operandToPython(node, expr);
+
+		/* Plain columns are given by name, as in the flat quals. */
+		if (p_column != NULL)
+		{
+			Py_DECREF(p_column);
+			p_column = state->cinfos[((Var *) expr)->varattno - 1]->attrkey;
+			Py_INCREF(p_column);
+		}
+		return p_column;
+	}
+	return operandToPython(node, expr);
+}
+
+/*
+ * Build a python multicorn.Qual comparing two operands, swapping them if
+ * only the right one uses the columns of the scanned table.
+ *
+ * Returns NULL if the comparison can not be represented.
+ */
+static PyObject *
+comparisonToPython(ForeignScanState *node, Oid opno, char *opname,
+				   List *args)
+{
+	Expr	   *left,
+			   *right;
+	PyObject   *p_field,
+			   *p_value,
+			   *p_class,
+			   *p_qual;
+
+	if (list_length(args) != 2)
+	{
+		return NULL;
+	}
+	left = linitial(args);
+	right = lsecond(args);
+	if (!contain_var_clause((Node *) left) &&
+		contain_var_clause((Node *) right) &&
+		OidIsValid(get_commutator(opno)))
+	{
+		left = lsecond(args);
+		right = linitial(args);
+		if (opname == NULL)
+		{
+			opno = get_commutator(opno);
+		}
+	}
+	if (opname == NULL)
+	{
+		opname = getOperatorString(opno);
+	}
+	p_field = fieldToPython(node, left);
+	if (p_field == NULL)
+	{
+		return NULL;
+	}
+	p_value = operandToPython(node, right);
+	if (p_value == NULL)
+	{
+		Py_DECREF(p_field);
+		return NULL;
+	}
+	p_class = getClassString("multicorn.Qual");
+	p_qual = PyObject_CallFunction(p_class, "(O,s,O)", p_field, opname,
+								   p_value);
+	errorCheck();
+	Py_DECREF(p_class);
+	Py_DECREF(p_field);
+	Py_DECREF(p_value);
+	return p_qual;
+}
+
+/*
+ * Build the python representation of a clause of the WHERE: a multicorn.Qual
+ * for a comparison, or a multicorn.BoolQual for a boolean combination of
+ * other clauses.
+ *
+ * Returns NULL if the clause can not be represented.
+ */
+static PyObject *
+clauseToPython(ForeignScanState *node, Expr *expr)
+{
+	PyObject   *p_class,
+			   *p_qual;
+
+	switch (nodeTag(expr))
+	{
+		case T_OpExpr:
+			return comparisonToPython(node, ((OpExpr *) expr)->opno, NULL,
+									  ((OpExpr *) expr)->args);
+		case T_DistinctExpr:
+			return comparisonToPython(node, ((DistinctExpr *) expr)->opno,
+									  "IS DISTINCT FROM",
+									  ((DistinctExpr *) expr)->args);
+		case T_ScalarArrayOpExpr:
+			{
+				ScalarArrayOpExpr *op = (ScalarArrayOpExpr *) expr;
+				PyObject   *p_field,
+						   *p_value;
+
+				p_field = fieldToPython(node, linitial(op->args));
+				if (p_field == NULL)
+				{
+					return NULL;
+				}
+				p_value = operandToPython(node, lsecond(op->args));
+				if (p_value == NULL)
+				{
+					Py_DECREF(p_field);
+					return NULL;
+				}
+				p_class = getClassString("multicorn.Qual");
+				p_qual = PyObject_CallFunction(p_class, "(O,(s,O),O)",
+											   p_field,
+											   getOperatorString(op->opno),
+											   op->useOr ? Py_True : Py_False,
+											   p_value);
+				errorCheck();
+				Py_DECREF(p_class);
+				Py_DECREF(p_field);
+				Py_DECREF(p_value);
+				return p_qual;
+			}
+		case T_NullTest:
+			{
+				NullTest   *test = (NullTest *) expr;
+				PyObject   *p_field;
+
+				if (test->argisrow)
+				{
+					return NULL;
+				}
+				p_field = fieldToPython(node, test->arg);
+				if (p_field == NULL)
+				{
+					return NULL;
+				}
+				p_class = getClassString("multicorn.Qual");
+				p_qual = PyObject_CallFunction(p_class, "(O,s,O)", p_field,
+											   test->nulltesttype == IS_NULL ?
+											   "=" : "<>", Py_None);
+				errorCheck();
+				Py_DECREF(p_class);
+				Py_DECREF(p_field);
+				return p_qual;
+			}
+		case T_Var:
+			{
+				/* A boolean column */
+				PyObject   *p_field = fieldToPython(node, expr);
+
+				if (p_field == NULL)
+				{
+					return NULL;
+				}
+				p_class = getClassString("multicorn.Qual");
+				p_qual = PyObject_CallFunction(p_class, "(O,s,O)", p_field,
+											   "=", Py_True);
+				errorCheck();
+				Py_DECREF(p_class);
+				Py_DECREF(p_field);
+				return p_qual;
+			}
+		case T_BoolExpr:
+			{
+				BoolExpr   *boolexpr = (BoolExpr *) expr;
+				PyObject   *p_quals = PyList_New(0);
+				ListCell   *lc;
+				char	   *operator;
+
+				switch (boolexpr->boolop)
+				{
+					case AND_EXPR:
+						operator = "and";
+						break;
+					case OR_EXPR:
+						operator = "or";
+						break;
+					default:
+						operator = "not";
+						break;
+				}
+				foreach(lc, boolexpr->args)
+				{
+					PyObject   *p_arg = clauseToPython(node,
+													   (Expr *) lfirst(lc));
+
+					/* The whole clause is left out with any of its parts. */
+					if (p_arg == NULL)
+					{
+						Py_DECREF(p_quals);
+						return NULL;
+					}
+					PyList_Append(p_quals, p_arg);
+					Py_DECREF(p_arg);
+				}
+				p_class = getClassString("multicorn.BoolQual");
+				p_qual = PyObject_CallFunction(p_class, "(s,O)", operator,
+											   p_quals);
+				errorCheck();
+				Py_DECREF(p_class);
+				Py_DECREF(p_quals);
+				return p_qual;
+			}
+		default:
+			return NULL;
+	}
+}
+
+/*
+ * Build the python list of the clauses of a scan which can be represented
+ * as a tree of quals, evaluating the parameters.
+ */
+static PyObject *
+clausesToPython(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_tree = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, state->clauses)
+	{
+		Expr	   *clause = (Expr *) lfirst(lc);
+		PyObject   *p_clause;
+
+		if (contain_volatile_functions((Node *) clause))
+		{
+			continue;
+		}
+		p_clause = clauseToPython(node, clause);
+		if (p_clause != NULL)
+		{
+			PyList_Append(p_tree, p_clause);
+			Py_DECREF(p_clause);
+		}
+	}
+	return p_tree;
+}
+
+/*
+ * Execute the query in the python fdw, and returns an iterator.
+ *
+ * If a partition of a parallel scan is set in the state, only this partition
+ * is scanned.
+ */
+PyObject *
+execute(ForeignScanState *node, ExplainState *es)
+{
+	MulticornExecState *state = node->fdw_state;
+	bool		null_param;
+	PyObject   *p_targets_set,
+			   *p_quals = scanQualsToPython(node, &null_param),
+			   *p_pathkeys,
+			   *p_iterable,
+			   *p_method;
+	ListCell   *lc;
+
+	/*
+	 * A strict qual with a NULL parameter matches no row, but python would
+	 * see it as an IS NULL test, and may enforce it as such. The rows of an
+	 * aggregate or a join do not only depend on the scanned ones.
+	 */
+	if (null_param && es == NULL && !state->aggregate &&
+		state->join_type == NULL)
+	{
+		Py_DECREF(p_quals);
+		Py_INCREF(Py_None);
+		state->p_iterator = Py_None;
+		return state->p_iterator;
+	}
+	p_pathkeys = PyList_New(0);
+	/* Transform every object to a suitable python representation */
+	p_targets_set = valuesToPySet(state->target_list);
+
+	foreach(lc, state->pathkeys)
+	{
+		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+		PyObject *python_sortkey = getSortKey(pathkey);
+		PyList_Append(p_pathkeys, python_sortkey);
+		Py_DECREF(python_sortkey);
+	}
+	{
+		PyObject * args,
+				 * kwargs = PyDict_New();
+		if(PyList_Size(p_pathkeys) > 0){
+			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
+		}
+		if (state->projected_rows && es == NULL && !state->aggregate &&
+			state->join_type == NULL)
+		{
+			PyObject   *p_projection = PyList_New(state->nprojected);
+			int			k;
+
+			for (k = 0; k < state->nprojected; k++)
+			{
+				PyObject   *key = state->cinfos[state->projection[k]]->attrkey;
+
+				Py_INCREF(key);
+				PyList_SET_ITEM(p_projection, k, key);
+			}
+			PyDict_SetItemString(kwargs, "projection", p_projection);
+			Py_DECREF(p_projection);
+		}
+		if (state->structured_quals && es == NULL && !state->aggregate &&
+			state->join_type == NULL && state->p_lookups == NULL)
+		{
+			PyObject   *p_tree = clausesToPython(node);
+
+			PyDict_SetItemString(kwargs, "quals_tree", p_tree);
+			Py_DECREF(p_tree);
+		}
+		if (state->pushed_limit && es == NULL)
+		{
+			PyObject   *p_limit = Py_None,
+					   *p_offset = PyLong_FromLongLong(state->limit_offset);
+
+			if (state->limit_count >= 0)
+			{
+				p_limit = PyLong_FromLongLong(state->limit_count);
+			}
+			else
+			{
+				Py_INCREF(p_limit);
+			}
+			PyDict_SetItemString(kwargs, "limit", p_limit);
+			PyDict_SetItemString(kwargs, "offset", p_offset);
+			Py_DECREF(p_limit);
+			Py_DECREF(p_offset);
+		}
+		if(es != NULL){
+			PyObject * verbose;
+			if(es->verbose){
+				verbose = Py_True;
+			} else {
+				verbose = Py_False;
+			}
+			p_method = PyObject_GetAttrString(state->fdw_instance, "explain");
+			args = PyTuple_Pack(2, p_quals, p_targets_set);
+			PyDict_SetItemString(kwargs, "verbose", verbose);
+			errorCheck();
+		} else if (state->join_type != NULL) {
+			PyObject   *p_outer = joinedTableToPython(state->outer_table,
+													  p_quals,
+													  state->target_list),
+					   *p_inner_quals = qualListToPython(node,
+														 state->inner_qual_list,
+														 state->inner_cinfos,
+														 NULL),
+					   *p_inner = joinedTableToPython(state->inner_table,
+													  p_inner_quals,
+													  state->inner_targets),
+					   *p_join_quals = tuplesToPyList(state->join_quals);
+
+			p_method = PyObject_GetAttrString(state->fdw_instance,
+											  "execute_join");
+			errorCheck();
+			args = Py_BuildValue("(O,O,s,O)", p_outer, p_inner,
+								 state->join_type, p_join_quals);
+			errorCheck();
+			Py_DECREF(p_outer);
+			Py_DECREF(p_inner_quals);
+			Py_DECREF(p_inner);
+			Py_DECREF(p_join_quals);
+		} else if (state->aggregate) {
+			PyObject   *p_group_by = stringsToPyList(state->group_by),
+					   *p_aggregates = tuplesToPyList(state->aggregates);
+
+			p_method = PyObject_GetAttrString(state->fdw_instance,
+											  "execute_aggregate");
+			errorCheck();
+			args = PyTuple_Pack(3, p_group_by, p_aggregates, p_quals);
+			errorCheck();
+			Py_DECREF(p_group_by);
+			Py_DECREF(p_aggregates);
+		} else if (state->p_partition != NULL) {
+			p_method = PyObject_GetAttrString(state->fdw_instance,
+											  "execute_partition");
+			errorCheck();
+			args = PyTuple_Pack(3, state->p_partition, p_quals,
+								p_targets_set);
+			errorCheck();
+		} else if (state->p_lookups != NULL) {
+			p_method = PyObject_GetAttrString(state->fdw_instance, "_lookup");
+			errorCheck();
+			args = PyTuple_Pack(3, state->p_lookups, p_quals, p_targets_set);
+			errorCheck();
+		} else {
+			p_method = PyObject_GetAttrString(state->fdw_instance,
+											  state->batch_execute ?
+											  "execute_batches" : "execute");
+			errorCheck();
+			args = PyTuple_Pack(2, p_quals, p_targets_set);
+			errorCheck();
+		}
+		p_iterable = PyObject_Call(p_method, args, kwargs);
+		errorCheck();
+		Py_DECREF(p_method);
+		Py_DECREF(args);
+		Py_DECREF(kwargs);
+	}
+
+	errorCheck();
+	if (p_iterable == Py_None){
+		Py_INCREF(p_iterable);
+		state->p_iterator = p_iterable;
+	}
+	else
+	{
+		state->p_iterator = PyObject_GetIter(p_iterable);
+	}
+	Py_DECREF(p_quals);
+	Py_DECREF(p_targets_set);
+	Py_DECREF(p_pathkeys);
+	Py_DECREF(p_iterable);
+	errorCheck();
+	/* Fetch the rows in a background thread while PostgreSQL consumes them. */
+	if (es == NULL && state->prefetch_rows > 0 && state->p_iterator != Py_None)
+	{
+		startBackgroundIterator(state, state->prefetch_rows);
+	}
+	return state->p_iterator;
+}
+
+/*
+ * Modify the rows matching the quals of a directly modified foreign table, by
+ * calling the python update_where or delete_where method.
+ *
+ * Returns the number of modified rows, as returned by python.
+ */
+long
+executeDirectModify(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	ExprContext *econtext = node->ss.ps.ps_ExprContext;
+	bool		null_param;
+	PyObject   *p_quals = scanQualsToPython(node, &null_param),
+			   *p_count;
+	long		count;
+
+	/* A strict qual with a NULL parameter matches no row. */
+	if (null_param)
+	{
+		Py_DECREF(p_quals);
+		return 0;
+	}
+
+	if (((ForeignScan *) node->ss.ps.plan)->operation == CMD_UPDATE)
+	{
+		PyObject   *p_new_values = PyDict_New();
+		ListCell   *lc_expr,
+				   *lc_attno;
+
+		forboth(lc_expr, state->update_exprs, lc_attno, state->update_attnos)
+		{
+			ConversionInfo *cinfo = state->cinfos[lfirst_int(lc_attno) - 1];
+			PyObject   *p_value;
+			Datum		value;
+			bool		isNull;
+
+#if PG_VERSION_NUM >= 100000
+			value = ExecEvalExpr((ExprState *) lfirst(lc_expr), econtext, &isNull);
+#else
+			value = ExecEvalExpr((ExprState *) lfirst(lc_expr), econtext, &isNull, NULL);
+#endif
+			if (isNull)
+			{
+				p_value = Py_None;
+				Py_INCREF(p_value);
+			}
+			else
+			{
+				p_value = datumToPython(value, cinfo->atttypoid, cinfo);
+				errorCheck();
+			}
+			PyDict_SetItem(p_new_values, cinfo->attrkey, p_value);
+			Py_DECREF(p_value);
+		}
+		p_count = PyObject_CallMethod(state->fdw_instance, "update_where",
+									  "(O,O)", p_quals, p_new_values);
+		Py_DECREF(p_new_values);
+	}
+	else
+	{
+		p_count = PyObject_CallMethod(state->fdw_instance, "delete_where",
+									  "(O)", p_quals);
+	}
+	Py_DECREF(p_quals);
+	errorCheck();
+	count = PyLong_AsLong(p_count);
+	Py_DECREF(p_count);
+	errorCheck();
+	return count;
+}
+
+/*
+ * Ask the python fdw how to split a parallel scan, and return the partitions
+ * as a new list.
+ */
+PyObject *
+getPartitions(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_quals = scanQualsToPython(node, NULL),
+			   *p_targets_set = valuesToPySet(state->target_list),
+			   *p_partitions,
+			   *result;
+
+	p_partitions = PyObject_CallMethod(state->fdw_instance, "get_partitions",
+									   "(O,O)", p_quals, p_targets_set);
+	errorCheck();
+	Py_DECREF(p_quals);
+	Py_DECREF(p_targets_set);
+	result = PySequence_List(p_partitions);
+	Py_DECREF(p_partitions);
+	errorCheck();
+	return result;
+}
+
+/*
+ * Ask the python fdw for its own statistics of a scan or a modification, and
+ * return them as a list of (name, value) pairs of strings, sorted by name.
+ */
+List *
+getScanStats(PyObject *fdw_instance)
+{
+	PyObject   *p_stats = PyObject_CallMethod(fdw_instance, "get_scan_stats",
+											  "()"),
+			   *p_items;
+	List	   *result = NIL;
+	Py_ssize_t	i;
+
+	errorCheck();
+	if (PyDict_Check(p_stats))
+	{
+		p_items = PyDict_Items(p_stats);
+	}
+	else
+	{
+		p_items = PySequence_List(p_stats);
+	}
+	Py_DECREF(p_stats);
+	errorCheck();
+	PyList_Sort(p_items);
+	errorCheck();
+	for (i = 0; i < PyList_Size(p_items); i++)
+	{
+		PyObject   *p_item = PyList_GetItem(p_items, i),
+				   *p_name = PySequence_GetItem(p_item, 0),
+				   *p_value = PySequence_GetItem(p_item, 1),
+				   *p_name_str,
+				   *p_value_str;
+
+		errorCheck();
+		p_name_str = PyObject_Str(p_name);
+		p_value_str = PyObject_Str(p_value);
+		Py_DECREF(p_name);
+		Py_DECREF(p_value);
+		errorCheck();
+		result = lappend(result,
+						 list_make2(makeString(pstrdup(PyString_AsString(p_name_str))),
+									makeString(pstrdup(PyString_AsString(p_value_str)))));
+		Py_DECREF(p_name_str);
+		Py_DECREF(p_value_str);
+	}
+	Py_DECREF(p_items);
+	return result;
+}
+
+/*
+ * Get the number of python garbage collections, and their total time in
+ * milliseconds, since they were first asked for.
+ * Returns false if this python cannot count them.
+ */
+bool
+getGcStats(long *collections, double *gc_time)
+{
+	PyObject   *p_snapshot = getClassString("multicorn.gcstats.snapshot"),
+			   *p_result = PyObject_CallFunction(p_snapshot, "()");
+
+	Py_DECREF(p_snapshot);
+	errorCheck();
+	if (p_result == Py_None)
+	{
+		Py_DECREF(p_result);
+		return false;
+	}
+	*collections = PyLong_AsLong(PyTuple_GetItem(p_result, 0));
+	*gc_time = PyFloat_AsDouble(PyTuple_GetItem(p_result, 1));
+	Py_DECREF(p_result);
+	errorCheck();
+	return true;
+}
+
+/*
+ * Pickle a python object, to send it to another backend.
+ * The result is palloc'd, and its size stored in length.
+ */
+char *
+pickleObject(PyObject *object, Size *length)
+{
+	PyObject   *p_bytes;
+	char	   *data;
+	char	   *result;
+	Py_ssize_t	size;
+
+	if (pickleDumps == NULL)
+	{
+		pickleDumps = importAttribute("pickle", "dumps");
+	}
+	p_bytes = PyObject_CallFunction(pickleDumps, "(Oi)", object, -1);
+	errorCheck();
+	PyBytes_AsStringAndSize(p_bytes, &data, &size);
+	result = palloc(size);
+	memcpy(result, data, size);
+	*length = size;
+	Py_DECREF(p_bytes);
+	return result;
+}
+
+/*
+ * Unpickle an object pickled by pickleObject.
+ */
+PyObject *
+unpickleObject(const char *data, Size length)
+{
+	PyObject   *p_bytes = PyBytes_FromStringAndSize(data, length),
+			   *result;
+
+	if (pickleLoads == NULL)
+	{
+		pickleLoads = importAttribute("pickle", "loads");
+	}
+	result = PyObject_CallFunctionObjArgs(pickleLoads, p_bytes, NULL);
+	Py_DECREF(p_bytes);
+	errorCheck();
+	return result;
+}
+
+void
+pynumberToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	PyObject   *pTempStr;
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	pTempStr = PyObject_Str(pyobject);
+	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	appendBinaryStringInfo(buffer, tempbuffer, strlength);
+	Py_DECREF(pTempStr);
+}
+
+void
+pyunicodeToCString(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+	PyObject   *pTempStr;
+	pTempStr = PyUnicode_AsEncodedString(pyobject, getPythonEncodingName(), NULL);
+	errorCheck();
+	PyBytes_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	Py_DECREF(pTempStr);
+}
+
+void
+pystringToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	if (PyString_AsStringAndSize(pyobject, &tempbuffer, &strlength) < 0)
+	{
+		ereport(WARNING,
+				(errmsg("An error occured while decoding the %s column",
+						cinfo->attrname),
+				 errhint("You should maybe return unicode instead?")));
+	}
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+}
+
+void
+pysequenceToCString(PyObject *pyobject, StringInfo buffer,
+					ConversionInfo * cinfo)
+{
+	/* Its an array */
+	Py_ssize_t	i,
+				size = PySequence_Size(pyobject);
+	PyObject   *p_item;
+	int			previous_dims = cinfo->attndims,
+				previous_needquote = cinfo->need_quote;
+
+	if (cinfo->attndims == 0)
 	{
 		/* We are not supposed to be converted to an array. */
 		pyunknownToCstring(pyobject, buffer, cinfo);
 		return;
 	}
-	appendStringInfoChar(buffer, '{');
-	/* We are an array, so we need to quote stuff */
-	cinfo->need_quote = true;
-	cinfo->attndims = cinfo->attndims - 1;
-	for (i = 0; i < size; i++)
+	appendStringInfoChar(buffer, '{');
+	/* We are an array, so we need to quote stuff */
+	cinfo->need_quote = true;
+	cinfo->attndims = cinfo->attndims - 1;
+	for (i = 0; i < size; i++)
+	{
+		p_item = PySequence_GetItem(pyobject, i);
+		pyobjectToCString(p_item, buffer, cinfo);
+		Py_DECREF(p_item);
+		if (i != size - 1)
+		{
+			appendBinaryStringInfo(buffer, ", ", 2);
+		}
+	}
+	appendStringInfoChar(buffer, '}');
+	cinfo->attndims = previous_dims;
+	cinfo->need_quote = previous_needquote;
+}
+
+void
+pymappingToCString(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	PyObject   *items = PyMapping_Items(pyobject);
+	PyObject   *current_tuple;
+	Py_ssize_t	i;
+	Py_ssize_t	size = PyList_Size(items);
+	bool		need_quote = cinfo->need_quote;
+
+	cinfo->need_quote = true;
+	for (i = 0; i < size; i++)
+	{
+		current_tuple = PySequence_GetItem(items, i);
+		pyobjectToCString(PyTuple_GetItem(current_tuple, 0),
+						  buffer, cinfo);
+		appendBinaryStringInfo(buffer, "=>", 2);
+		pyobjectToCString(PyTuple_GetItem(current_tuple, 1),
+						  buffer, cinfo);
+		if (i != size - 1)
+		{
+			appendBinaryStringInfo(buffer, ", ", 2);
+		}
+		Py_DECREF(current_tuple);
+	}
+	Py_DECREF(items);
+	cinfo->need_quote = need_quote;
+}
+
+void
+pydateToCString(PyObject *pyobject, StringInfo buffer,
+				ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+	PyObject   *formatted_date;
+
+	formatted_date = PyObject_CallMethod(pyobject, "isoformat", "()");
+	PyString_AsStringAndSize(formatted_date, &tempbuffer, &strlength);
+	appendBinaryStringInfo(buffer, tempbuffer, strlength);
+	Py_DECREF(formatted_date);
+}
+
+
+void
+pyobjectToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	if (pyobject == NULL || pyobject == Py_None)
+	{
+		return;
+	}
+	if (PyNumber_Check(pyobject))
+	{
+		pynumberToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	if (PyUnicode_Check(pyobject))
+	{
+		pyunicodeToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	if (PyBytes_Check(pyobject))
+	{
+		pystringToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	if (PySequence_Check(pyobject))
+	{
+		pysequenceToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	if (PyMapping_Check(pyobject))
+	{
+		pymappingToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	importDateTime();
+	if (PyDate_Check(pyobject))
+	{
+		pydateToCString(pyobject, buffer, cinfo);
+		return;
+	}
+	pyunknownToCstring(pyobject, buffer, cinfo);
+}
+
+void
+pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	PyObject   *pTempStr = PyObject_Str(pyobject);
+	char	   *tempbuffer;
+	Py_ssize_t	strlength;
+
+	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	errorCheck();
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	Py_DECREF(pTempStr);
+	return;
+}
+
+/*
+ * Build the python keys used to look the columns up in the rows returned by
+ * the wrapper. They are created once per scan, and interned: looking them up
+ * in a dictionary built with literal keys then mostly boils down to a pointer
+ * comparison.
+ */
+void
+initConversioninfoKeys(ConversionInfo ** cinfos, int natts)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		PyObject   *key;
+
+		if (cinfos[i] == NULL || cinfos[i]->attrkey != NULL)
+		{
+			continue;
+		}
+		key = PyString_FromString(cinfos[i]->attrname);
+		errorCheck();
+#if PY_MAJOR_VERSION >= 3
+		PyUnicode_InternInPlace(&key);
+#else
+		PyString_InternInPlace(&key);
+#endif
+		cinfos[i]->attrkey = key;
+	}
+}
+
+void
+releaseConversioninfoKeys(ConversionInfo ** cinfos, int natts)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		if (cinfos[i] != NULL)
+		{
+			Py_CLEAR(cinfos[i]->attrkey);
+		}
+	}
+}
+
+/*
+ * Look a column up in a mapping. Returns a new reference, or NULL if the
+ * column is missing.
+ */
+static PyObject *
+getMappingItem(PyObject *p_value, ConversionInfo * cinfo)
+{
+	PyObject   *p_object;
+
+	if (cinfo->attrkey == NULL)
+	{
+		p_object = PyMapping_GetItemString(p_value, cinfo->attrname);
+	}
+	else if (PyDict_CheckExact(p_value))
+	{
+		/* Borrowed reference, and no KeyError to clear. */
+		p_object = PyDict_GetItem(p_value, cinfo->attrkey);
+		Py_XINCREF(p_object);
+		return p_object;
+	}
+	else
+	{
+		p_object = PyObject_GetItem(p_value, cinfo->attrkey);
+	}
+	if (p_object == NULL)
+	{
+		/* "KeyError", doesnt matter. */
+		PyErr_Clear();
+	}
+	return p_object;
+}
+
+/*
+ * Returns the value of a column whose values may be computed lazily, by
+ * calling it if it is callable.
+ * Steals the reference to the value, and returns a new one.
+ */
+static PyObject *
+resolveLazyValue(PyObject *p_object, ConversionInfo * cinfo)
+{
+	PyObject   *p_result;
+
+	if (!cinfo->lazy || p_object == NULL || !PyCallable_Check(p_object))
+	{
+		return p_object;
+	}
+	p_result = PyObject_CallObject(p_object, NULL);
+	Py_DECREF(p_object);
+	errorCheck();
+	return p_result;
+}
+
+/*
+ * Set every attribute not part of the projection to NULL.
+ */
+static void
+clearUnprojected(TupleTableSlot *slot, int *projection)
+{
+	if (projection != NULL)
+	{
+		int			natts = slot->tts_tupleDescriptor->natts;
+
+		memset(slot->tts_values, 0, sizeof(Datum) * natts);
+		memset(slot->tts_isnull, true, sizeof(bool) * natts);
+	}
+}
+
+void
+pythonDictToTuple(PyObject *p_value,
+				  TupleTableSlot *slot,
+				  ConversionInfo ** cinfos,
+				  int *projection,
+				  int nprojected,
+				  StringInfo buffer)
+{
+	int			i,
+				k,
+				natts = projection ? nprojected : slot->tts_tupleDescriptor->natts;
+	PyObject   *p_object;
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+
+	clearUnprojected(slot, projection);
+	for (k = 0; k < natts; k++)
+	{
+		i = projection ? projection[k] : k;
+		if (cinfos[i] == NULL)
+		{
+			continue;
+		}
+		p_object = resolveLazyValue(getMappingItem(p_value, cinfos[i]),
+									cinfos[i]);
+		if (p_object != NULL && p_object != Py_None)
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object,
+										buffer,
+										cinfos[i]);
+			if (buffer->data == NULL)
+			{
+				nulls[i] = true;
+			}
+			else
+			{
+				nulls[i] = false;
+			}
+		}
+		else
+		{
+			values[i] = (Datum) NULL;
+			nulls[i] = true;
+		}
+		Py_XDECREF(p_object);
+	}
+}
+
+void
+pythonSequenceToTuple(PyObject *p_value,
+					  TupleTableSlot *slot,
+					  ConversionInfo ** cinfos,
+					  int *projection,
+					  int nprojected,
+					  StringInfo buffer)
+{
+	int			i,
+				k,
+				natts = projection ? nprojected : slot->tts_tupleDescriptor->natts;
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	bool		fast = PyList_CheckExact(p_value) || PyTuple_CheckExact(p_value);
+	Py_ssize_t	size = fast ? PySequence_Fast_GET_SIZE(p_value) : 0;
+
+	clearUnprojected(slot, projection);
+	for (k = 0; k < natts; k++)
+	{
+		PyObject   *p_object;
+		ConversionInfo *cinfo;
+
+		i = projection ? projection[k] : k;
+		cinfo = cinfos[i];
+		if (cinfo == NULL)
+		{
+			continue;
+		}
+		if (fast && cinfo->seqindex < size)
+		{
+			p_object = PySequence_Fast_GET_ITEM(p_value, cinfo->seqindex);
+			Py_INCREF(p_object);
+		}
+		else
+		{
+			p_object = PySequence_GetItem(p_value, cinfo->seqindex);
+		}
+		p_object = resolveLazyValue(p_object, cinfo);
+		if(p_object == NULL || p_object == Py_None){
+			nulls[i] = true;
+			values[i] = 0;
+		}
+		else
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object, buffer,
+										cinfo);
+			if (buffer->data == NULL)
+			{
+				nulls[i] = true;
+			}
+			else
+			{
+				nulls[i] = false;
+			}
+		}
+		errorCheck();
+		Py_DECREF(p_object);
+	}
+}
+
+/*
+ * Convert a python result (a sequence or a dictionary) to a tupletableslot.
+ *
+ * If a projection is given, only the attributes it lists are read from the
+ * python object, the others are set to NULL.
+ */
+void
+pythonResultToTuple(PyObject *p_value,
+					TupleTableSlot *slot,
+					ConversionInfo ** cinfos,
+					int *projection,
+					int nprojected,
+					StringInfo buffer)
+{
+	if (PySequence_Check(p_value))
+	{
+		pythonSequenceToTuple(p_value, slot, cinfos, projection, nprojected,
+							  buffer);
+	}
+	else
+	{
+
+		if (PyMapping_Check(p_value))
+		{
+			pythonDictToTuple(p_value, slot, cinfos, projection, nprojected,
+							  buffer);
+		}
+		else
+		{
+			elog(ERROR, "Cannot transform anything else than mappings and"
+				 "sequences to rows");
+		}
+	}
+}
+
+/*
+ * Convert a python result to a tupletableslot, for wrappers returning
+ * projected rows: sequences then hold exactly the projected columns, in the
+ * projection order. Mappings are handled as usual.
+ */
+void
+pythonProjectedResultToTuple(PyObject *p_value,
+							 TupleTableSlot *slot,
+							 ConversionInfo ** cinfos,
+							 int *projection,
+							 int nprojected,
+							 StringInfo buffer)
+{
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	bool		fast;
+	int			k;
+
+	if (!PySequence_Check(p_value))
+	{
+		pythonResultToTuple(p_value, slot, cinfos, projection, nprojected,
+							buffer);
+		return;
+	}
+	fast = PyList_CheckExact(p_value) || PyTuple_CheckExact(p_value);
+	if (fast && PySequence_Fast_GET_SIZE(p_value) != nprojected)
+	{
+		ereport(ERROR,
+				(errmsg("Expected a row of %d columns, got %ld",
+						nprojected, (long) PySequence_Fast_GET_SIZE(p_value)),
+				 errhint("Rows must hold the columns from the projection argument, in order.")));
+	}
+	clearUnprojected(slot, projection);
+	for (k = 0; k < nprojected; k++)
+	{
+		int			i = projection[k];
+		PyObject   *p_object;
+
+		if (fast)
+		{
+			p_object = PySequence_Fast_GET_ITEM(p_value, k);
+			Py_INCREF(p_object);
+		}
+		else
+		{
+			p_object = PySequence_GetItem(p_value, k);
+			errorCheck();
+		}
+		p_object = resolveLazyValue(p_object, cinfos[i]);
+		if (p_object != Py_None)
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object, buffer, cinfos[i]);
+			nulls[i] = false;
+		}
+		Py_DECREF(p_object);
+	}
+}
+
+/*
+ * Columnar batches.
+ *
+ * A wrapper can return a multicorn.ColumnBatch instead of a single row.
+ * Columns exposing a one-dimensional, contiguous buffer of fixed-width
+ * numbers matching the column type are read straight from memory. Any other
+ * column is converted item by item, like the values of a row.
+ */
+
+static PyObject *columnBatchClass = NULL;
+
+bool
+isColumnBatch(PyObject *p_value)
+{
+	int			result;
+
+	if (p_value == NULL || p_value == Py_None)
+	{
+		return false;
+	}
+	if (columnBatchClass == NULL)
+	{
+		columnBatchClass = getClassString("multicorn.ColumnBatch");
+	}
+	result = PyObject_IsInstance(p_value, columnBatchClass);
+	errorCheck();
+	return result == 1;
+}
+
+/*
+ * Returns the size of the C type read for a struct format code, or 0 if it
+ * is not supported.
+ */
+static Py_ssize_t
+getFormatSize(char format)
+{
+	switch (format)
+	{
+		case 'b':
+		case 'B':
+		case '?':
+			return 1;
+		case 'h':
+		case 'H':
+			return sizeof(short);
+		case 'i':
+		case 'I':
+			return sizeof(int);
+		case 'l':
+		case 'L':
+			return sizeof(long);
+		case 'q':
+		case 'Q':
+			return sizeof(long long);
+		case 'n':
+		case 'N':
+			return sizeof(Py_ssize_t);
+		case 'f':
+			return sizeof(float);
+		case 'd':
+			return sizeof(double);
+		default:
+			return 0;
+	}
+}
+
+/*
+ * Returns the struct format code of a buffer if it is a single one, whose
+ * items have the size of the native C type, or 0.
+ *
+ * The standard sizes ("=" prefix) are accepted when they match the native
+ * ones: an "=l" buffer holds 4 bytes items, which cannot be read as a long
+ * on most 64 bits platforms.
+ */
+static char
+getBufferFormat(Py_buffer *view)
+{
+	const char *format = view->format;
+
+	if (format == NULL)
+	{
+		return view->itemsize == 1 ? 'B' : 0;
+	}
+	if (*format == '@' || *format == '=')
+	{
+		format++;
+	}
+	if (format[0] == '\0' || format[1] != '\0' ||
+		view->itemsize != getFormatSize(format[0]))
+	{
+		return 0;
+	}
+	return format[0];
+}
+
+static bool
+isIntegerFormat(char format)
+{
+	return strchr("bBhHiIlLqQnN", format) != NULL;
+}
+
+/*
+ * Check that values stored in a buffer with the given format can be read
+ * directly into a datum of the given type.
+ */
+static bool
+bufferFormatMatchesType(char format, Oid typeoid)
+{
+	switch (typeoid)
+	{
+		case INT2OID:
+		case INT4OID:
+		case INT8OID:
+		case NUMERICOID:
+			return isIntegerFormat(format);
+		case FLOAT4OID:
+		case FLOAT8OID:
+			return format == 'f' || format == 'd' || isIntegerFormat(format);
+		case BOOLOID:
+			return format == '?';
+		default:
+			return false;
+	}
+}
+
+/*
+ * Try to get a buffer holding exactly one flat array of items.
+ */
+static bool
+getFlatBuffer(PyObject *p_object, Py_buffer *view)
+{
+	if (!PyObject_CheckBuffer(p_object))
+	{
+		return false;
+	}
+	if (PyObject_GetBuffer(p_object, view,
+						   PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0)
+	{
+		PyErr_Clear();
+		return false;
+	}
+	if (view->ndim != 1 || view->itemsize <= 0)
+	{
+		PyBuffer_Release(view);
+		return false;
+	}
+	return true;
+}
+
+static Py_ssize_t
+getBatchColumnSize(PyObject *p_values, Py_buffer *view, bool has_buffer)
+{
+	if (has_buffer)
+	{
+		return view->len / view->itemsize;
+	}
+	return PySequence_Fast_GET_SIZE(p_values);
+}
+
+/*
+ * Release what a batch being built holds, before reporting an error: the
+ * buffers exported by its columns would otherwise stay locked.
+ * The pending python exception, if any, is kept.
+ */
+static void
+abortColumnarBatch(MulticornColumnarBatch * batch, PyObject *p_columns,
+				   PyObject *p_nulls)
+{
+	PyObject   *p_type,
+			   *p_value,
+			   *p_traceback;
+
+	PyErr_Fetch(&p_type, &p_value, &p_traceback);
+	endColumnarBatch(batch);
+	Py_XDECREF(p_columns);
+	Py_XDECREF(p_nulls);
+	PyErr_Restore(p_type, p_value, p_traceback);
+}
+
+MulticornColumnarBatch *
+beginColumnarBatch(PyObject *p_batch, ConversionInfo ** cinfos, int natts,
+				   int *projection, int nprojected)
+{
+	MulticornColumnarBatch *batch = palloc0(sizeof(MulticornColumnarBatch));
+	PyObject   *p_columns = PyObject_GetAttrString(p_batch, "columns"),
+			   *p_nulls = PyObject_GetAttrString(p_batch, "nulls"),
+			   *p_length = PyObject_GetAttrString(p_batch, "length");
+	Py_ssize_t	length;
+	int			k;
+
+	batch->natts = natts;
+	batch->columns = palloc0(sizeof(MulticornBatchColumn) * natts);
+	if (p_length != NULL)
+	{
+		batch->length = PyNumber_AsSsize_t(p_length, NULL);
+		Py_DECREF(p_length);
+	}
+	if (PyErr_Occurred())
+	{
+		abortColumnarBatch(batch, p_columns, p_nulls);
+		errorCheck();
+	}
+	length = batch->length;
+	/* Columns outside of the projection are left out, and thus null. */
+	for (k = 0; k < nprojected; k++)
+	{
+		int			i = projection[k];
+		ConversionInfo *cinfo = cinfos[i];
+		MulticornBatchColumn *column = &batch->columns[i];
+		PyObject   *p_column,
+				   *p_mask;
+		Py_ssize_t	size;
+
+		if (cinfo == NULL)
+		{
+			continue;
+		}
+		p_column = PyMapping_GetItemString(p_columns, cinfo->attrname);
+		if (p_column == NULL || p_column == Py_None)
+		{
+			/* A missing column is null. */
+			PyErr_Clear();
+			Py_XDECREF(p_column);
+			continue;
+		}
+		column->p_column = p_column;
+		if (getFlatBuffer(p_column, &column->view))
+		{
+			column->format = getBufferFormat(&column->view);
+			column->has_buffer = bufferFormatMatchesType(column->format,
+														 cinfo->atttypoid);
+			if (!column->has_buffer)
+			{
+				PyBuffer_Release(&column->view);
+			}
+		}
+		if (!column->has_buffer)
+		{
+			column->p_values = PySequence_Fast(p_column,
+								   "ColumnBatch columns must be sequences");
+			if (column->p_values == NULL)
+			{
+				abortColumnarBatch(batch, p_columns, p_nulls);
+				errorCheck();
+			}
+		}
+		size = getBatchColumnSize(column->p_values, &column->view,
+								  column->has_buffer);
+		if (size < length)
+		{
+			abortColumnarBatch(batch, p_columns, p_nulls);
+			ereport(ERROR,
+					(errmsg("Column %s of the batch has %ld values, %ld expected",
+							cinfo->attrname, (long) size,
+							(long) length)));
+		}
+		if (p_nulls == Py_None)
+		{
+			continue;
+		}
+		p_mask = PyMapping_GetItemString(p_nulls, cinfo->attrname);
+		if (p_mask == NULL || p_mask == Py_None)
+		{
+			PyErr_Clear();
+			Py_XDECREF(p_mask);
+			continue;
+		}
+		if (getFlatBuffer(p_mask, &column->nullmask))
+		{
+			column->has_nullmask = column->nullmask.itemsize == 1;
+			if (!column->has_nullmask)
+			{
+				PyBuffer_Release(&column->nullmask);
+			}
+		}
+		if (!column->has_nullmask)
+		{
+			column->p_nulls = PySequence_Fast(p_mask,
+								 "ColumnBatch null masks must be sequences");
+			Py_DECREF(p_mask);
+			if (column->p_nulls == NULL)
+			{
+				abortColumnarBatch(batch, p_columns, p_nulls);
+				errorCheck();
+			}
+		}
+		else
+		{
+			Py_DECREF(p_mask);
+		}
+		size = getBatchColumnSize(column->p_nulls, &column->nullmask,
+								  column->has_nullmask);
+		if (size < length)
+		{
+			abortColumnarBatch(batch, p_columns, p_nulls);
+			ereport(ERROR,
+					(errmsg("The null mask of column %s has %ld values, %ld expected",
+							cinfo->attrname, (long) size,
+							(long) length)));
+		}
+	}
+	Py_DECREF(p_columns);
+	Py_DECREF(p_nulls);
+	return batch;
+}
+
+/*
+ * Read a value from a column buffer, in the column type.
+ * Returns false if the value does not fit, in which case the caller converts
+ * the python object instead, and reports a proper error.
+ */
+static bool
+bufferItemToDatum(MulticornBatchColumn * column, Py_ssize_t index,
+				  ConversionInfo * cinfo, Datum *value)
+{
+	char	   *ptr = (char *) column->view.buf + index * column->view.itemsize;
+	int64		intvalue = 0;
+	double		floatvalue = 0;
+	bool		isfloat = false;
+
+	/* The buffer is not guaranteed to be aligned, hence the memcpys. */
+	switch (column->format)
+	{
+		case 'b':
+			{
+				signed char v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'B':
+			{
+				unsigned char v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case '?':
+			*value = BoolGetDatum(*ptr != 0);
+			return true;
+		case 'h':
+			{
+				short		v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'H':
+			{
+				unsigned short v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'i':
+			{
+				int			v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'I':
+			{
+				unsigned int v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'l':
+			{
+				long		v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'q':
+			{
+				long long	v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'n':
+			{
+				Py_ssize_t	v;
+
+				memcpy(&v, ptr, sizeof(v));
+				intvalue = v;
+				break;
+			}
+		case 'L':
+		case 'Q':
+		case 'N':
+			{
+				unsigned long long v = 0;
+
+				if (column->format == 'L')
+				{
+					unsigned long l;
+
+					memcpy(&l, ptr, sizeof(l));
+					v = l;
+				}
+				else if (column->format == 'N')
+				{
+					size_t		n;
+
+					memcpy(&n, ptr, sizeof(n));
+					v = n;
+				}
+				else
+				{
+					memcpy(&v, ptr, sizeof(v));
+				}
+				if (v > (unsigned long long) INT64CONST(0x7FFFFFFFFFFFFFFF))
+				{
+					return false;
+				}
+				intvalue = (int64) v;
+				break;
+			}
+		case 'f':
+			{
+				float		v;
+
+				memcpy(&v, ptr, sizeof(v));
+				floatvalue = v;
+				isfloat = true;
+				break;
+			}
+		case 'd':
+			memcpy(&floatvalue, ptr, sizeof(floatvalue));
+			isfloat = true;
+			break;
+		default:
+			return false;
+	}
+	switch (cinfo->atttypoid)
 	{
-		p_item = PySequence_GetItem(pyobject, i);
-		pyobjectToCString(p_item, buffer, cinfo);
-		Py_DECREF(p_item);
-		if (i != size - 1)
+		case INT2OID:
+			if (intvalue < SHRT_MIN || intvalue > SHRT_MAX)
+				return false;
+			*value = Int16GetDatum((int16) intvalue);
+			return true;
+		case INT4OID:
+			if (intvalue < INT_MIN || intvalue > INT_MAX)
+				return false;
+			*value = Int32GetDatum((int32) intvalue);
+			return true;
+		case INT8OID:
+			*value = Int64GetDatum(intvalue);
+			return true;
+		case NUMERICOID:
+			*value = DirectFunctionCall1(int8_numeric, Int64GetDatum(intvalue));
+			if (cinfo->atttypmod >= 0)
+			{
+				*value = DirectFunctionCall2(numeric, *value,
+											 Int32GetDatum(cinfo->atttypmod));
+			}
+			return true;
+		case FLOAT4OID:
+			if (!isfloat)
+				floatvalue = (double) intvalue;
+			if (isinf((float4) floatvalue) && !isinf(floatvalue))
+				return false;
+			*value = Float4GetDatum((float4) floatvalue);
+			return true;
+		case FLOAT8OID:
+			if (!isfloat)
+				floatvalue = (double) intvalue;
+			*value = Float8GetDatum(floatvalue);
+			return true;
+		default:
+			return false;
+	}
+}
+
+static bool
+batchColumnIsNull(MulticornBatchColumn * column, Py_ssize_t index)
+{
+	int			result;
+
+	if (column->has_nullmask)
+	{
+		return ((char *) column->nullmask.buf)[index] != 0;
+	}
+	if (column->p_nulls == NULL)
+	{
+		return false;
+	}
+	result = PyObject_IsTrue(PySequence_Fast_GET_ITEM(column->p_nulls, index));
+	errorCheck();
+	return result == 1;
+}
+
+/*
+ * Store the next row of a columnar batch in the slot.
+ * Returns false once every row has been read.
+ */
+bool
+columnarBatchToTuple(MulticornColumnarBatch * batch,
+					 TupleTableSlot *slot,
+					 ConversionInfo ** cinfos,
+					 StringInfo buffer)
+{
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	Py_ssize_t	index = batch->index;
+	int			i;
+
+	if (index >= batch->length)
+	{
+		return false;
+	}
+	for (i = 0; i < batch->natts; i++)
+	{
+		MulticornBatchColumn *column = &batch->columns[i];
+		PyObject   *p_object;
+
+		values[i] = (Datum) 0;
+		nulls[i] = true;
+		if (column->p_column == NULL || batchColumnIsNull(column, index))
 		{
-			appendBinaryStringInfo(buffer, ", ", 2);
+			continue;
+		}
+		if (column->has_buffer &&
+			bufferItemToDatum(column, index, cinfos[i], &values[i]))
+		{
+			nulls[i] = false;
+			continue;
 		}
+		if (column->p_values != NULL)
+		{
+			p_object = PySequence_Fast_GET_ITEM(column->p_values, index);
+			Py_INCREF(p_object);
+		}
+		else
+		{
+			p_object = PySequence_GetItem(column->p_column, index);
+			errorCheck();
+		}
+		if (p_object != Py_None)
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object, buffer, cinfos[i]);
+			nulls[i] = false;
+		}
+		Py_DECREF(p_object);
 	}
-	appendStringInfoChar(buffer, '}');
-	cinfo->attndims = previous_dims;
-	cinfo->need_quote = previous_needquote;
+	batch->index++;
+	return true;
 }
 
 void
-pymappingToCString(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
+endColumnarBatch(MulticornColumnarBatch * batch)
 {
-	PyObject   *items = PyMapping_Items(pyobject);
-	PyObject   *current_tuple;
-	Py_ssize_t	i;
-	Py_ssize_t	size = PyList_Size(items);
-	bool		need_quote = cinfo->need_quote;
+	int			i;
 
-	cinfo->need_quote = true;
-	for (i = 0; i < size; i++)
+	for (i = 0; i < batch->natts; i++)
 	{
-		current_tuple = PySequence_GetItem(items, i);
-		pyobjectToCString(PyTuple_GetItem(current_tuple, 0),
-						  buffer, cinfo);
-		appendBinaryStringInfo(buffer, "=>", 2);
-		pyobjectToCString(PyTuple_GetItem(current_tuple, 1),
-						  buffer, cinfo);
-		if (i != size - 1)
+		MulticornBatchColumn *column = &batch->columns[i];
+
+		if (column->has_buffer)
 		{
-			appendBinaryStringInfo(buffer, ", ", 2);
+			PyBuffer_Release(&column->view);
 		}
-		Py_DECREF(current_tuple);
+		if (column->has_nullmask)
+		{
+			PyBuffer_Release(&column->nullmask);
+		}
+		Py_XDECREF(column->p_column);
+		Py_XDECREF(column->p_values);
+		Py_XDECREF(column->p_nulls);
 	}
-	Py_DECREF(items);
-	cinfo->need_quote = need_quote;
+	pfree(batch->columns);
+	pfree(batch);
 }
 
-void
-pydateToCString(PyObject *pyobject, StringInfo buffer,
-				ConversionInfo * cinfo)
+/*
+ * Direct python to datum converters.
+ *
+ * Those avoid formatting the python object to a string only to parse it back
+ * with the type input function. Each of them returns false if it does not
+ * know how to handle the given object, in which case pyobjectToDatum falls
+ * back to the generic text representation.
+ */
+
+static bool
+pyintegerToInt64(PyObject *object, int64 *result)
+{
+	long long	value;
+	int			overflow;
+
+#if PY_MAJOR_VERSION < 3
+	if (PyInt_Check(object) && !PyBool_Check(object))
+	{
+		*result = (int64) PyInt_AS_LONG(object);
+		return true;
+	}
+#endif
+	if (!PyLong_Check(object) || PyBool_Check(object))
+	{
+		return false;
+	}
+	value = PyLong_AsLongLongAndOverflow(object, &overflow);
+	if (overflow != 0 || (value == -1 && PyErr_Occurred()))
+	{
+		/* Let the input function report the out of range value. */
+		PyErr_Clear();
+		return false;
+	}
+	*result = (int64) value;
+	return true;
+}
+
+static bool
+pyobjectToInt2Datum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int64		result;
+
+	if (!pyintegerToInt64(object, &result) ||
+		result < SHRT_MIN || result > SHRT_MAX)
+	{
+		return false;
+	}
+	*value = Int16GetDatum((int16) result);
+	return true;
+}
+
+static bool
+pyobjectToInt4Datum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int64		result;
+
+	if (!pyintegerToInt64(object, &result) ||
+		result < INT_MIN || result > INT_MAX)
+	{
+		return false;
+	}
+	*value = Int32GetDatum((int32) result);
+	return true;
+}
+
+static bool
+pyobjectToInt8Datum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int64		result;
+
+	if (!pyintegerToInt64(object, &result))
+	{
+		return false;
+	}
+	*value = Int64GetDatum(result);
+	return true;
+}
+
+static bool
+pyobjectToDouble(PyObject *object, double *result)
+{
+	int64		intvalue;
+
+	if (PyFloat_Check(object))
+	{
+		*result = PyFloat_AS_DOUBLE(object);
+		return true;
+	}
+	if (pyintegerToInt64(object, &intvalue))
+	{
+		*result = (double) intvalue;
+		return true;
+	}
+	return false;
+}
+
+static bool
+pyobjectToFloat4Datum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	double		result;
+
+	if (!pyobjectToDouble(object, &result))
+	{
+		return false;
+	}
+	/* Leave the overflow error to float4in. */
+	if (isinf((float4) result) && !isinf(result))
+	{
+		return false;
+	}
+	*value = Float4GetDatum((float4) result);
+	return true;
+}
+
+static bool
+pyobjectToFloat8Datum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	double		result;
+
+	if (!pyobjectToDouble(object, &result))
+	{
+		return false;
+	}
+	*value = Float8GetDatum(result);
+	return true;
+}
+
+static bool
+pyobjectToBoolDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	if (!PyBool_Check(object))
+	{
+		return false;
+	}
+	*value = BoolGetDatum(object == Py_True);
+	return true;
+}
+
+static bool
+pyobjectToNumericDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	int64		result;
+
+	if (!pyintegerToInt64(object, &result))
+	{
+		return false;
+	}
+	*value = DirectFunctionCall1(int8_numeric, Int64GetDatum(result));
+	if (cinfo->atttypmod >= 0)
+	{
+		*value = DirectFunctionCall2(numeric, *value,
+									 Int32GetDatum(cinfo->atttypmod));
+	}
+	return true;
+}
+
+/*
+ * Check the text built from a python string before handing it to
+ * PostgreSQL. A str may hold NUL characters, and bytes any sequence of
+ * bytes, which may be invalid in the server encoding.
+ */
+static void
+verifyTextDatum(Datum value, bool from_bytes)
+{
+	text	   *t = DatumGetTextPP(value);
+	const char *data = VARDATA_ANY(t);
+	int			length = VARSIZE_ANY_EXHDR(t);
+
+	if (from_bytes || memchr(data, '\0', length) != NULL)
+	{
+		pg_verify_mbstr(GetDatabaseEncoding(), data, length, false);
+	}
+}
+
+static bool
+pyobjectToTextDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
 {
 	char	   *tempbuffer;
 	Py_ssize_t	strlength = 0;
-	PyObject   *formatted_date;
 
-	formatted_date = PyObject_CallMethod(pyobject, "isoformat", "()");
-	PyString_AsStringAndSize(formatted_date, &tempbuffer, &strlength);
-	appendBinaryStringInfo(buffer, tempbuffer, strlength);
-	Py_DECREF(formatted_date);
-}
+	if (PyUnicode_Check(object))
+	{
+		PyObject   *pTempStr;
 
+#if PY_MAJOR_VERSION >= 3
+		if (GetDatabaseEncoding() == PG_UTF8)
+		{
+			/* Use the utf8 representation cached by the object itself. */
+			tempbuffer = (char *) PyUnicode_AsUTF8AndSize(object, &strlength);
+			errorCheck();
+			*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer,
+															  strlength));
+			verifyTextDatum(*value, false);
+			return true;
+		}
+#endif
+		pTempStr = PyUnicode_AsEncodedString(object, getPythonEncodingName(), NULL);
+		errorCheck();
+		PyBytes_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+		*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer,
+														  strlength));
+		Py_DECREF(pTempStr);
+		verifyTextDatum(*value, false);
+		return true;
+	}
+	if (PyBytes_Check(object))
+	{
+		PyBytes_AsStringAndSize(object, &tempbuffer, &strlength);
+		*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer,
+														  strlength));
+		verifyTextDatum(*value, true);
+		return true;
+	}
+	return false;
+}
 
-void
-pyobjectToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+static bool
+pyobjectToByteaDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
 {
-	if (pyobject == NULL || pyobject == Py_None)
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	if (!PyBytes_Check(object))
 	{
-		return;
+		return false;
 	}
-	if (PyNumber_Check(pyobject))
+	PyBytes_AsStringAndSize(object, &tempbuffer, &strlength);
+	*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer, strlength));
+	return true;
+}
+
+static bool
+pyobjectToDateDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	/* A datetime is a date too, let date_in truncate it. */
+	if (!PyDate_Check(object) || PyDateTime_Check(object))
 	{
-		pynumberToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	if (PyUnicode_Check(pyobject))
+	*value = DateADTGetDatum(date2j(PyDateTime_GET_YEAR(object),
+									PyDateTime_GET_MONTH(object),
+									PyDateTime_GET_DAY(object))
+							 - POSTGRES_EPOCH_JDATE);
+	return true;
+}
+
+/*
+ * Convert a python datetime to a timestamp, shifted by the given offset
+ * (in seconds west of UTC) if tzp is not NULL.
+ */
+static bool
+pydatetimeToTimestamp(PyObject *object, int *tzp, Timestamp *result)
+{
+	struct pg_tm tm;
+	fsec_t		fsec;
+
+	tm.tm_year = PyDateTime_GET_YEAR(object);
+	tm.tm_mon = PyDateTime_GET_MONTH(object);
+	tm.tm_mday = PyDateTime_GET_DAY(object);
+	tm.tm_hour = PyDateTime_DATE_GET_HOUR(object);
+	tm.tm_min = PyDateTime_DATE_GET_MINUTE(object);
+	tm.tm_sec = PyDateTime_DATE_GET_SECOND(object);
+	fsec = PyDateTime_DATE_GET_MICROSECOND(object);
+	return tm2timestamp(&tm, fsec, tzp, result) == 0;
+}
+
+static bool
+pyobjectToTimestampDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	Timestamp	result;
+
+	/*
+	 * Only handle naive datetimes, and leave the rounding to a given
+	 * precision to timestamp_in.
+	 */
+	if (!PyDateTime_Check(object) || _PyDateTime_HAS_TZINFO(object) ||
+		cinfo->atttypmod >= 0)
 	{
-		pyunicodeToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	if (PyBytes_Check(pyobject))
+	if (!pydatetimeToTimestamp(object, NULL, &result))
 	{
-		pystringToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	if (PySequence_Check(pyobject))
+	*value = TimestampGetDatum(result);
+	return true;
+}
+
+static bool
+pyobjectToTimestampTzDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	PyObject   *p_offset;
+	int			tz;
+	TimestampTz result;
+
+	/*
+	 * Naive datetimes are interpreted in the session timezone, which is the
+	 * job of timestamptz_in.
+	 */
+	if (!PyDateTime_Check(object) || !_PyDateTime_HAS_TZINFO(object) ||
+		cinfo->atttypmod >= 0)
 	{
-		pysequenceToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	if (PyMapping_Check(pyobject))
+	p_offset = PyObject_CallMethod(object, "utcoffset", "()");
+	errorCheck();
+	if (!PyDelta_Check(p_offset) ||
+		((PyDateTime_Delta *) p_offset)->microseconds != 0)
 	{
-		pymappingToCString(pyobject, buffer, cinfo);
-		return;
+		Py_DECREF(p_offset);
+		return false;
 	}
-	PyDateTime_IMPORT;
-	if (PyDate_Check(pyobject))
+	tz = -(((PyDateTime_Delta *) p_offset)->days * SECS_PER_DAY +
+		   ((PyDateTime_Delta *) p_offset)->seconds);
+	Py_DECREF(p_offset);
+	if (!pydatetimeToTimestamp(object, &tz, &result))
 	{
-		pydateToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	pyunknownToCstring(pyobject, buffer, cinfo);
+	*value = TimestampTzGetDatum(result);
+	return true;
 }
 
-void
-pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
+static bool
+pyobjectToUuidDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
 {
-	PyObject   *pTempStr = PyObject_Str(pyobject);
+	PyObject   *p_bytes;
 	char	   *tempbuffer;
-	Py_ssize_t	strlength;
+	Py_ssize_t	strlength = 0;
+	pg_uuid_t  *uuid;
 
-	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	if (!PyObject_TypeCheck(object, (PyTypeObject *) uuidClass))
+	{
+		return false;
+	}
+	p_bytes = PyObject_GetAttrString(object, "bytes");
 	errorCheck();
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
-	Py_DECREF(pTempStr);
-	return;
-}
-
-void
-pythonDictToTuple(PyObject *p_value,
-				  TupleTableSlot *slot,
-				  ConversionInfo ** cinfos,
-				  StringInfo buffer)
-{
-	int			i;
-	PyObject   *p_object;
-	Datum	   *values = slot->tts_values;
-	bool	   *nulls = slot->tts_isnull;
-
-	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	PyBytes_AsStringAndSize(p_bytes, &tempbuffer, &strlength);
+	if (strlength != UUID_LEN)
 	{
-		char	   *key;
-		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
-		AttrNumber	cinfo_idx = attr->attnum - 1;
-
-		if (cinfos[cinfo_idx] == NULL)
-		{
-			continue;
-		}
-		key = cinfos[cinfo_idx]->attrname;
-		p_object = PyMapping_GetItemString(p_value, key);
-		if (p_object != NULL && p_object != Py_None)
-		{
-			resetStringInfo(buffer);
-			values[i] = pyobjectToDatum(p_object,
-										buffer,
-										cinfos[cinfo_idx]);
-			if (buffer->data == NULL)
-			{
-				nulls[i] = true;
-			}
-			else
-			{
-				nulls[i] = false;
-			}
-		}
-		else
-		{
-			/* "KeyError", doesnt matter. */
-			PyErr_Clear();
-			values[i] = (Datum) NULL;
-			nulls[i] = true;
-		}
-		Py_XDECREF(p_object);
+		Py_DECREF(p_bytes);
+		return false;
 	}
+	uuid = (pg_uuid_t *) palloc(sizeof(pg_uuid_t));
+	memcpy(uuid->data, tempbuffer, UUID_LEN);
+	Py_DECREF(p_bytes);
+	*value = UUIDPGetDatum(uuid);
+	return true;
 }
 
-void
-pythonSequenceToTuple(PyObject *p_value,
-					  TupleTableSlot *slot,
-					  ConversionInfo ** cinfos,
-					  StringInfo buffer)
+static bool
+pyobjectToJsonDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
 {
-	int			i,
-				j;
-	Datum	   *values = slot->tts_values;
-	bool	   *nulls = slot->tts_isnull;
+	PyObject   *p_json,
+			   *pTempStr;
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
 
-	for (i = 0, j = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	/* Strings are assumed to already be serialized. */
+	if (!PyDict_Check(object) && !PyList_Check(object) &&
+		!PyTuple_Check(object))
 	{
-		PyObject   *p_object;
-		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
-		AttrNumber	cinfo_idx = attr->attnum - 1;
-
-		if (cinfos[cinfo_idx] == NULL)
-		{
-			continue;
-		}
-		p_object = PySequence_GetItem(p_value, j);
-		if(p_object == NULL || p_object == Py_None){
-			nulls[i] = true;
-			values[i] = 0;
-		}
-		else
-		{
-			resetStringInfo(buffer);
-			values[i] = pyobjectToDatum(p_object, buffer,
-										cinfos[cinfo_idx]);
-			if (buffer->data == NULL)
-			{
-				nulls[i] = true;
-			}
-			else
-			{
-				nulls[i] = false;
-			}
-		}
-		errorCheck();
-		Py_DECREF(p_object);
-		j++;
+		return false;
 	}
+	p_json = PyObject_CallFunctionObjArgs(jsonDumps, object, NULL);
+	errorCheck();
+	pTempStr = PyUnicode_AsEncodedString(p_json, getPythonEncodingName(), NULL);
+	Py_DECREF(p_json);
+	errorCheck();
+	PyBytes_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	*value = InputFunctionCall(cinfo->attinfunc,
+							   tempbuffer,
+							   cinfo->attioparam,
+							   cinfo->atttypmod);
+	Py_DECREF(pTempStr);
+	return true;
 }
 
 /*
- * Convert a python result (a sequence or a dictionary) to a tupletableslot.
+ * Returns the direct converter for a column, or NULL if values of this type
+ * must always go through the type input function.
  */
-void
-pythonResultToTuple(PyObject *p_value,
-					TupleTableSlot *slot,
-					ConversionInfo ** cinfos,
-					StringInfo buffer)
+PyobjectToDatumFunc
+getPyobjectToDatumFunc(ConversionInfo * cinfo)
 {
-	if (PySequence_Check(p_value))
+	switch (cinfo->atttypoid)
 	{
-		pythonSequenceToTuple(p_value, slot, cinfos, buffer);
-	}
-	else
-	{
-
-		if (PyMapping_Check(p_value))
-		{
-			pythonDictToTuple(p_value, slot, cinfos, buffer);
-		}
-		else
-		{
-			elog(ERROR, "Cannot transform anything else than mappings and"
-				 "sequences to rows");
-		}
+		case INT2OID:
+			return pyobjectToInt2Datum;
+		case INT4OID:
+			return pyobjectToInt4Datum;
+		case INT8OID:
+			return pyobjectToInt8Datum;
+		case FLOAT4OID:
+			return pyobjectToFloat4Datum;
+		case FLOAT8OID:
+			return pyobjectToFloat8Datum;
+		case BOOLOID:
+			return pyobjectToBoolDatum;
+		case NUMERICOID:
+			return pyobjectToNumericDatum;
+		case TEXTOID:
+		case VARCHAROID:
+			return pyobjectToTextDatum;
+		case BYTEAOID:
+			return pyobjectToByteaDatum;
+		case DATEOID:
+		case TIMESTAMPOID:
+		case TIMESTAMPTZOID:
+			importDateTime();
+			if (cinfo->atttypoid == DATEOID)
+				return pyobjectToDateDatum;
+			if (cinfo->atttypoid == TIMESTAMPOID)
+				return pyobjectToTimestampDatum;
+			return pyobjectToTimestampTzDatum;
+		case UUIDOID:
+			if (uuidClass == NULL)
+			{
+				uuidClass = importAttribute("uuid", "UUID");
+			}
+			return pyobjectToUuidDatum;
+		case JSONOID:
+#if PG_VERSION_NUM >= 90400
+		case JSONBOID:
+#endif
+			if (jsonDumps == NULL)
+			{
+				jsonDumps = importAttribute("json", "dumps");
+			}
+			return pyobjectToJsonDatum;
+		default:
+			return NULL;
 	}
 }
 
@@ -1334,6 +3583,11 @@ pyobjectToDatum(PyObject *object, StringInfo buffer,
 {
 	Datum		value = 0;
 
+	if (cinfo->pyconverter != NULL &&
+		cinfo->pyconverter(object, cinfo, &value))
+	{
+		return value;
+	}
 	pyobjectToCString(object, buffer,
 					  cinfo);
 
@@ -1348,6 +3602,10 @@ pyobjectToDatum(PyObject *object, StringInfo buffer,
 			 */
 			value = PointerGetDatum(cstring_to_text_with_len(buffer->data,
 															 buffer->len));
+			if (cinfo->atttypoid != BYTEAOID)
+			{
+				verifyTextDatum(value, true);
+			}
 		}
 		else
 		{
@@ -1373,38 +3631,60 @@ datumStringToPython(Datum datum, ConversionInfo * cinfo)
 	return result;
 }
 
+/*
+ * Get the output function for a type, reusing the ones cached in the
+ * ConversionInfo when the type is the column type or its element type.
+ */
+static FmgrInfo *
+getOutputFunction(Oid type, ConversionInfo * cinfo, FmgrInfo *fmout)
+{
+	Oid			outfuncoid;
+	bool		isvarlena;
+
+	if (cinfo != NULL)
+	{
+		if (type == cinfo->atttypoid && cinfo->attoutfunc != NULL)
+		{
+			return cinfo->attoutfunc;
+		}
+		if (type == cinfo->attelemtype && cinfo->attelemoutfunc != NULL)
+		{
+			return cinfo->attelemoutfunc;
+		}
+	}
+	getTypeOutputInfo(type, &outfuncoid, &isvarlena);
+	fmgr_info(outfuncoid, fmout);
+	return fmout;
+}
+
 PyObject *
 datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type)
 {
 	char	   *temp;
 	ssize_t		size;
 	PyObject   *result;
-	Oid			outfuncoid;
-	bool		isvarlena;
-	FmgrInfo   *fmout = palloc0(sizeof(FmgrInfo));
+	FmgrInfo	fmout;
 
-	getTypeOutputInfo(type, &outfuncoid, &isvarlena);
-	fmgr_info(outfuncoid, fmout);
-	temp = OutputFunctionCall(fmout, datum);
+	temp = OutputFunctionCall(getOutputFunction(type, cinfo, &fmout), datum);
 	size = strlen(temp);
 	result = PyUnicode_Decode(temp, size, getPythonEncodingName(), NULL);
-	pfree(fmout);
+	pfree(temp);
 	return result;
 }
 
 PyObject *
 datumNumberToPython(Datum datum, ConversionInfo * cinfo)
 {
-	ssize_t		numvalue = (ssize_t) DatumGetNumeric(datum);
-	char	   *tempvalue = (char *) DirectFunctionCall1(numeric_out,
-														 numvalue);
-	PyObject   *buffer = PyString_FromString(tempvalue),
-#if PY_MAJOR_VERSION >= 3
-			   *value = PyFloat_FromString(buffer);
-#else
-			   *value = PyFloat_FromString(buffer, NULL);
-#endif
-	Py_DECREF(buffer);
+	char	   *tempvalue = DatumGetCString(DirectFunctionCall1(numeric_out,
+																datum));
+	PyObject   *value;
+
+	if (decimalClass == NULL)
+	{
+		decimalClass = importAttribute("decimal", "Decimal");
+	}
+	value = PyObject_CallFunction(decimalClass, "(s)", tempvalue);
+	pfree(tempvalue);
 	return value;
 }
 
@@ -1415,7 +3695,7 @@ datumDateToPython(Datum datum, ConversionInfo * cinfo)
 	PyObject   *result;
 	fsec_t		fsec;
 
-	PyDateTime_IMPORT;
+	importDateTime();
 	datum = DirectFunctionCall1(date_timestamp, datum);
 	timestamp2tm(DatumGetTimestamp(datum), NULL, pg_tm_value, &fsec,
 				 NULL, NULL);
@@ -1425,23 +3705,66 @@ datumDateToPython(Datum datum, ConversionInfo * cinfo)
 	return result;
 }
 
+/*
+ * Convert a timestamp to a python datetime, with the given tzinfo.
+ * Returns NULL if the timestamp cannot be represented as a datetime, such as
+ * infinite timestamps or years before 1 and after 9999.
+ */
+static PyObject *
+timestampToPyDatetime(Timestamp timestamp, PyObject *tzinfo)
+{
+	struct pg_tm pg_tm_value;
+	fsec_t		fsec;
+
+	if (TIMESTAMP_NOT_FINITE(timestamp) ||
+		timestamp2tm(timestamp, NULL, &pg_tm_value, &fsec, NULL, NULL) != 0 ||
+		pg_tm_value.tm_year < 1 || pg_tm_value.tm_year > 9999)
+	{
+		return NULL;
+	}
+	importDateTime();
+	return PyDateTimeAPI->DateTime_FromDateAndTime(pg_tm_value.tm_year,
+												   pg_tm_value.tm_mon,
+												   pg_tm_value.tm_mday,
+												   pg_tm_value.tm_hour,
+												   pg_tm_value.tm_min,
+												   pg_tm_value.tm_sec,
+												   fsec,
+												   tzinfo,
+												   PyDateTimeAPI->DateTimeType);
+}
+
 PyObject *
 datumTimestampToPython(Datum datum, ConversionInfo * cinfo)
 {
-	struct pg_tm *pg_tm_value = palloc(sizeof(struct pg_tm));
+	PyObject   *result = timestampToPyDatetime(DatumGetTimestamp(datum),
+											   Py_None);
+
+	if (result == NULL)
+	{
+		return datumUnknownToPython(datum, cinfo, TIMESTAMPOID);
+	}
+	return result;
+}
+
+/*
+ * Timestamps with time zone are converted to aware datetimes, in UTC, on
+ * every python version: see multicorn.compat.utc.
+ */
+PyObject *
+datumTimestampTzToPython(Datum datum, ConversionInfo * cinfo)
+{
 	PyObject   *result;
-	fsec_t		fsec;
 
-	PyDateTime_IMPORT;
-	timestamp2tm(DatumGetTimestamp(datum), NULL, pg_tm_value, &fsec,
-				 NULL, NULL);
-	result = PyDateTime_FromDateAndTime(pg_tm_value->tm_year,
-										pg_tm_value->tm_mon,
-										pg_tm_value->tm_mday,
-										pg_tm_value->tm_hour,
-										pg_tm_value->tm_min,
-										pg_tm_value->tm_sec, 0);
-	pfree(pg_tm_value);
+	if (utcTimezone == NULL)
+	{
+		utcTimezone = importAttribute("multicorn.compat", "utc");
+	}
+	result = timestampToPyDatetime(DatumGetTimestampTz(datum), utcTimezone);
+	if (result == NULL)
+	{
+		return datumUnknownToPython(datum, cinfo, TIMESTAMPTZOID);
+	}
 	return result;
 }
 
@@ -1451,6 +3774,42 @@ datumIntToPython(Datum datum, ConversionInfo * cinfo)
 	return PyLong_FromLong(DatumGetInt32(datum));
 }
 
+PyObject *
+datumUuidToPython(Datum datum, ConversionInfo * cinfo)
+{
+	pg_uuid_t  *uuid = DatumGetUUIDP(datum);
+	PyObject   *p_bytes,
+			   *result;
+
+	if (uuidClass == NULL)
+	{
+		uuidClass = importAttribute("uuid", "UUID");
+	}
+	p_bytes = PyBytes_FromStringAndSize((char *) uuid->data, UUID_LEN);
+	result = PyObject_CallFunction(uuidClass, "(OO)", Py_None, p_bytes);
+	Py_DECREF(p_bytes);
+	return result;
+}
+
+PyObject *
+datumJsonToPython(Datum datum, ConversionInfo * cinfo, Oid type)
+{
+	PyObject   *p_text = datumUnknownToPython(datum, cinfo, type),
+			   *result;
+
+	if (p_text == NULL)
+	{
+		return NULL;
+	}
+	if (jsonLoads == NULL)
+	{
+		jsonLoads = importAttribute("json", "loads");
+	}
+	result = PyObject_CallFunctionObjArgs(jsonLoads, p_text, NULL);
+	Py_DECREF(p_text);
+	return result;
+}
+
 PyObject *
 datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 {
@@ -1466,7 +3825,23 @@ datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 	bool		isnull;
 	PyObject   *result = PyList_New(0),
 			   *pyitem;
+	Oid			elemtype;
 
+	/* Lookup the element type once, not for every element. */
+	if (cinfo != NULL && type == cinfo->atttypoid &&
+		cinfo->attelemtype != InvalidOid)
+	{
+		elemtype = cinfo->attelemtype;
+	}
+	else
+	{
+		elemtype = get_element_type(type);
+		if (elemtype == InvalidOid)
+		{
+			elog(ERROR, "lookup failed for type %u",
+				 type);
+		}
+	}
 	while (array_iterate(iterator, &elem, &isnull))
 	{
 		if (isnull)
@@ -1474,24 +3849,13 @@ datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 			PyList_Append(result, Py_None);
 		}
 		else
-		{
-			HeapTuple	tuple;
-			Form_pg_type typeStruct;
-
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
-			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
-			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			pyitem = datumToPython(elem, typeStruct->typelem, cinfo);
-			ReleaseSysCache(tuple);
-
+		{
+			pyitem = datumToPython(elem, elemtype, cinfo);
 			PyList_Append(result, pyitem);
 			Py_DECREF(pyitem);
 		}
 	}
+	array_free_iterator(iterator);
 	return result;
 }
 
@@ -1514,15 +3878,13 @@ datumByteaToPython(Datum datum, ConversionInfo * cinfo)
 PyObject *
 datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 {
-	HeapTuple	tuple;
-	Form_pg_type typeStruct;
-
 	switch (type)
 	{
 		case BYTEAOID:
 			return datumByteaToPython(datum, cinfo);
 		case TEXTOID:
 		case VARCHAROID:
+		case BPCHAROID:
 			return datumStringToPython(datum, cinfo);
 		case NUMERICOID:
 			return datumNumberToPython(datum, cinfo);
@@ -1530,19 +3892,32 @@ datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 			return datumDateToPython(datum, cinfo);
 		case TIMESTAMPOID:
 			return datumTimestampToPython(datum, cinfo);
+		case TIMESTAMPTZOID:
+			return datumTimestampTzToPython(datum, cinfo);
+		case INT2OID:
+			return PyLong_FromLong(DatumGetInt16(datum));
 		case INT4OID:
 			return datumIntToPython(datum, cinfo);
+		case INT8OID:
+			return PyLong_FromLongLong(DatumGetInt64(datum));
+		case FLOAT4OID:
+			return PyFloat_FromDouble(DatumGetFloat4(datum));
+		case FLOAT8OID:
+			return PyFloat_FromDouble(DatumGetFloat8(datum));
+		case BOOLOID:
+			return PyBool_FromLong(DatumGetBool(datum));
+		case UUIDOID:
+			return datumUuidToPython(datum, cinfo);
+		case JSONOID:
+#if PG_VERSION_NUM >= 90400
+		case JSONBOID:
+#endif
+			return datumJsonToPython(datum, cinfo, type);
 		default:
 			/* Case for the array ? */
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
-			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
-			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			ReleaseSysCache(tuple);
-			if ((typeStruct->typelem != 0) && (typeStruct->typlen == -1))
+			if ((cinfo != NULL && type == cinfo->atttypoid) ?
+				cinfo->attelemtype != InvalidOid :
+				get_element_type(type) != InvalidOid)
 			{
 				/* Its an array. */
 				return datumArrayToPython(datum, type, cinfo);
@@ -1564,9 +3939,15 @@ pathKeys(MulticornPlanState * state)
 	Py_ssize_t	i;
 	PyObject   *fdw_instance = state->fdw_instance,
 			   *p_pathkeys;
+	StringInfo	key = planCacheKey(fdw_instance, "get_path_keys");
 
-	p_pathkeys = PyObject_CallMethod(fdw_instance, "get_path_keys", "()");
-	errorCheck();
+	p_pathkeys = getPlanCache(fdw_instance, key);
+	if (p_pathkeys == NULL)
+	{
+		p_pathkeys = PyObject_CallMethod(fdw_instance, "get_path_keys", "()");
+		errorCheck();
+		setPlanCache(fdw_instance, key, p_pathkeys);
+	}
 	for (i = 0; i < PySequence_Length(p_pathkeys); i++)
 	{
 		PyObject   *p_item = PySequence_GetItem(p_pathkeys, i),
@@ -1633,17 +4014,36 @@ canSort(MulticornPlanState * state, List *deparsed)
 	PyObject   *fdw_instance = state->fdw_instance,
 			   *p_pathkeys = PyList_New(0),
 			   *p_sortable;
+	StringInfo	key = planCacheKey(fdw_instance, "can_sort");
 
 	foreach(lc, deparsed)
 	{
 		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
-		PyObject *python_sortkey = getSortKey(pathkey);
-		PyList_Append(p_pathkeys, python_sortkey);
-		Py_DECREF(python_sortkey);
+
+		if (key != NULL)
+		{
+			appendStringInfo(key, " %s %d %d %s", NameStr(*(pathkey->attname)),
+							 pathkey->reversed, pathkey->nulls_first,
+							 pathkey->collate != NULL ?
+							 NameStr(*(pathkey->collate)) : "-");
+		}
 	}
 
-	p_sortable = PyObject_CallMethod(fdw_instance, "can_sort", "(O)", p_pathkeys);
-	errorCheck();
+	p_sortable = getPlanCache(fdw_instance, key);
+	if (p_sortable == NULL)
+	{
+		foreach(lc, deparsed)
+		{
+			MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+			PyObject *python_sortkey = getSortKey(pathkey);
+			PyList_Append(p_pathkeys, python_sortkey);
+			Py_DECREF(python_sortkey);
+		}
+		p_sortable = PyObject_CallMethod(fdw_instance, "can_sort", "(O)",
+										 p_pathkeys);
+		errorCheck();
+		setPlanCache(fdw_instance, key, p_sortable);
+	}
 	for (i = 0; i < PySequence_Length(p_sortable); i++)
 	{
 		PyObject   *p_key = PySequence_GetItem(p_sortable, i);
@@ -1656,6 +4056,258 @@ canSort(MulticornPlanState * state, List *deparsed)
 	return result;
 }
 
+/*
+ * Returns a python list of strings, or of None for the NULL items.
+ */
+static PyObject *
+stringsToPyList(List *strings)
+{
+	PyObject   *p_list = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, strings)
+	{
+		PyObject   *p_item;
+
+		if (lfirst(lc) == NULL)
+		{
+			PyList_Append(p_list, Py_None);
+			continue;
+		}
+		p_item = PyString_FromString(strVal(lfirst(lc)));
+		errorCheck();
+		PyList_Append(p_list, p_item);
+		Py_DECREF(p_item);
+	}
+	return p_list;
+}
+
+/*
+ * Returns a python list of tuples of strings, from a list of lists of
+ * strings: the aggregates computed by the python fdw, as (function name,
+ * column name or None) tuples, or the clauses of a join, as (outer column,
+ * operator, inner column) tuples.
+ */
+static PyObject *
+tuplesToPyList(List *tuples)
+{
+	PyObject   *p_tuples = PyList_New(0);
+	ListCell   *lc;
+
+	foreach(lc, tuples)
+	{
+		PyObject   *p_items = stringsToPyList((List *) lfirst(lc)),
+				   *p_tuple = PyList_AsTuple(p_items);
+
+		errorCheck();
+		PyList_Append(p_tuples, p_tuple);
+		Py_DECREF(p_tuple);
+		Py_DECREF(p_items);
+	}
+	return p_tuples;
+}
+
+/*
+ * Returns a multicorn.JoinedTable describing one of the tables of a join
+ * computed by the python fdw.
+ */
+static PyObject *
+joinedTableToPython(Oid foreigntableid, PyObject *p_quals, List *targets)
+{
+	PyObject   *p_class = getClassString("multicorn.JoinedTable"),
+			   *p_instance = getInstance(foreigntableid),
+			   *p_options = optionsListToPyDict(getOptions(foreigntableid)),
+			   *p_columns = NULL,
+			   *p_targets = stringsToPyList(targets),
+			   *p_table;
+	List	   *columns = NIL;
+	Relation	rel = RelationIdGetRelation(foreigntableid);
+
+	getColumnsFromTable(RelationGetDescr(rel), &p_columns, &columns);
+	RelationClose(rel);
+	PyDict_DelItemString(p_options, "wrapper");
+	p_table = PyObject_CallFunction(p_class, "(O,O,O,O,O)", p_instance,
+									p_options, p_columns, p_quals, p_targets);
+	Py_DECREF(p_class);
+	Py_DECREF(p_instance);
+	Py_DECREF(p_options);
+	Py_DECREF(p_columns);
+	Py_DECREF(p_targets);
+	errorCheck();
+	return p_table;
+}
+
+/*
+ * Ask the python fdw whether it can join the tables described by the plan
+ * states, as planned in the join state.
+ *
+ * Both tables must use the same python class, whose can_join method is
+ * called.
+ */
+bool
+canJoin(MulticornPlanState * state, MulticornPlanState * outerstate,
+		MulticornPlanState * innerstate)
+{
+	PyObject   *p_quals,
+			   *p_outer,
+			   *p_inner,
+			   *p_join_quals,
+			   *p_result;
+	bool		result;
+
+	if (Py_TYPE(outerstate->fdw_instance) != Py_TYPE(innerstate->fdw_instance))
+	{
+		return false;
+	}
+	p_quals = planQualsToPyList(outerstate->qual_list, outerstate->cinfos);
+	p_outer = joinedTableToPython(outerstate->foreigntableid, p_quals,
+								  state->target_list);
+	Py_DECREF(p_quals);
+	p_quals = planQualsToPyList(innerstate->qual_list, innerstate->cinfos);
+	p_inner = joinedTableToPython(innerstate->foreigntableid, p_quals,
+								  state->inner_targets);
+	Py_DECREF(p_quals);
+	p_join_quals = tuplesToPyList(state->join_quals);
+	p_result = PyObject_CallMethod(outerstate->fdw_instance, "can_join",
+								   "(O,O,s,O)", p_outer, p_inner,
+								   state->join_type, p_join_quals);
+	Py_DECREF(p_outer);
+	Py_DECREF(p_inner);
+	Py_DECREF(p_join_quals);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
+/*
+ * Ask the python fdw whether it can apply a LIMIT and an OFFSET to a scan
+ * with the quals of the plan state, sorted by the given deparsed pathkeys.
+ */
+bool
+canLimit(MulticornPlanState * state, List *deparsed)
+{
+	PyObject   *p_quals = planQualsToPyList(state->qual_list, state->cinfos),
+			   *p_sortkeys = PyList_New(0),
+			   *p_result;
+	ListCell   *lc;
+	bool		result;
+
+	foreach(lc, deparsed)
+	{
+		PyObject   *p_sortkey = getSortKey((MulticornDeparsedSortGroup *) lfirst(lc));
+
+		PyList_Append(p_sortkeys, p_sortkey);
+		Py_DECREF(p_sortkey);
+	}
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_limit", "(O,O)",
+								   p_quals, p_sortkeys);
+	Py_DECREF(p_quals);
+	Py_DECREF(p_sortkeys);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
+/*
+ * Ask the python fdw which of the clauses of a scan it enforces, through its
+ * can_enforce_quals method. Only the clauses translating to a single qual are
+ * proposed. The value of the quals comparing a column to a value only known
+ * at execution time is multicorn.UNBOUND.
+ *
+ * Returns the enforced clauses.
+ */
+List *
+canEnforceQuals(MulticornPlanState * state, Relids base_relids, List *clauses)
+{
+	List	   *candidates = NIL,
+			   *result = NIL;
+	PyObject   *p_quals,
+			   *p_unbound,
+			   *p_enforced;
+	ListCell   *lc;
+	Py_ssize_t	i;
+
+	p_quals = PyList_New(0);
+	p_unbound = getClassString("multicorn.UNBOUND");
+	foreach(lc, clauses)
+	{
+		Expr	   *clause = (Expr *) lfirst(lc);
+		List	   *quals = NIL;
+		MulticornBaseQual *qual;
+		PyObject   *p_qual;
+
+		/* Do not let extractRestrictions log the other clauses. */
+		if (!IsA(clause, OpExpr) && !IsA(clause, ScalarArrayOpExpr) &&
+			!IsA(clause, NullTest))
+		{
+			continue;
+		}
+		extractRestrictions(base_relids, clause, &quals);
+		if (list_length(quals) != 1)
+		{
+			continue;
+		}
+		qual = linitial(quals);
+		p_qual = planQualToPython(qual, state->cinfos, p_unbound);
+		if (p_qual != NULL)
+		{
+			PyList_Append(p_quals, p_qual);
+			Py_DECREF(p_qual);
+			candidates = lappend(candidates, clause);
+		}
+	}
+	Py_DECREF(p_unbound);
+	if (candidates == NIL)
+	{
+		Py_DECREF(p_quals);
+		return NIL;
+	}
+	p_enforced = PyObject_CallMethod(state->fdw_instance, "can_enforce_quals",
+									 "(O)", p_quals);
+	errorCheck();
+	for (i = 0; i < PyList_Size(p_quals); i++)
+	{
+		int			enforced = PySequence_Contains(p_enforced,
+												   PyList_GetItem(p_quals, i));
+
+		errorCheck();
+		if (enforced == 1)
+		{
+			result = lappend(result, list_nth(candidates, i));
+		}
+	}
+	Py_DECREF(p_quals);
+	Py_DECREF(p_enforced);
+	return result;
+}
+
+/*
+ * Ask the python fdw whether it can compute the given aggregates, grouped by
+ * the given columns, over the rows matching the quals of the plan state.
+ */
+bool
+canAggregate(MulticornPlanState * state, List *group_by, List *aggregates)
+{
+	PyObject   *p_group_by = stringsToPyList(group_by),
+			   *p_aggregates = tuplesToPyList(aggregates),
+			   *p_quals = planQualsToPyList(state->qual_list, state->cinfos),
+			   *p_result;
+	bool		result;
+
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_aggregate",
+								   "(O,O,O)", p_group_by, p_aggregates,
+								   p_quals);
+	Py_DECREF(p_group_by);
+	Py_DECREF(p_aggregates);
+	Py_DECREF(p_quals);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
 PyObject *
 tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos)
 {
@@ -1687,7 +4339,14 @@ tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos)
 								 cinfos[cinfo_idx]);
 			errorCheck();
 		}
-		PyDict_SetItemString(result, cinfos[cinfo_idx]->attrname, item);
+		if (cinfos[cinfo_idx]->attrkey != NULL)
+		{
+			PyDict_SetItem(result, cinfos[cinfo_idx]->attrkey, item);
+		}
+		else
+		{
+			PyDict_SetItemString(result, cinfos[cinfo_idx]->attrname, item);
+		}
 		Py_DECREF(item);
 	}
 	return result;
@@ -1712,3 +4371,255 @@ getRowIdColumn(PyObject *fdw_instance)
 	Py_DECREF(value);
 	return result;
 }
+
+/*
+ * Get a boolean class attribute (a "flag") from the fdw instance.
+ * A missing attribute is treated as false, since wrappers are not required to
+ * inherit from ForeignDataWrapper.
+ */
+bool
+getBooleanAttribute(PyObject *fdw_instance, const char *name)
+{
+	PyObject   *value = PyObject_GetAttrString(fdw_instance, name);
+	bool		result;
+
+	if (value == NULL)
+	{
+		PyErr_Clear();
+		return false;
+	}
+	result = PyObject_IsTrue(value);
+	Py_DECREF(value);
+	errorCheck();
+	return result;
+}
+
+/*
+ * Returns the value of an integer attribute of the python fdw instance,
+ * or 0 if it is not defined.
+ */
+int
+getIntegerAttribute(PyObject *fdw_instance, const char *name)
+{
+	PyObject   *value = PyObject_GetAttrString(fdw_instance, name);
+	long		result;
+
+	if (value == NULL)
+	{
+		PyErr_Clear();
+		return 0;
+	}
+	result = PyLong_AsLong(value);
+	Py_DECREF(value);
+	errorCheck();
+	return (int) result;
+}
+
+/*
+ * Release the GIL, letting python threads run until the next call to
+ * acquireGil. This is only done while waiting for the rows of a background
+ * iterator: the interpreter is shared with PL/Python, whose functions may be
+ * called by the same query, and expect the GIL to be held.
+ */
+void
+releaseGil(void)
+{
+	if (savedThreadState == NULL)
+	{
+#if PY_VERSION_HEX < 0x03070000
+		PyEval_InitThreads();
+#endif
+		savedThreadState = PyEval_SaveThread();
+	}
+}
+
+/*
+ * Take the GIL back, if it was released. This must be called before calling
+ * into python from any entry point.
+ */
+void
+acquireGil(void)
+{
+	if (interpreterPid != MyProcPid)
+	{
+		/* The interpreter was inherited from the postmaster. */
+#if PY_VERSION_HEX >= 0x03070000
+		PyOS_AfterFork_Child();
+#else
+		PyOS_AfterFork();
+#endif
+		interpreterPid = MyProcPid;
+	}
+	if (savedThreadState != NULL)
+	{
+		PyEval_RestoreThread(savedThreadState);
+		savedThreadState = NULL;
+	}
+}
+
+/*
+ * Replace the scan iterator by a multicorn.background.BackgroundIterator,
+ * running it in a python thread. At most maxsize rows are read in advance,
+ * or every row if maxsize is 0.
+ */
+void
+startBackgroundIterator(MulticornExecState * state, int maxsize)
+{
+	PyObject   *p_class = getClassString("multicorn.background."
+										 "BackgroundIterator"),
+			   *p_background;
+
+	errorCheck();
+	p_background = PyObject_CallFunction(p_class, "(O,i)", state->p_iterator,
+										 maxsize);
+	Py_DECREF(p_class);
+	errorCheck();
+	Py_DECREF(state->p_iterator);
+	state->p_iterator = p_background;
+	state->background = true;
+}
+
+/*
+ * Returns true if the next row can be read from the background iterator
+ * without waiting.
+ */
+bool
+backgroundRowReady(MulticornExecState * state)
+{
+	PyObject   *p_ready = PyObject_CallMethod(state->p_iterator, "ready", "()");
+	bool		result;
+
+	errorCheck();
+	result = PyObject_IsTrue(p_ready);
+	Py_DECREF(p_ready);
+	return result;
+}
+
+/*
+ * Returns the file descriptor which becomes readable when the background
+ * iterator has new rows.
+ */
+int
+backgroundFileno(MulticornExecState * state)
+{
+	PyObject   *p_fileno = PyObject_CallMethod(state->p_iterator, "fileno", "()");
+	int			result;
+
+	errorCheck();
+	result = (int) PyLong_AsLong(p_fileno);
+	Py_DECREF(p_fileno);
+	errorCheck();
+	return result;
+}
+
+/*
+ * Stop the thread of the background iterator, if any.
+ */
+void
+stopBackgroundIterator(MulticornExecState * state)
+{
+	if (state->background && state->p_iterator != NULL)
+	{
+		PyObject   *p_result = PyObject_CallMethod(state->p_iterator, "close",
+												   "()");
+
+		errorCheck();
+		Py_DECREF(p_result);
+	}
+	state->background = false;
+}
+
+/*
+ * Close the python iterator of a scan, and release it.
+ *
+ * Generators are closed explicitly, so that the resources they hold (a
+ * cursor, a connection...) are released as soon as the scan is over, even if
+ * they are still referenced from elsewhere.
+ */
+void
+closeIterator(MulticornExecState * state)
+{
+	stopBackgroundIterator(state);
+	if (state->p_iterator != NULL && PyGen_Check(state->p_iterator))
+	{
+		PyObject   *p_result = PyObject_CallMethod(state->p_iterator, "close",
+												   "()");
+
+		errorCheck();
+		Py_DECREF(p_result);
+	}
+	Py_CLEAR(state->p_iterator);
+}
+
+/*
+ * Stop the threads of every background iterator. The scans interrupted by an
+ * error are never ended, so this is done when a transaction is aborted,
+ * before the wrappers roll back. An error is only a warning here, since it
+ * must not keep them from doing so.
+ */
+void
+stopBackgroundIterators(void)
+{
+	PyObject   *p_module = PyDict_GetItemString(PyImport_GetModuleDict(),
+												"multicorn.background"),
+			   *p_result;
+
+	/* No background iterator was ever started. */
+	if (p_module == NULL)
+	{
+		return;
+	}
+	p_result = PyObject_CallMethod(p_module, "close_all", "()");
+	if (p_result == NULL)
+	{
+		PyErr_Clear();
+		elog(WARNING, "multicorn could not stop the background iterators");
+	}
+	Py_XDECREF(p_result);
+}
+
+/*
+ * Import a python module at load time, only warning on failure, since it is
+ * imported again when it is used.
+ */
+static void
+preloadModule(const char *name)
+{
+	PyObject   *p_module = PyImport_ImportModule(name);
+
+	if (p_module == NULL)
+	{
+		PyErr_Clear();
+		elog(WARNING, "multicorn could not preload the \"%s\" module", name);
+	}
+	Py_XDECREF(p_module);
+}
+
+/*
+ * Remember that the interpreter was initialized by the current process, and
+ * import the multicorn module along with the given comma-separated list of
+ * modules.
+ *
+ * When multicorn is loaded through shared_preload_libraries, this is done in
+ * the postmaster: the backends then inherit the imported modules instead of
+ * importing them on their first query.
+ */
+void
+preloadModules(const char *modules)
+{
+	char	   *names;
+	char	   *name;
+
+	interpreterPid = MyProcPid;
+	preloadModule("multicorn");
+	if (modules == NULL)
+	{
+		return;
+	}
+	names = pstrdup(modules);
+	for (name = strtok(names, ", \t"); name != NULL; name = strtok(NULL, ", \t"))
+	{
+		preloadModule(name);
+	}
+	pfree(names);
+}
@@ -109,7 +109,8 @@ extractColumns(List *reltargetlist, List *restrictinfolist)
 void
 initConversioninfo(ConversionInfo ** cinfos, AttInMetadata *attinmeta)
 {
-	int			i;
+	int			i,
+				seqindex = 0;
 
 	for (i = 0; i < attinmeta->tupdesc->natts; i++)
 	{
@@ -133,7 +134,17 @@ initConversioninfo(ConversionInfo ** cinfos, AttInMetadata *attinmeta)
 			cinfo->attrname = NameStr(attr->attname);
 			cinfo->attnum = i + 1;
 			cinfo->attndims = attr->attndims;
+			cinfo->attelemtype = get_element_type(attr->atttypid);
+			if (cinfo->attelemtype != InvalidOid)
+			{
+				cinfo->attelemoutfunc = (FmgrInfo *) palloc0(sizeof(FmgrInfo));
+				getTypeOutputInfo(cinfo->attelemtype, &outfuncoid, &typIsVarlena);
+				fmgr_info(outfuncoid, cinfo->attelemoutfunc);
+			}
 			cinfo->need_quote = false;
+			cinfo->pyconverter = getPyobjectToDatumFunc(cinfo);
+			cinfo->seqindex = seqindex++;
+			cinfo->attrkey = NULL;
 			cinfos[i] = cinfo;
 		}
 		else
@@ -325,12 +336,14 @@ extractRestrictions(Relids base_relids,
 											   quals);
 			break;
 		default:
-			{
-				ereport(WARNING,
-						(errmsg("unsupported expression for "
-								"extractClauseFrom"),
-						 errdetail("%s", nodeToString(node))));
-			}
+			/*
+			 * The clause is still checked by PostgreSQL, and given to the
+			 * fdws asking for structured quals.
+			 */
+			ereport(DEBUG1,
+					(errmsg("unsupported expression for "
+							"extractClauseFrom"),
+					 errdetail("%s", nodeToString(node))));
 			break;
 	}
 }
@@ -365,9 +378,15 @@ extractClauseFromOpExpr(Relids base_relids,
 		if (!(contain_volatile_functions((Node *) right) ||
 			  bms_is_subset(base_relids, pull_varnos((Node *) right))))
 		{
-			*quals = lappend(*quals, makeQual(left->varattno,
-											  getOperatorString(op->opno),
-											  right, false, false));
+			MulticornBaseQual *qual = makeQual(left->varattno,
+											   getOperatorString(op->opno),
+											   right, false, false);
+
+			if (qual->right_type == T_Param)
+			{
+				((MulticornParamQual *) qual)->strict = op_strict(op->opno);
+			}
+			*quals = lappend(*quals, qual);
 		}
 	}
 }
@@ -388,10 +407,16 @@ extractClauseFromScalarArrayOpExpr(Relids base_relids,
 		if (!(contain_volatile_functions((Node *) right) ||
 			  bms_is_subset(base_relids, pull_varnos((Node *) right))))
 		{
-			*quals = lappend(*quals, makeQual(left->varattno,
-											  getOperatorString(op->opno),
-											  right, true,
-											  op->useOr));
+			MulticornBaseQual *qual = makeQual(left->varattno,
+											   getOperatorString(op->opno),
+											   right, true, op->useOr);
+
+			/* A NULL array makes the clause NULL, whatever the operator. */
+			if (qual->right_type == T_Param)
+			{
+				((MulticornParamQual *) qual)->strict = true;
+			}
+			*quals = lappend(*quals, qual);
 		}
 	}
 }
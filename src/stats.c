@@ -0,0 +1,532 @@
+/*-------------------------------------------------------------------------
+ *
+ * The Multicorn Foreign Data Wrapper allows you to fetch foreign data in
+ * Python in your PostgreSQL server.
+ *
+ * This module keeps the cumulative statistics of every foreign table, in
+ * shared memory: the calls to the python hooks and their time, the rows
+ * returned, the instances created and the python errors raised.
+ *
+ * The shared memory is only reserved when multicorn is loaded through
+ * shared_preload_libraries. Otherwise, nothing is tracked.
+ *
+ * This software is released under the postgresql licence
+ *
+ * author: Kozea
+ *
+ *
+ *-------------------------------------------------------------------------
+ */
+#include "multicorn.h"
+#include "miscadmin.h"
+#include "storage/ipc.h"
+#include "storage/lwlock.h"
+#include "storage/shmem.h"
+#include "storage/spin.h"
+#include "utils/guc.h"
+#include "utils/hsearch.h"
+#include "utils/memutils.h"
+#include "utils/tuplestore.h"
+
+
+extern PGDLLEXPORT Datum multicorn_stat_foreign_tables(PG_FUNCTION_ARGS);
+extern PGDLLEXPORT Datum multicorn_stat_reset(PG_FUNCTION_ARGS);
+
+PG_FUNCTION_INFO_V1(multicorn_stat_foreign_tables);
+PG_FUNCTION_INFO_V1(multicorn_stat_reset);
+
+/* The number of columns returned by multicorn_stat_foreign_tables */
+#define MULTICORN_STAT_COLS (2 + 3 * MULTICORN_NUM_HOOKS + 3)
+
+/* Whether the statistics are gathered, from the multicorn.track_stats GUC */
+static bool trackStats = true;
+
+/* The number of tables tracked, from the multicorn.stats_max_tables GUC */
+static int	statsMaxTables = 1000;
+
+#if PG_VERSION_NUM >= 90600
+typedef struct MulticornTableStatsKey
+{
+	Oid			dbid;
+	Oid			relid;
+}	MulticornTableStatsKey;
+
+typedef struct MulticornTableCounters
+{
+	int64		calls[MULTICORN_NUM_HOOKS];
+	double		total_time[MULTICORN_NUM_HOOKS];
+	double		max_time[MULTICORN_NUM_HOOKS];
+	int64		rows;
+	int64		instances;
+	int64		errors;
+}	MulticornTableCounters;
+
+/*
+ * The statistics of a foreign table. Their counters are protected by their
+ * own spinlock, and are only updated while the lock of the hash table is
+ * held, since an entry may be removed by a reset, or evicted to make room for
+ * another table.
+ */
+typedef struct MulticornTableStats
+{
+	MulticornTableStatsKey key;
+	slock_t		mutex;
+	MulticornTableCounters counters;
+}	MulticornTableStats;
+
+typedef struct MulticornStatsShared
+{
+	/* Protects the hash table, not the counters */
+	LWLock	   *lock;
+}	MulticornStatsShared;
+
+static MulticornStatsShared *statsShared = NULL;
+static HTAB *statsHash = NULL;
+
+/* The table whose python errors are being counted */
+static Oid	currentRelid = InvalidOid;
+
+#if PG_VERSION_NUM >= 150000
+static shmem_request_hook_type prev_shmem_request_hook = NULL;
+#endif
+static shmem_startup_hook_type prev_shmem_startup_hook = NULL;
+
+static void statsShmemRequest(void);
+static void statsShmemStartup(void);
+#endif
+
+
+/*
+ * Define the GUCs of the statistics, and reserve their shared memory if
+ * multicorn is being preloaded.
+ */
+void
+initTableStats(void)
+{
+	DefineCustomBoolVariable("multicorn.track_stats",
+							 "Gather the statistics of the foreign tables.",
+							 "They are only gathered when multicorn is in "
+							 "shared_preload_libraries.",
+							 &trackStats,
+							 true,
+							 PGC_SUSET,
+							 0,
+							 NULL,
+							 NULL,
+							 NULL);
+	DefineCustomIntVariable("multicorn.stats_max_tables",
+							"The number of foreign tables whose statistics "
+							"are gathered.",
+							"Once it is reached, the statistics of the least "
+							"called table are dropped for a new one.",
+							&statsMaxTables,
+							1000,
+							100,
+							INT_MAX / 2,
+							PGC_POSTMASTER,
+							0,
+							NULL,
+							NULL,
+							NULL);
+#if PG_VERSION_NUM >= 90600
+	if (!process_shared_preload_libraries_in_progress)
+	{
+		return;
+	}
+#if PG_VERSION_NUM >= 150000
+	prev_shmem_request_hook = shmem_request_hook;
+	shmem_request_hook = statsShmemRequest;
+#else
+	statsShmemRequest();
+#endif
+	prev_shmem_startup_hook = shmem_startup_hook;
+	shmem_startup_hook = statsShmemStartup;
+#endif
+}
+
+#if PG_VERSION_NUM >= 90600
+static void
+statsShmemRequest(void)
+{
+#if PG_VERSION_NUM >= 150000
+	if (prev_shmem_request_hook)
+	{
+		prev_shmem_request_hook();
+	}
+#endif
+	RequestAddinShmemSpace(add_size(MAXALIGN(sizeof(MulticornStatsShared)),
+									hash_estimate_size(statsMaxTables,
+										sizeof(MulticornTableStats))));
+	RequestNamedLWLockTranche("multicorn", 1);
+}
+
+static void
+statsShmemStartup(void)
+{
+	HASHCTL		info;
+	bool		found;
+
+	if (prev_shmem_startup_hook)
+	{
+		prev_shmem_startup_hook();
+	}
+	LWLockAcquire(AddinShmemInitLock, LW_EXCLUSIVE);
+	statsShared = ShmemInitStruct("multicorn stats",
+								  sizeof(MulticornStatsShared), &found);
+	if (!found)
+	{
+		statsShared->lock = &(GetNamedLWLockTranche("multicorn"))->lock;
+	}
+	MemSet(&info, 0, sizeof(info));
+	info.keysize = sizeof(MulticornTableStatsKey);
+	info.entrysize = sizeof(MulticornTableStats);
+	statsHash = ShmemInitHash("multicorn table stats",
+							  statsMaxTables, statsMaxTables,
+							  &info, HASH_ELEM | HASH_BLOBS);
+	LWLockRelease(AddinShmemInitLock);
+}
+
+/*
+ * Remove the statistics of the least called foreign table, to make room for
+ * another one. The lock of the hash table must be held exclusively, so that
+ * no counter is being updated.
+ */
+static void
+evictTableStats(void)
+{
+	HASH_SEQ_STATUS status;
+	MulticornTableStats *stats,
+			   *victim = NULL;
+	int64		victim_calls = 0;
+
+	hash_seq_init(&status, statsHash);
+	while ((stats = hash_seq_search(&status)) != NULL)
+	{
+		int64		calls = 0;
+		int			hook;
+
+		for (hook = 0; hook < MULTICORN_NUM_HOOKS; hook++)
+		{
+			calls += stats->counters.calls[hook];
+		}
+		if (victim == NULL || calls < victim_calls)
+		{
+			victim = stats;
+			victim_calls = calls;
+		}
+	}
+	if (victim != NULL)
+	{
+		hash_search(statsHash, &victim->key, HASH_REMOVE, NULL);
+	}
+}
+
+/*
+ * Returns the statistics of a foreign table of the current database,
+ * creating them if needed, or NULL if they are not tracked.
+ *
+ * Unless NULL is returned, the lock of the hash table is held, and must be
+ * released by the caller once the counters are updated.
+ */
+static MulticornTableStats *
+lockTableStats(Oid relid)
+{
+	MulticornTableStatsKey key;
+	MulticornTableStats *stats;
+
+	if (statsHash == NULL || !trackStats || !OidIsValid(relid))
+	{
+		return NULL;
+	}
+	key.dbid = MyDatabaseId;
+	key.relid = relid;
+	LWLockAcquire(statsShared->lock, LW_SHARED);
+	stats = hash_search(statsHash, &key, HASH_FIND, NULL);
+	if (stats != NULL)
+	{
+		return stats;
+	}
+	LWLockRelease(statsShared->lock);
+	LWLockAcquire(statsShared->lock, LW_EXCLUSIVE);
+	stats = hash_search(statsHash, &key, HASH_FIND, NULL);
+	if (stats == NULL)
+	{
+		/* Once every entry is used, the least called table is dropped. */
+		if (hash_get_num_entries(statsHash) >= statsMaxTables)
+		{
+			evictTableStats();
+		}
+		stats = hash_search(statsHash, &key, HASH_ENTER_NULL, NULL);
+		if (stats == NULL)
+		{
+			LWLockRelease(statsShared->lock);
+			return NULL;
+		}
+		SpinLockInit(&stats->mutex);
+		MemSet(&stats->counters, 0, sizeof(MulticornTableCounters));
+	}
+	return stats;
+}
+#endif
+
+/*
+ * Returns true if the statistics of the foreign tables are gathered.
+ */
+bool
+trackTableStats(void)
+{
+#if PG_VERSION_NUM >= 90600
+	return statsHash != NULL && trackStats;
+#else
+	return false;
+#endif
+}
+
+/*
+ * Count the python errors from now on for the given foreign table.
+ */
+void
+setCurrentTableStats(Oid relid)
+{
+#if PG_VERSION_NUM >= 90600
+	currentRelid = relid;
+#endif
+}
+
+/*
+ * Start measuring a call to a python hook of a foreign table.
+ */
+void
+startTableHook(Oid relid, instr_time *start)
+{
+	INSTR_TIME_SET_ZERO(*start);
+	if (trackTableStats())
+	{
+		setCurrentTableStats(relid);
+		INSTR_TIME_SET_CURRENT(*start);
+	}
+}
+
+/*
+ * Count a call to a python hook of a foreign table, started by
+ * startTableHook.
+ */
+void
+endTableHook(Oid relid, MulticornHook hook, instr_time *start)
+{
+	instr_time	elapsed;
+
+	if (INSTR_TIME_IS_ZERO(*start))
+	{
+		return;
+	}
+	INSTR_TIME_SET_CURRENT(elapsed);
+	INSTR_TIME_SUBTRACT(elapsed, *start);
+	countTableHook(relid, hook, 1, &elapsed);
+}
+
+/*
+ * Count calls to a python hook of a foreign table, and the time they took.
+ */
+void
+countTableHook(Oid relid, MulticornHook hook, int64 calls, instr_time *elapsed)
+{
+#if PG_VERSION_NUM >= 90600
+	MulticornTableStats *stats = lockTableStats(relid);
+	double		elapsed_ms = INSTR_TIME_GET_MILLISEC(*elapsed);
+
+	if (stats == NULL)
+	{
+		return;
+	}
+	SpinLockAcquire(&stats->mutex);
+	stats->counters.calls[hook] += calls;
+	stats->counters.total_time[hook] += elapsed_ms;
+	if (elapsed_ms > stats->counters.max_time[hook])
+	{
+		stats->counters.max_time[hook] = elapsed_ms;
+	}
+	SpinLockRelease(&stats->mutex);
+	LWLockRelease(statsShared->lock);
+#endif
+}
+
+/*
+ * Count the rows returned by the scans of a foreign table.
+ */
+void
+countTableRows(Oid relid, int64 rows)
+{
+#if PG_VERSION_NUM >= 90600
+	MulticornTableStats *stats = lockTableStats(relid);
+
+	if (stats == NULL)
+	{
+		return;
+	}
+	SpinLockAcquire(&stats->mutex);
+	stats->counters.rows += rows;
+	SpinLockRelease(&stats->mutex);
+	LWLockRelease(statsShared->lock);
+#endif
+}
+
+/*
+ * Count the creation of a python instance for a foreign table. The errors
+ * raised from then on are counted for it.
+ */
+void
+countTableInstance(Oid relid)
+{
+#if PG_VERSION_NUM >= 90600
+	MulticornTableStats *stats;
+
+	currentRelid = relid;
+	stats = lockTableStats(relid);
+	if (stats == NULL)
+	{
+		return;
+	}
+	SpinLockAcquire(&stats->mutex);
+	stats->counters.instances++;
+	SpinLockRelease(&stats->mutex);
+	LWLockRelease(statsShared->lock);
+#endif
+}
+
+/*
+ * Count a python error, for the foreign table whose hook was called last.
+ */
+void
+countTableError(void)
+{
+#if PG_VERSION_NUM >= 90600
+	MulticornTableStats *stats = lockTableStats(currentRelid);
+
+	if (stats == NULL)
+	{
+		return;
+	}
+	SpinLockAcquire(&stats->mutex);
+	stats->counters.errors++;
+	SpinLockRelease(&stats->mutex);
+	LWLockRelease(statsShared->lock);
+#endif
+}
+
+static void
+checkTableStats(void)
+{
+#if PG_VERSION_NUM >= 90600
+	if (statsHash == NULL)
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_OBJECT_NOT_IN_PREREQUISITE_STATE),
+				 errmsg("multicorn must be loaded via shared_preload_libraries")));
+	}
+#else
+	ereport(ERROR,
+			(errcode(ERRCODE_FEATURE_NOT_SUPPORTED),
+			 errmsg("the statistics of the foreign tables require PostgreSQL 9.6 or later")));
+#endif
+}
+
+/*
+ * Return the statistics of every foreign table, one row per table.
+ */
+Datum
+multicorn_stat_foreign_tables(PG_FUNCTION_ARGS)
+{
+	ReturnSetInfo *rsinfo = (ReturnSetInfo *) fcinfo->resultinfo;
+	TupleDesc	tupdesc;
+	Tuplestorestate *tupstore;
+	MemoryContext oldcontext;
+
+	checkTableStats();
+	if (rsinfo == NULL || !IsA(rsinfo, ReturnSetInfo))
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_FEATURE_NOT_SUPPORTED),
+				 errmsg("set-valued function called in context that cannot accept a set")));
+	}
+	if (!(rsinfo->allowedModes & SFRM_Materialize))
+	{
+		ereport(ERROR,
+				(errcode(ERRCODE_FEATURE_NOT_SUPPORTED),
+				 errmsg("materialize mode required, but it is not allowed in this context")));
+	}
+	if (get_call_result_type(fcinfo, NULL, &tupdesc) != TYPEFUNC_COMPOSITE)
+	{
+		elog(ERROR, "return type must be a row type");
+	}
+	if (tupdesc->natts != MULTICORN_STAT_COLS)
+	{
+		elog(ERROR, "incorrect number of output arguments");
+	}
+	oldcontext = MemoryContextSwitchTo(rsinfo->econtext->ecxt_per_query_memory);
+	tupstore = tuplestore_begin_heap(true, false, work_mem);
+	rsinfo->returnMode = SFRM_Materialize;
+	rsinfo->setResult = tupstore;
+	rsinfo->setDesc = tupdesc;
+	MemoryContextSwitchTo(oldcontext);
+#if PG_VERSION_NUM >= 90600
+	{
+		HASH_SEQ_STATUS status;
+		MulticornTableStats *stats;
+
+		LWLockAcquire(statsShared->lock, LW_SHARED);
+		hash_seq_init(&status, statsHash);
+		while ((stats = hash_seq_search(&status)) != NULL)
+		{
+			Datum		values[MULTICORN_STAT_COLS];
+			bool		nulls[MULTICORN_STAT_COLS];
+			MulticornTableCounters counters;
+			int			i = 0,
+						hook;
+
+			SpinLockAcquire(&stats->mutex);
+			counters = stats->counters;
+			SpinLockRelease(&stats->mutex);
+			MemSet(nulls, 0, sizeof(nulls));
+			values[i++] = ObjectIdGetDatum(stats->key.dbid);
+			values[i++] = ObjectIdGetDatum(stats->key.relid);
+			for (hook = 0; hook < MULTICORN_NUM_HOOKS; hook++)
+			{
+				values[i++] = Int64GetDatum(counters.calls[hook]);
+				values[i++] = Float8GetDatum(counters.total_time[hook]);
+				values[i++] = Float8GetDatum(counters.max_time[hook]);
+			}
+			values[i++] = Int64GetDatum(counters.rows);
+			values[i++] = Int64GetDatum(counters.instances);
+			values[i++] = Int64GetDatum(counters.errors);
+			tuplestore_putvalues(tupstore, tupdesc, values, nulls);
+		}
+		LWLockRelease(statsShared->lock);
+	}
+#endif
+	return (Datum) 0;
+}
+
+/*
+ * Reset the statistics of every foreign table, by removing them.
+ */
+Datum
+multicorn_stat_reset(PG_FUNCTION_ARGS)
+{
+	checkTableStats();
+#if PG_VERSION_NUM >= 90600
+	{
+		HASH_SEQ_STATUS status;
+		MulticornTableStats *stats;
+
+		LWLockAcquire(statsShared->lock, LW_EXCLUSIVE);
+		hash_seq_init(&status, statsHash);
+		while ((stats = hash_seq_search(&status)) != NULL)
+		{
+			hash_search(statsHash, &stats->key, HASH_REMOVE, NULL);
+		}
+		LWLockRelease(statsShared->lock);
+	}
+#endif
+	PG_RETURN_VOID();
+}
@@ -59,5 +59,12 @@ ALTER foreign table testmulticorn rename test1 to testnew;
 
 select * from testmulticorn limit 1;
 
+-- Test changing the server and user mapping options
+ALTER server multicorn_srv options (ADD option3 'option3');
+select * from testmulticorn limit 1;
+
+ALTER user mapping FOR current_user server multicorn_srv options (SET usermapping 'test2');
+select * from testmulticorn limit 1;
+
 DROP USER MAPPING FOR current_user SERVER multicorn_srv;
 DROP EXTENSION multicorn cascade;
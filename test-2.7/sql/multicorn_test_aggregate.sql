@@ -0,0 +1,37 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    aggregate 'true'
+);
+
+-- The aggregates are computed by execute_aggregate
+EXPLAIN (COSTS OFF) select count(*), sum(test2), min(test1), max(test1), avg(test2) from testmulticorn;
+
+select count(*), sum(test2), min(test1), max(test1), avg(test2) from testmulticorn;
+
+select test1, count(*), sum(test2) from testmulticorn where test1 < 3 group by test1 order by test1;
+
+select sum(test2) + 1 from testmulticorn where test1 >= 10;
+
+-- Otherwise, the rows are aggregated by PostgreSQL
+select count(distinct test1) from testmulticorn;
+
+-- Or when the fdw cannot apply a qual comparing a column to a parameter
+CREATE FUNCTION count_matching(integer[]) RETURNS bigint LANGUAGE sql AS $$
+    SELECT count(*) FROM testmulticorn WHERE test1 = ANY($1)
+$$;
+select count_matching(ARRAY[1, 2]);
+
+DROP FUNCTION count_matching(integer[]);
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,23 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int'
+);
+
+-- The rows are sampled by the default analyze method, through execute
+ANALYZE testmulticorn;
+
+select reltuples from pg_class where relname = 'testmulticorn';
+
+select attname, null_frac, n_distinct from pg_stats where tablename = 'testmulticorn' order by attname;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,25 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 double precision,
+    test3 text
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'columnar'
+);
+
+-- Test "normal" usage
+select * from testmulticorn;
+
+-- Test quals and projections
+select test2, test3 from testmulticorn where test1 > 15;
+
+select test1 from testmulticorn where test3 is null;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,32 @@
+SET client_min_messages=WARNING;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+
+CREATE foreign table testmulticorn (
+    test1 text,
+    test2 character varying
+) server multicorn_srv options (
+    test_type 'encoding',
+    test_subtype 'nul'
+);
+
+-- Strings holding a NUL character are rejected
+DO $$
+BEGIN
+    PERFORM * FROM testmulticorn;
+EXCEPTION WHEN character_not_in_repertoire THEN
+    RAISE WARNING 'rejected: %', SQLSTATE;
+END $$;
+
+-- Bytes are checked against the server encoding
+ALTER foreign table testmulticorn options (SET test_subtype 'bytes');
+DO $$
+BEGIN
+    PERFORM * FROM testmulticorn;
+EXCEPTION WHEN character_not_in_repertoire THEN
+    RAISE WARNING 'rejected: %', SQLSTATE;
+END $$;
+
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,23 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    enforce_quals 'true'
+);
+
+-- Only the clauses not enforced by the fdw are filtered by PostgreSQL
+explain (costs off) select * from testmulticorn where test1 < 5 and test2 % 2 = 1;
+
+select * from testmulticorn where test1 < 5 and test2 % 2 = 1;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
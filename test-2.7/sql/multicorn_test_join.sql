@@ -0,0 +1,42 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    join 'true'
+);
+
+CREATE foreign table testmulticorn2 (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    join 'true'
+);
+
+-- The join is computed by execute_join
+EXPLAIN (COSTS OFF) select t1.test1, t2.test2 from testmulticorn t1 join testmulticorn2 t2 on t1.test1 = t2.test1 where t1.test1 < 3;
+
+select t1.test1, t2.test2 from testmulticorn t1 join testmulticorn2 t2 on t1.test1 = t2.test1 where t1.test1 < 3 order by t1.test1;
+
+select t1.test1, t2.test2 from testmulticorn t1 left join testmulticorn2 t2 on t1.test1 = t2.test2 and t2.test2 < 2 where t1.test1 < 3 order by t1.test1;
+
+-- Unless the fdw cannot apply a qual comparing a column to a parameter
+CREATE FUNCTION join_matching(integer[]) RETURNS bigint LANGUAGE sql AS $$
+    SELECT count(*) FROM testmulticorn t1 JOIN testmulticorn2 t2 ON t1.test1 = t2.test1 WHERE t1.test1 = ANY($1)
+$$;
+SET client_min_messages = WARNING;
+select join_matching(ARRAY[1, 2]);
+RESET client_min_messages;
+DROP FUNCTION join_matching(integer[]);
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
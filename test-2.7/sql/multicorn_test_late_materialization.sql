@@ -0,0 +1,24 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    late_materialization 'true'
+);
+
+-- test2 is only computed for the rows matching the WHERE clause
+select * from testmulticorn where test1 < 3;
+
+-- and for every row when the clause uses it
+select test1 from testmulticorn where test2 >= 18;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,40 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    limit 'true'
+);
+
+-- The LIMIT and OFFSET are applied by execute
+EXPLAIN (COSTS OFF) select * from testmulticorn limit 3 offset 2;
+
+select * from testmulticorn limit 3 offset 2;
+
+select test1 from testmulticorn where test1 > 5 order by test1 desc limit 2;
+
+select * from testmulticorn offset 18;
+
+-- Otherwise, they are applied by PostgreSQL
+select * from testmulticorn where test1 + 1 > 5 limit 2;
+
+-- Or when the fdw cannot apply a qual comparing a column to a parameter
+CREATE FUNCTION second_matching(integer[]) RETURNS integer LANGUAGE sql AS $$
+    SELECT test1 FROM testmulticorn WHERE test1 = ANY($1) LIMIT 1 OFFSET 1
+$$;
+select second_matching(ARRAY[1, 2]);
+
+-- A qual comparing a column to a NULL parameter matches no row
+select second_matching(NULL);
+
+DROP FUNCTION second_matching(integer[]);
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,41 @@
+SET client_min_messages=NOTICE;
+\i test-common/disable_jit.include
+-- Memoize nodes would cache the lookups above the foreign scan
+DO $$
+BEGIN
+  IF current_setting('server_version_num')::bigint >= 140000 THEN
+    SET enable_memoize = off;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    cache_lookups 'true'
+);
+
+CREATE TABLE lookups (value integer);
+INSERT INTO lookups VALUES (1), (2), (1), (3), (2), (1);
+
+-- Each value is only looked up once
+select l.value, m.test2 from lookups l inner join testmulticorn m on m.test1 = l.value;
+
+-- The lookups are not kept from one scan to the next
+select l.value, m.test2 from lookups l inner join testmulticorn m on m.test1 = l.value where l.value > 2;
+
+-- Only the most recently used values are kept
+ALTER FOREIGN TABLE testmulticorn OPTIONS (ADD lookup_cache_size '2');
+select l.value, m.test2 from lookups l inner join testmulticorn m on m.test1 = l.value;
+
+DROP TABLE lookups;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
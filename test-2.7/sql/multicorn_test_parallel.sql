@@ -0,0 +1,36 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    parallel_workers '2'
+);
+
+-- Without a Gather node, the whole table is scanned by the backend
+select count(*) from testmulticorn;
+
+-- The workers log their own messages, in no particular order
+SET client_min_messages=WARNING;
+SET parallel_setup_cost=0;
+SET parallel_tuple_cost=0;
+SET max_parallel_workers_per_gather=2;
+
+EXPLAIN (COSTS OFF) select test1, test2 from testmulticorn;
+
+select test1, test2 from testmulticorn order by test1;
+
+select count(*), sum(test2) from testmulticorn;
+
+RESET max_parallel_workers_per_gather;
+RESET parallel_tuple_cost;
+RESET parallel_setup_cost;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
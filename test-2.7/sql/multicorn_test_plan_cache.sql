@@ -0,0 +1,24 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    plan_cache_ttl '3600'
+);
+
+-- get_rel_size is called once for each shape of quals
+select * from testmulticorn where test1 = 1;
+
+select * from testmulticorn where test1 = 2;
+
+select * from testmulticorn where test1 > 17;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
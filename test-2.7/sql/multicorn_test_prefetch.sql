@@ -0,0 +1,41 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    prefetch_rows '4'
+);
+
+-- The rows are read from a background thread
+select * from testmulticorn;
+
+select test1 from testmulticorn where test1 > 15;
+
+select count(*), sum(test2) from testmulticorn;
+
+-- The messages logged by the background thread are emitted by the backend
+ALTER foreign table testmulticorn options (ADD log_at '5');
+
+select sum(test1) from testmulticorn;
+
+ALTER foreign table testmulticorn options (DROP log_at, ADD error_at '5');
+
+select sum(test1) from testmulticorn;
+
+ALTER foreign table testmulticorn options (DROP error_at);
+
+-- Only a positive number of rows can be prefetched
+ALTER foreign table testmulticorn options (SET prefetch_rows '0');
+
+ALTER foreign table testmulticorn options (SET prefetch_rows 'all');
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,29 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    structured_quals 'true'
+);
+
+select * from testmulticorn where test1 = 1 or test2 = 3;
+
+select * from testmulticorn where test1 <= test2 and test2 < 2;
+
+select * from testmulticorn where test1 % 5 = 0 or test1 is null;
+
+select * from testmulticorn where not (test1 is distinct from 4);
+
+-- Volatile clauses are left out
+select * from testmulticorn where test1 < 2 and random() >= 0;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,42 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    scan_stats 'true'
+);
+
+-- Only keep the lines of the statistics, the times being left out
+CREATE FUNCTION explain_stats(query text) RETURNS SETOF text AS $$
+DECLARE
+    line text;
+BEGIN
+    FOR line IN EXECUTE 'EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF) ' || query LOOP
+        IF line ~ '^\s*Multicorn ' THEN
+            RETURN NEXT btrim(line);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+-- Leave out the context of the notices raised from the function
+\set VERBOSITY terse
+
+select explain_stats('select * from testmulticorn');
+
+-- The rows are counted before the WHERE clause, and only the needed columns
+select explain_stats('select test1 from testmulticorn where test1 < 5');
+
+select explain_stats('insert into testmulticorn values (1, 2)');
+
+\set VERBOSITY default
+DROP FUNCTION explain_stats(text);
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
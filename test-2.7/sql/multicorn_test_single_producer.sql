@@ -0,0 +1,41 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int',
+    parallel_workers '2',
+    single_producer 'true'
+);
+
+-- The workers log their own messages, in no particular order
+SET client_min_messages=WARNING;
+SET parallel_setup_cost=0;
+SET parallel_tuple_cost=0;
+SET max_parallel_workers_per_gather=2;
+
+-- A single backend runs the python code, and hands out the rows
+EXPLAIN (COSTS OFF) select test1, test2 from testmulticorn;
+
+select test1, test2 from testmulticorn order by test1;
+
+select count(*), sum(test2) from testmulticorn;
+
+-- The leader stops before the end of the rows, and releases the workers
+-- still waiting for one
+EXPLAIN (COSTS OFF) select count(*) from (select test1 from testmulticorn limit 1) t;
+
+select count(*) from (select test1 from testmulticorn limit 1) t;
+
+RESET max_parallel_workers_per_gather;
+RESET parallel_tuple_cost;
+RESET parallel_setup_cost;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
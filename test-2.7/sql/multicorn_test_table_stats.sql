@@ -0,0 +1,47 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'int'
+);
+
+SELECT multicorn_stat_reset();
+
+select * from testmulticorn where test1 < 2;
+
+select test1 from testmulticorn where test1 = 5;
+
+-- Each scan counts a call to execute, and the rows it returned
+SELECT get_rel_size_calls, execute_calls, rows, instances, errors
+FROM multicorn_stat_foreign_tables()
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+AND foreigntableid = 'testmulticorn'::regclass;
+
+-- Unless the tracking is turned off
+SET multicorn.track_stats = off;
+
+select * from testmulticorn where test1 < 2;
+
+SELECT get_rel_size_calls, execute_calls, rows, instances, errors
+FROM multicorn_stat_foreign_tables()
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+AND foreigntableid = 'testmulticorn'::regclass;
+
+-- A reset removes the statistics of every table
+SELECT multicorn_stat_reset();
+
+SELECT count(*)
+FROM multicorn_stat_foreign_tables()
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+AND foreigntableid = 'testmulticorn'::regclass;
+
+RESET multicorn.track_stats;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,36 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    num numeric,
+    ts timestamptz,
+    jsb jsonb,
+    id uuid,
+    big bigint,
+    dbl float8,
+    flag boolean
+) server multicorn_srv options (
+    test_type 'types'
+);
+
+-- The values of the quals are converted to native python types
+select num from testmulticorn where num = 1.10;
+
+select ts from testmulticorn where ts = '2020-01-01 12:00:00+02';
+
+select jsb from testmulticorn where jsb @> '{"a": [1, 2]}';
+
+select id from testmulticorn where id = 'a0eebc99-9c0b-4ef8-bb6d-6bb9bd380a11';
+
+select big from testmulticorn where big = 10000000000;
+
+select dbl from testmulticorn where dbl = 0.5;
+
+select flag from testmulticorn where flag in (true, false);
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,44 @@
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    row_id_column 'test1',
+    direct_modify 'true'
+);
+
+-- The whole statement is handed to update_where / delete_where
+EXPLAIN (COSTS OFF) update testmulticorn set test2 = 'test' where test1 = 'test1 1 0';
+
+update testmulticorn set test2 = 'test' where test1 = 'test1 1 0';
+
+update testmulticorn set test1 = 'test', test2 = NULL;
+
+delete from testmulticorn where test2 = 'test2 2 0';
+
+-- A NULL parameter matches no row, and python is not called
+CREATE FUNCTION delete_matching(varchar) RETURNS void AS $$
+    delete from testmulticorn where test1 = $1
+$$ LANGUAGE sql;
+
+select delete_matching('test1 1 0');
+
+select delete_matching(NULL);
+
+DROP FUNCTION delete_matching(varchar);
+
+-- Otherwise, the rows are fetched and modified one at a time
+update testmulticorn set test2 = test1 where test1 = 'test1 1 0';
+
+delete from testmulticorn where test1 || test2 = 'test';
+
+delete from testmulticorn where test1 = 'test1 1 0' returning test2;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
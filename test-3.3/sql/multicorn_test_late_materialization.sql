@@ -0,0 +1 @@
+../../test-2.7/sql/multicorn_test_late_materialization.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../../test-2.7/sql/multicorn_test_lookups.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../../test-2.7/sql/write_direct_modify.sql
\ No newline at end of file